@@ -0,0 +1,77 @@
+"""
+benchmarks/unpack.py - time source archive extraction on a synthetic archive
+
+Builds a tar.gz and a zip with many small members, laid out like a source repo,
+and times extracting each with builder.package_build.extract. Run from tools/:
+
+    python -m benchmarks.unpack --members 50000
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+from pathlib import Path
+import tarfile
+import tempfile
+import time
+import zipfile
+from typing import Callable
+
+from builder.package_build.extract import extract_tar, extract_zip
+
+
+def _members(count: int) -> list[tuple[str, bytes]]:
+    return [
+        (
+            f"pkg-1.0/src/module{index // 500}/sub{index % 25}/file{index}.py",
+            (f"value_{index} = {index}\n" * (1 + index % 40)).encode(),
+        )
+        for index in range(count)
+    ]
+
+
+def make_tar(path: Path, members: list[tuple[str, bytes]]) -> Path:
+    with tarfile.open(path, "w:gz", compresslevel=1) as tf:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tf.addfile(info, BytesIO(data))
+    return path
+
+
+def make_zip(path: Path, members: list[tuple[str, bytes]]) -> Path:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return path
+
+
+def _time(label: str, count: int, func: Callable[[], Path]) -> None:
+    began = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - began
+    print(f"{label}: {elapsed:.2f}s ({count / elapsed:.0f} members/s)")
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=50000)
+    args = parser.parse_args()
+    members = _members(args.members)
+    with tempfile.TemporaryDirectory() as tempdir:
+        root = Path(tempdir)
+        tar = make_tar(root / "pkg.tar.gz", members)
+        zip_ = make_zip(root / "pkg.zip", members)
+        _time(
+            "tar",
+            args.members,
+            lambda: extract_tar(root / "tar-out", tar, Path(".")),
+        )
+        _time(
+            "zip",
+            args.members,
+            lambda: extract_zip(root / "zip-out", zip_, Path(".")),
+        )
+
+
+if __name__ == "__main__":
+    main()
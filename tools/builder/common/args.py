@@ -4,7 +4,40 @@ import sys
 import argparse
 
 
+#: What each command other than build can do
+COMMAND_ACTIONS = {
+    "wheelhouse": ["populate", "prune"],
+    "cache": ["stats", "prune", "clear"],
+}
+
+
 def add_common_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["build"] + list(COMMAND_ACTIONS),
+        default="build",
+        help=(
+            "build: build the packages and the index. wheelhouse: manage the "
+            "wheelhouse of build dependencies in the cache root. cache: inspect or "
+            "trim the caches, on the host. default: build"
+        ),
+    )
+    parser.add_argument(
+        "action",
+        nargs="?",
+        choices=sorted(
+            {action for actions in COMMAND_ACTIONS.values() for action in actions}
+        ),
+        metavar="ACTION",
+        help=(
+            "For wheelhouse, populate: download everything the packages' "
+            "build-dependencies.lock files pin; prune: remove what they no longer "
+            "pin. For cache, stats: show each cache's size and hit rate; prune: "
+            "evict the least recently used entries down to --cache-budget-mb; "
+            "clear: remove them all"
+        ),
+    )
     parser.add_argument(
         "--output",
         "-o",
@@ -65,6 +98,45 @@ def add_common_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         default="http://localhost",
         help="URL of the root of the index to write in URLs",
     )
+    parser.add_argument(
+        "--index-link-mode",
+        action="store",
+        choices=["copy", "hardlink", "reflink", "symlink"],
+        default="copy",
+        help=(
+            "How to put distributions from the dist tree in the index. Anything "
+            "but copy falls back to copying when a link can't be made. hardlink "
+            "and symlink share the file with the dist tree, so a wheel rebuilt in "
+            "place changes what the index serves before its hash on the index "
+            "pages is updated. default: copy"
+        ),
+    )
+    parser.add_argument(
+        "--cache-root",
+        action="store",
+        default="./cache",
+        help="Location for caches shared between builds and runs",
+    )
+    parser.add_argument(
+        "--download-cache-mb",
+        action="store",
+        type=int,
+        default=10240,
+        help=(
+            "How large the source download cache may get, in MB, before the least "
+            "recently used archives are evicted. default: 10240"
+        ),
+    )
+    parser.add_argument(
+        "--cache-budget-mb",
+        action="store",
+        type=int,
+        default=20480,
+        help=(
+            "How large cache prune lets all the caches together get, in MB. "
+            "default: 20480"
+        ),
+    )
     parser.add_argument(
         "--build-type",
         action="store",
@@ -72,5 +144,72 @@ def add_common_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
         default="both",
         help="Just build packages; just build index from previous package build; do both",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "How many packages to build at the same time. Each parallel package "
+            "build logs to build.log in its build directory. default: 1"
+        ),
+    )
+    parser.add_argument(
+        "--sdk-environment",
+        action="store",
+        choices=["snapshot", "subshell"],
+        default="subshell",
+        help=(
+            "How to run commands with the buildroot SDK active. snapshot: source the "
+            "SDK once, save the changes it makes to the environment, and run commands "
+            "directly with them. subshell: source the SDK in an interactive shell for "
+            "each package and run commands through it. default: subshell"
+        ),
+    )
+    parser.add_argument(
+        "--trace-out",
+        action="store",
+        default=None,
+        help=(
+            "Where to write a Chrome trace-event timeline of the package build, for "
+            "viewing in Perfetto or chrome://tracing. A JSON timing report is always "
+            "written to build-report.json in the build tree root."
+        ),
+    )
+    parser.add_argument(
+        "--force-rebuild",
+        action="store_true",
+        help=(
+            "Build every package even if its dist directory already has a wheel "
+            "built from the same build.py, source, dependencies, tools and SDK"
+        ),
+    )
+    parser.add_argument(
+        "--refresh-locks",
+        action="store_true",
+        help=(
+            "Resolve each package's build dependencies again and rewrite the "
+            "build-dependencies.lock next to its build.py, instead of installing "
+            "exactly what the lock pins. Packages are rebuilt with the new locks."
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help=(
+            "Install build dependencies only from the wheelhouse in the cache root, "
+            "never from PyPI. Populate it first with the wheelhouse command."
+        ),
+    )
 
     return parser
+
+
+def check_command(parser: argparse.ArgumentParser, parsed: argparse.Namespace) -> None:
+    """Make sure the command and its action go together, exiting if they don't."""
+    actions = COMMAND_ACTIONS.get(parsed.command, [])
+    if actions and parsed.action not in actions:
+        parser.error(f"{parsed.command} needs one of {', '.join(actions)}")
+    if not actions and parsed.action:
+        parser.error(f"{parsed.action} is not an action of {parsed.command}")
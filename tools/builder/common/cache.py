@@ -0,0 +1,152 @@
+"""builder.common.cache: primitives for the on-disk build caches"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+
+def path_size(path: Path) -> int:
+    """The total size in bytes of a file or a directory tree."""
+    try:
+        if not path.is_dir() or path.is_symlink():
+            return path.lstat().st_size
+    except OSError:
+        return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def touch(path: Path) -> None:
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def remove(path: Path) -> None:
+    """Remove a cache entry, whether it is a file or a directory."""
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def atomic_path(final_path: Path) -> Iterator[Path]:
+    """
+    Provide a temporary path next to final_path to write a file to. When the
+    context exits cleanly, the file is moved to final_path in one step, so
+    concurrent readers see either the whole file or nothing; if it raises, the
+    temporary file is removed.
+    """
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_name = tempfile.mkstemp(
+        dir=final_path.parent, prefix=f".{final_path.name}.", suffix=".tmp"
+    )
+    os.close(handle)
+    temp_path = Path(temp_name)
+    try:
+        yield temp_path
+        os.replace(temp_path, final_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def link_or_copy(source: Path, dest: Path) -> Path:
+    """
+    Make dest have the contents of source, as a hardlink if the filesystem
+    allows it and as a copy if it doesn't.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists() or dest.is_symlink():
+        dest.unlink()
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+    return dest
+
+
+def evict_lru(
+    entries_dir: Path, max_bytes: int, keep: Tuple[Path, ...] = ()
+) -> List[Path]:
+    """
+    Remove the least recently used entries in entries_dir until its contents fit
+    in max_bytes. Entries are the direct children of entries_dir, files or
+    directories, and their last use is their mtime (see touch()). Anything in keep
+    is never evicted. Returns the evicted entries.
+    """
+    try:
+        entries = [entry for entry in entries_dir.iterdir() if entry not in keep]
+    except FileNotFoundError:
+        return []
+    sized: List[Tuple[float, int, Path]] = []
+    for entry in entries:
+        try:
+            used = entry.lstat().st_mtime
+        except OSError:
+            continue
+        sized.append((used, path_size(entry), entry))
+    total = sum(size for _, size, _ in sized) + sum(path_size(path) for path in keep)
+    evicted: List[Path] = []
+    for _, size, entry in sorted(sized, key=lambda item: item[0]):
+        if total <= max_bytes:
+            break
+        remove(entry)
+        total -= size
+        evicted.append(entry)
+    return evicted
+
+
+#: Where a cache keeps count of how many lookups in it hit and missed
+LOOKUPS_NAME = ".lookups.json"
+
+_lookups_lock = threading.Lock()
+
+
+def read_lookups(cache_dir: Path) -> Tuple[int, int]:
+    """How many lookups in a cache hit and how many missed."""
+    try:
+        with open(cache_dir / LOOKUPS_NAME) as lookups_file:
+            lookups = json.load(lookups_file)
+        return int(lookups["hits"]), int(lookups["misses"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0, 0
+
+
+def record_lookups(cache_dir: Path, hits: int = 0, misses: int = 0) -> None:
+    """
+    Add to the hit and miss counts of a cache. The counts are only for reporting,
+    so builders in other processes updating them at the same time can lose a few;
+    the file itself is always whole.
+    """
+    with _lookups_lock:
+        previous_hits, previous_misses = read_lookups(cache_dir)
+        try:
+            with atomic_path(cache_dir / LOOKUPS_NAME) as temp_path:
+                temp_path.write_text(
+                    json.dumps(
+                        {
+                            "hits": previous_hits + hits,
+                            "misses": previous_misses + misses,
+                        }
+                    )
+                )
+        except OSError:
+            pass
@@ -0,0 +1,159 @@
+"""builder.common.cache_areas: report on, prune and clear all the build caches"""
+import io
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from .cache import LOOKUPS_NAME, path_size, read_lookups, remove
+
+
+class CacheArea(NamedTuple):
+    name: str
+    #: The cache's directory under the cache root
+    entries: Optional[str]
+    #: The directory in that whose children are evicted whole (e.g. a venv), or
+    #: None to evict its files one at a time
+    description: str
+
+
+CACHE_AREAS = [
+    CacheArea("downloads", "blobs", "source archives"),
+    CacheArea("venvs", "entries", "build venvs"),
+    CacheArea("sdk-env", ".", "captured SDK environments"),
+    CacheArea("ccache", None, "compiled objects"),
+    CacheArea("wheelhouse", ".", "build dependency distributions"),
+    CacheArea("pip", None, "pip's http and wheel cache"),
+]
+
+#: Files that caches need to keep, whose loss would only reset their counters
+_KEEP_NAMES = frozenset({LOOKUPS_NAME, "ccache.conf", "stats"})
+
+#: (last used, size, path) of something that can be evicted
+Entry = Tuple[float, int, Path]
+
+
+class CacheStats(NamedTuple):
+    area: CacheArea
+    size: int
+    entries: int
+    hits: int
+    misses: int
+
+    def hit_rate(self) -> Optional[float]:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+
+def _files(directory: Path) -> List[Entry]:
+    entries: List[Entry] = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename in _KEEP_NAMES:
+                continue
+            path = Path(dirpath) / filename
+            try:
+                stat = path.lstat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _children(directory: Path) -> List[Entry]:
+    try:
+        children = list(directory.iterdir())
+    except OSError:
+        return []
+    entries: List[Entry] = []
+    for child in children:
+        # dotfiles are counters and work in progress
+        if child.name.startswith("."):
+            continue
+        try:
+            used = child.lstat().st_mtime
+        except OSError:
+            continue
+        entries.append((used, path_size(child), child))
+    return entries
+
+
+def cache_entries(cache_root: Path, area: CacheArea) -> List[Entry]:
+    """The things in a cache that can be evicted, one at a time."""
+    directory = cache_root / area.name
+    if area.entries is None:
+        return _files(directory)
+    return _children(directory / area.entries)
+
+
+def cache_stats(cache_root: Path) -> List[CacheStats]:
+    """The size, number of entries and lookup counts of each cache."""
+    stats = []
+    for area in CACHE_AREAS:
+        hits, misses = read_lookups(cache_root / area.name)
+        stats.append(
+            CacheStats(
+                area,
+                path_size(cache_root / area.name),
+                len(cache_entries(cache_root, area)),
+                hits,
+                misses,
+            )
+        )
+    return stats
+
+
+def prune(cache_root: Path, max_bytes: int) -> List[Path]:
+    """
+    Evict the least recently used entries of all the caches together until they
+    fit in max_bytes. Returns what was evicted.
+    """
+    total = sum(path_size(cache_root / area.name) for area in CACHE_AREAS)
+    entries: List[Entry] = []
+    for area in CACHE_AREAS:
+        entries.extend(cache_entries(cache_root, area))
+    evicted: List[Path] = []
+    for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        remove(path)
+        total -= size
+        evicted.append(path)
+    return evicted
+
+
+def clear(cache_root: Path) -> int:
+    """Remove every cache entirely. Returns how many bytes that freed."""
+    freed = 0
+    for area in CACHE_AREAS:
+        freed += path_size(cache_root / area.name)
+        remove(cache_root / area.name)
+    return freed
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+def format_stats(stats: List[CacheStats]) -> str:
+    lines = [f"{'cache':<12}{'size':>12}{'entries':>10}{'hit rate':>10}  contents"]
+    for stat in stats:
+        rate = stat.hit_rate()
+        lines.append(
+            f"{stat.area.name:<12}{_megabytes(stat.size):>12}{stat.entries:>10}"
+            f"{'-' if rate is None else f'{rate:.0%}':>10}  {stat.area.description}"
+        )
+    lines.append(f"{'total':<12}{_megabytes(sum(stat.size for stat in stats)):>12}")
+    return "\n".join(lines)
+
+
+def run_cache_command(
+    action: str, cache_root: Path, budget_mb: int, output: io.TextIOBase
+) -> None:
+    """Run build-packages cache stats, prune or clear."""
+    print(f"Caches in {cache_root}", file=output)
+    if action == "prune":
+        evicted = prune(cache_root, budget_mb * 1024 * 1024)
+        print(f"Evicted {len(evicted)} entries to fit in {budget_mb}MB", file=output)
+    elif action == "clear":
+        print(f"Cleared {_megabytes(clear(cache_root))}", file=output)
+    print(format_stats(cache_stats(cache_root)), file=output)
@@ -1,9 +1,19 @@
 """builder.common.shellcommand: utilities for nicer shell processing"""
 
-import subprocess
+import codecs
 import io
+import os
+import selectors
+import subprocess
 import time
-from typing import List, Optional
+from collections import deque
+from typing import Callable, IO, Iterable, Iterator, List, Mapping, Optional, Union
+
+#: Something that consumes a command's output one line at a time. Lines keep
+#: their line endings, except possibly the last line of the output.
+Sink = Callable[[str], None]
+
+_READ_SIZE = 65536
 
 
 class ShellCommandFailed(RuntimeError):
@@ -22,49 +32,192 @@ class ShellCommandFailed(RuntimeError):
         return f"<ShellCommandFailed: {self.command} returned {self.returncode}>"
 
 
+class ShellCommandTimedOut(ShellCommandFailed):
+    def __init__(self, command: str, timeout: float, message: str, output: str) -> None:
+        super().__init__(command, -1, message, output)
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        return f"{self.message}: {self.command} timed out after {self.timeout}s"
+
+
+class TailBuffer:
+    """A sink that keeps only the last max_lines lines of output."""
+
+    def __init__(self, max_lines: int = 500) -> None:
+        self._lines: "deque[str]" = deque(maxlen=max_lines)
+
+    def __call__(self, line: str) -> None:
+        self._lines.append(line)
+
+    def text(self) -> str:
+        return "".join(self._lines)
+
+
+class CaptureBuffer:
+    """A sink that keeps all the output."""
+
+    def __init__(self) -> None:
+        self._buffer = io.StringIO()
+
+    def __call__(self, line: str) -> None:
+        self._buffer.write(line)
+
+    def text(self) -> str:
+        return self._buffer.getvalue()
+
+
+class StreamSink:
+    """A sink that tees output to a text stream, like a log file or stdout."""
+
+    def __init__(self, stream: Union[IO[str], io.TextIOBase]) -> None:
+        self._stream = stream
+
+    def __call__(self, line: str) -> None:
+        self._stream.write(line)
+        self._stream.flush()
+
+
+def _feed_lines(pending: str, text: str, sinks: Iterable[Sink]) -> str:
+    """Send the complete lines in pending + text to sinks and return what's left."""
+    pending += text
+    lines = pending.splitlines(keepends=True)
+    if lines and not lines[-1].endswith(("\n", "\r")):
+        pending = lines.pop()
+    else:
+        pending = ""
+    for line in lines:
+        for sink in sinks:
+            sink(line)
+    return pending
+
+
+def _read_chunks(fd: int, deadline: Optional[float]) -> Iterator[bytes]:
+    """
+    Read from fd as data arrives until it's closed. Raises TimeoutError if the
+    deadline (in time.monotonic() terms) passes first.
+    """
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError()
+            if not selector.select(remaining):
+                continue
+            chunk = os.read(fd, _READ_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_output(
+    proc: "subprocess.Popen[bytes]",
+    sinks: Iterable[Sink],
+    deadline: Optional[float] = None,
+) -> bool:
+    """
+    Send everything proc writes to its stdout to sinks, line by line, as soon as
+    it's written, until proc closes stdout. Returns False if the deadline (in
+    time.monotonic() terms) passed first, True otherwise.
+    """
+    assert proc.stdout
+    sinks = list(sinks)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    try:
+        for chunk in _read_chunks(proc.stdout.fileno(), deadline):
+            pending = _feed_lines(pending, decoder.decode(chunk), sinks)
+    except TimeoutError:
+        return False
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        for sink in sinks:
+            sink(pending)
+    return True
+
+
+def _wait_until(proc: "subprocess.Popen[bytes]", deadline: Optional[float]) -> bool:
+    """Wait for proc to exit. Returns False if the deadline passed first."""
+    remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        proc.wait(timeout=remaining)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def _stop(proc: "subprocess.Popen[bytes]") -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
 def run_simple(
     args: List[str],
     name: str,
-    output: io.TextIOBase,
+    output: Optional[io.TextIOBase],
     cwd: Optional[str] = None,
     verbose: bool = False,
+    *,
+    sinks: Iterable[Sink] = (),
+    timeout: Optional[float] = None,
+    env: Optional[Mapping[str, str]] = None,
+    capture: bool = False,
 ) -> str:
     """Run a shell command simple enough to run with the list-args subprocess Popen.
 
-    Should stream the output of the process to output. Raises RuntimeError if the
-    process fails, and cancels the process and propagates KeyboardInterrupt.
+    The output of the process is sent to each of sinks as it arrives, and also
+    streamed to output if verbose is set. Raises ShellCommandFailed if the process
+    fails, with the tail of its output; raises ShellCommandTimedOut if timeout
+    seconds pass before the process finishes; and cancels the process and
+    propagates KeyboardInterrupt.
+
+    Only the tail of the output is kept, and an empty string returned, unless
+    capture is set, in which case all of it is returned.
     """
-    if verbose:
+    if verbose and output:
         print(" ".join(args), file=output)
+    tail = TailBuffer()
+    captured = CaptureBuffer() if capture else None
+    all_sinks: List[Sink] = [tail, *sinks]
+    if captured:
+        all_sinks.append(captured)
+    if verbose and output:
+        all_sinks.append(StreamSink(output))
+    deadline = None if timeout is None else time.monotonic() + timeout
     proc = subprocess.Popen(
         args,
-        bufsize=100,
+        bufsize=0,
         cwd=cwd,
+        env=env,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        text=True,
     )
     if not proc.stdout:
         raise RuntimeError(f"failed to communicate with {name} process")
-    accumulated = []
     try:
-        while proc.poll() is None:
-            # always read to prevent blocking on the pipe
-            procwrote = proc.stdout.readline()
-            accumulated.append(procwrote)
-            # but only echo if verbose
-            if verbose:
-                output.write(procwrote)
-                output.flush()
-            else:
-                time.sleep(0.1)
+        with proc.stdout:
+            finished = stream_output(proc, all_sinks, deadline)
+        if not finished or not _wait_until(proc, deadline):
+            _stop(proc)
+            raise ShellCommandTimedOut(
+                command=" ".join(args),
+                timeout=timeout or 0,
+                message=f"{name} timed out",
+                output=tail.text(),
+            )
     except KeyboardInterrupt:
-        proc.terminate()
+        _stop(proc)
+        raise
     if proc.returncode != 0:
         raise ShellCommandFailed(
             command=" ".join(args),
             returncode=proc.returncode,
             message=f"{name} failed",
-            output="\n".join(accumulated),
+            output=tail.text(),
         )
-    return "\n".join(accumulated)
+    return captured.text() if captured else ""
@@ -9,8 +9,12 @@ from builder.common import args
 from builder import __version__
 from builder.package_build.orchestrate import discover_build_packages_sync
 from builder.package_build.types import GlobalBuildContext
+from builder.package_build.report import BuildReport
+from builder.package_build import wheelhouse
+from builder.common.cache_areas import run_cache_command
 from builder.common.shellcommand import ShellCommandFailed
 from builder.generate_index import generate as build_index
+from builder.generate_index.link import LinkMode
 import sys
 
 
@@ -33,9 +37,27 @@ def run_from_cmdline() -> None:
     )
     parser = args.add_common_args(parser)
     parsed_args = parser.parse_args()
+    args.check_command(parser, parsed_args)
     repo_base = Path(parsed_args.package_repo_base)
 
     try:
+        if parsed_args.command == "wheelhouse":
+            run_wheelhouse(
+                parsed_args.action,
+                repo_base / "packages",
+                _ensure_path(repo_base, Path(parsed_args.cache_root)),
+                parsed_args.output,
+                parsed_args.verbose,
+            )
+            sys.exit(0)
+        if parsed_args.command == "cache":
+            run_cache_command(
+                parsed_args.action,
+                _ensure_path(repo_base, Path(parsed_args.cache_root)),
+                parsed_args.cache_budget_mb,
+                parsed_args.output,
+            )
+            sys.exit(0)
         run_build(
             Path(parsed_args.package_repo_base) / "packages",
             Path(parsed_args.buildroot_sdk_base),
@@ -46,6 +68,17 @@ def run_from_cmdline() -> None:
             parsed_args.build_type,
             parsed_args.output,
             parsed_args.verbose,
+            parsed_args.jobs,
+            parsed_args.force_rebuild,
+            _ensure_path(repo_base, Path(parsed_args.cache_root)),
+            parsed_args.download_cache_mb,
+            parsed_args.sdk_environment,
+            _ensure_path(repo_base, Path(parsed_args.trace_out))
+            if parsed_args.trace_out
+            else None,
+            parsed_args.index_link_mode,
+            parsed_args.refresh_locks,
+            parsed_args.offline,
         )
     except ShellCommandFailed as scf:
         # Invert the usual verbosity logic here because if we're verbose, then
@@ -76,6 +109,19 @@ def _ensure_path(repo_base: Path, possibly_relative: Path) -> Path:
     return (repo_base / possibly_relative).resolve()
 
 
+def _write_reports(
+    report: BuildReport,
+    build_tree_root: Path,
+    trace_out: Path | None,
+    output: io.TextIOBase,
+) -> None:
+    print(report.summary(), file=output)
+    report_path = report.write_json(build_tree_root / "build-report.json")
+    print(f"Build timing report in {report_path}", file=output)
+    if trace_out:
+        print(f"Build trace in {report.write_chrome_trace(trace_out)}", file=output)
+
+
 def run_build(
     package_tree_root: Path,
     buildroot_sdk_base: Path,
@@ -86,6 +132,15 @@ def run_build(
     build_type: Literal["packages-only", "index-only", "both"],
     output: io.TextIOBase,
     verbose: bool,
+    jobs: int = 1,
+    force_rebuild: bool = False,
+    cache_root: Path | None = None,
+    download_cache_mb: int = 10240,
+    sdk_environment: Literal["snapshot", "subshell"] = "subshell",
+    trace_out: Path | None = None,
+    index_link_mode: LinkMode = "copy",
+    refresh_locks: bool = False,
+    offline: bool = False,
 ) -> None:
     """Run the build.
 
@@ -99,17 +154,81 @@ def run_build(
     dist_tree_root: path to the tree where distributables should go
     output: a text io that can be used to write build logs
     verbose: whether those logs should be verbose
+    jobs: how many packages to build at the same time
+    force_rebuild: build packages even if their dists are up to date
+    cache_root: path to the caches shared between builds, or None to not cache
+    download_cache_mb: the size limit of the download cache
+    sdk_environment: whether to run build commands with a captured SDK environment
+                     or in an interactive subshell
+    trace_out: where to write a chrome trace of the package build, if anywhere
+    index_link_mode: how to put distributions in the index (see generate_index.link)
+    refresh_locks: resolve build dependencies again instead of using their lockfiles
+    offline: install build dependencies only from the wheelhouse, not from PyPI
     """
     if build_type in ("packages-only", "both"):
         print(f"Building with tools version {__version__}", file=output)
         context = GlobalBuildContext(
-            output=output, verbose=verbose, sdk_path=buildroot_sdk_base
-        )
-        discover_build_packages_sync(
-            package_tree_root, build_tree_root, dist_tree_root, context=context
+            output=output,
+            verbose=verbose,
+            sdk_path=buildroot_sdk_base,
+            jobs=jobs,
+            force_rebuild=force_rebuild,
+            refresh_locks=refresh_locks,
+            offline=offline,
+            cache_root=cache_root,
+            download_cache_mb=download_cache_mb,
+            sdk_environment=sdk_environment,
         )
+        try:
+            discover_build_packages_sync(
+                package_tree_root, build_tree_root, dist_tree_root, context=context
+            )
+        finally:
+            _write_reports(context.report, build_tree_root, trace_out, output)
         print("Package build complete!", file=output)
     if build_type in ("index-only", "both"):
         print("Building pypi index", file=output)
-        index_files = build_index(index_root_url, index_tree_root, dist_tree_root)
+        index_files = build_index(
+            index_root_url, index_tree_root, dist_tree_root, index_link_mode
+        )
         print(f"Index build complete in {index_files[0]}", file=output)
+
+
+def run_wheelhouse(
+    action: Literal["populate", "prune"],
+    package_tree_root: Path,
+    cache_root: Path,
+    output: io.TextIOBase,
+    verbose: bool,
+) -> None:
+    """Populate or prune the wheelhouse of build dependencies (see
+    builder.package_build.wheelhouse).
+
+    Params
+    ------
+
+    action: populate to download everything the packages' lockfiles pin, or prune to
+            remove what none of them pin
+    package_tree_root: path to the tree of packages, each containing a build.py
+    cache_root: path to the caches shared between builds, which has the wheelhouse
+    output: a text io that can be used to write logs
+    verbose: whether those logs should be verbose
+    """
+    wheelhouse_path = cache_root / wheelhouse.WHEELHOUSE_DIR
+    if action == "populate":
+        changes = wheelhouse.populate(
+            wheelhouse_path, package_tree_root, output, verbose
+        )
+        for lock_path in changes.changed:
+            print(f"Downloaded build dependencies for {lock_path}", file=output)
+    else:
+        changes = wheelhouse.prune(wheelhouse_path, package_tree_root)
+        for removed in changes.changed:
+            print(f"Removed {removed.name}", file=output)
+        print(f"Freed {changes.bytes_removed // 1024}KiB", file=output)
+    for lock_path in changes.skipped:
+        print(
+            f"Could not read {lock_path}; resolve it again with --refresh-locks",
+            file=output,
+        )
+    print(f"Wheelhouse in {wheelhouse_path} is up to date", file=output)
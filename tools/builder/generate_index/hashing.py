@@ -0,0 +1,51 @@
+"""generate_index.hashing: hash distributions without reading them into memory"""
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+import os
+import threading
+
+#: How much of a file to read at a time
+CHUNK_SIZE = 1024 * 1024
+#: How many files to hash at once
+HASH_THREADS = min(8, os.cpu_count() or 1)
+
+_known_digests: dict[tuple[str, int, int], str] = {}
+_known_digests_lock = threading.Lock()
+
+
+def _identity(path: Path) -> tuple[str, int, int]:
+    stat = path.stat()
+    return os.path.realpath(path), stat.st_size, stat.st_mtime_ns
+
+
+def file_sha256(path: Path) -> str:
+    """The hex sha256 digest of a file."""
+    identity = _identity(path)
+    with _known_digests_lock:
+        known = _known_digests.get(identity)
+    if known:
+        return known
+    digest = sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as hashed_file:
+        while True:
+            read = hashed_file.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    hexdigest = digest.hexdigest()
+    with _known_digests_lock:
+        _known_digests[identity] = hexdigest
+    return hexdigest
+
+
+def hash_files(paths: Iterable[Path], threads: int = HASH_THREADS) -> dict[Path, str]:
+    """The hex sha256 digests of several files, hashed concurrently."""
+    unique = list(dict.fromkeys(paths))
+    if len(unique) <= 1 or threads <= 1:
+        return {path: file_sha256(path) for path in unique}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return dict(zip(unique, pool.map(file_sha256, unique)))
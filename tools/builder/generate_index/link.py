@@ -0,0 +1,73 @@
+"""generate_index.link: put distributions in the index, copying or linking them"""
+from pathlib import Path
+from typing import Literal
+import os
+import shutil
+import sys
+
+from .hashing import file_sha256
+
+LinkMode = Literal["copy", "hardlink", "reflink", "symlink"]
+LINK_MODES: tuple[LinkMode, ...] = ("copy", "hardlink", "reflink", "symlink")
+
+# from linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _reflink(source: Path, target: Path) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflinks are only supported on linux")
+    import fcntl
+
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+
+
+def _link(source: Path, target: Path, mode: LinkMode) -> LinkMode:
+    try:
+        match mode:
+            case "hardlink":
+                os.link(source, target)
+                return mode
+            case "reflink":
+                _reflink(source, target)
+                return mode
+            case "symlink":
+                # relative, so the link still works where the tree is mounted
+                # somewhere else, as it is in the container
+                os.symlink(os.path.relpath(source, target.parent), target)
+                return mode
+    except OSError:
+        target.unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+def place_file(source: Path, target: Path, mode: LinkMode) -> LinkMode:
+    """
+    Make target have the contents of source, by linking it if mode says to and
+    that's possible, and by copying it if not. The file is put in place atomically,
+    and never written through an existing link. Returns how the file was placed.
+    """
+    temp_path = target.with_name(f".{target.name}.{os.getpid()}.placing")
+    temp_path.unlink(missing_ok=True)
+    try:
+        placed = _link(source, temp_path, mode)
+        os.replace(temp_path, target)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return placed
+
+
+def is_identical(source: Path, target: Path, size: int, sha256: str) -> bool:
+    """
+    Whether target already has the contents of source: either it's the same file,
+    or it's the same size and has the same hash.
+    """
+    try:
+        if os.path.samefile(source, target):
+            return True
+        return target.stat().st_size == size and file_sha256(target) == sha256
+    except OSError:
+        return False
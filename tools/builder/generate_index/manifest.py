@@ -0,0 +1,146 @@
+"""generate_index.manifest: remember what went into the index last time"""
+from dataclasses import asdict, dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+import json
+import os
+import zipfile
+
+from pkginfo import Wheel
+
+from .hashing import HASH_THREADS, file_sha256
+
+#: The name of the manifest file in the index root
+MANIFEST_NAME = ".index-manifest.json"
+_MANIFEST_VERSION = 2
+
+
+@dataclass(frozen=True)
+class DistributionRecord:
+    path: str
+    #: Where the distribution is in the dist tree
+    size: int
+    #: Its size in bytes
+    mtime_ns: int
+    #: Its modification time
+    sha256: str
+    #: The hex sha256 digest of its contents
+    project: str
+    #: The name of the project it's a distribution of
+    version: str
+    #: The version of the project it's a distribution of
+    metadata_sha256: str | None = None
+    #: The hex sha256 digest of its core metadata file, if it has one
+    requires_python: str | None = None
+    #: The python versions it supports, if it says
+
+    @property
+    def filename(self) -> str:
+        return Path(self.path).name
+
+
+@dataclass
+class IndexManifest:
+    index_root_url: str | None = None
+    #: The url the index was last generated for
+    distributions: dict[str, DistributionRecord] = field(default_factory=dict)
+    #: Everything in the index, by path in the dist tree
+
+    @classmethod
+    def load(cls, index_root_path: Path) -> "IndexManifest":
+        """Load the manifest in an index root, or an empty one if it is missing or unreadable."""
+        try:
+            contents = json.loads((index_root_path / MANIFEST_NAME).read_text())
+            if contents.get("version") != _MANIFEST_VERSION:
+                return cls()
+            return cls(
+                index_root_url=contents["index_root_url"],
+                distributions={
+                    record["path"]: DistributionRecord(**record)
+                    for record in contents["distributions"]
+                },
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+    def save(self, index_root_path: Path) -> Path:
+        """Write the manifest to an index root, atomically."""
+        path = index_root_path / MANIFEST_NAME
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_text(
+            json.dumps(
+                {
+                    "version": _MANIFEST_VERSION,
+                    "index_root_url": self.index_root_url,
+                    "distributions": [
+                        asdict(record) for record in self.distributions.values()
+                    ],
+                },
+                indent=2,
+            )
+        )
+        os.replace(temp_path, path)
+        return path
+
+    def by_project(self) -> dict[str, dict[str, DistributionRecord]]:
+        """The distributions of each project, by file name."""
+        projects: dict[str, dict[str, DistributionRecord]] = {}
+        for record in self.distributions.values():
+            projects.setdefault(record.project, {})[record.filename] = record
+        return projects
+
+
+def read_core_metadata(path: Path) -> bytes | None:
+    """The contents of a wheel's .dist-info/METADATA file, if it has one."""
+    with zipfile.ZipFile(path) as wheel:
+        for name in wheel.namelist():
+            directory, _, filename = name.partition("/")
+            if directory.endswith(".dist-info") and filename == "METADATA":
+                return wheel.read(name)
+    return None
+
+
+def inspect_distribution(path: Path) -> DistributionRecord:
+    """Read a distribution's metadata and hash it."""
+    stat = path.stat()
+    wheel = Wheel(str(path))
+    if not wheel.name or not wheel.version:
+        raise RuntimeError(f"Could not read the name and version of {path}")
+    metadata = read_core_metadata(path)
+    return DistributionRecord(
+        path=str(path),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        sha256=file_sha256(path),
+        project=wheel.name,
+        version=wheel.version,
+        metadata_sha256=sha256(metadata).hexdigest() if metadata else None,
+        requires_python=wheel.requires_python or None,
+    )
+
+
+def scan_distributions(
+    distributions: Iterable[Path], previous: IndexManifest
+) -> IndexManifest:
+    """
+    Build the manifest for a set of distributions, reusing what the previous
+    manifest knows about any distribution whose size and mtime haven't changed.
+    Distributions that do need inspecting are inspected concurrently.
+    """
+    records: dict[str, DistributionRecord] = {}
+    unknown: list[Path] = []
+    for dist in distributions:
+        known = previous.distributions.get(str(dist))
+        if known:
+            stat = dist.stat()
+            if known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+                records[known.path] = known
+                continue
+        unknown.append(dist)
+    if unknown:
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as pool:
+            for record in pool.map(inspect_distribution, unknown):
+                records[record.path] = record
+    return IndexManifest(distributions=records)
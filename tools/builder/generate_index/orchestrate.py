@@ -1,23 +1,38 @@
 """generate_index.orchestrate: functions for generating the index"""
 
 from pathlib import Path
-from pkginfo import Wheel  # type: ignore
-from shutil import copyfile
+import gzip
+import os
+import shutil
 from glob import iglob
-from itertools import chain
 from typing import Iterable, Iterator
-from .root_index import generate as generate_root
-from .package_leaf import generate as generate_leaf
-from collections import defaultdict
+from .root_index import generate as generate_root, generate_json as generate_root_json
+from .package_leaf import (
+    generate as generate_leaf,
+    generate_json as generate_leaf_json,
+    metadata_path,
+)
+from .link import LinkMode, is_identical, place_file
+from .manifest import (
+    DistributionRecord,
+    IndexManifest,
+    read_core_metadata,
+    scan_distributions,
+)
 from urllib.parse import urljoin
 
 
-def generate(index_root_url: str, index_root: Path, dist_root: Path) -> list[Path]:
+def generate(
+    index_root_url: str,
+    index_root: Path,
+    dist_root: Path,
+    link_mode: LinkMode = "copy",
+) -> list[Path]:
     """
     Inspect a tree of package distributions and build an index in index_root for them.
     """
     return generate_for_distributions(
-        index_root_url, index_root, distributions_from_tree(dist_root)
+        index_root_url, index_root, distributions_from_tree(dist_root), link_mode
     )
 
 
@@ -27,7 +42,10 @@ def distributions_from_tree(dist_root: Path) -> Iterator[Path]:
 
 
 def generate_for_distributions(
-    index_root_url: str, index_root_path: Path, distributions: Iterable[Path]
+    index_root_url: str,
+    index_root_path: Path,
+    distributions: Iterable[Path],
+    link_mode: LinkMode = "copy",
 ) -> list[Path]:
     """
     Generate an index for a list of packages in a root path.
@@ -48,32 +66,62 @@ def generate_for_distributions(
                      That means files will be under index_root/simple/.
     distributions: A list of paths to package distributions. A package might have
                    multiple distributions.
+    link_mode: How to put distributions in the index: copy them, or hardlink,
+               reflink or symlink them (falling back to copying if that's not
+               possible). See generate_index.link.
+
+    The index is updated incrementally: a manifest in index_root_path remembers
+    the name, version and hash of every distribution, so only new or changed
+    distributions are inspected, and only the pages of packages whose
+    distributions changed are rewritten.
 
     Returns
     -------
     A list of paths to each file and directory in the index, with the root as the first.
     """
-    by_package = collate_to_packages(distributions)
     if not index_root_url.endswith("/"):
         index_root_url += "/"
-    return (
-        [index_root_path]
-        + generate_simple_index_dir(
-            index_root_url,
-            index_root_path,
-            package_dirs_from_names(index_root_path, by_package.keys()),
+    index_root_path.mkdir(parents=True, exist_ok=True)
+    previous = IndexManifest.load(index_root_path)
+    manifest = scan_distributions(distributions, previous)
+    manifest.index_root_url = index_root_url
+    # pages have absolute urls in them, so they all change if the url does
+    url_changed = previous.index_root_url != index_root_url
+    previous_by_package = previous.by_project()
+    by_package = manifest.by_project()
+    package_dirs = list(package_dirs_from_names(index_root_path, by_package.keys()))
+    if url_changed or by_package.keys() != previous_by_package.keys():
+        simple_index = generate_simple_index_dir(
+            index_root_url, index_root_path, package_dirs
         )
-        + list(
-            chain.from_iterable(
-                [
-                    generate_and_fill_package_dir(
-                        index_root_url, index_root_path, package, dists
-                    )
-                    for package, dists in by_package.items()
-                ]
+    else:
+        simple_index = existing_simple_index_dir(index_root_path)
+    package_paths: list[Path] = []
+    for package, records in by_package.items():
+        previous_records = previous_by_package.get(package, {})
+        if url_changed or _leaf_contents(records) != _leaf_contents(previous_records):
+            package_paths.extend(
+                generate_and_fill_package_dir(
+                    index_root_url,
+                    index_root_path,
+                    package,
+                    records,
+                    previous_records,
+                    link_mode,
+                )
             )
-        )
-    )
+        else:
+            package_paths.extend(
+                existing_package_dir(index_root_path, package, records)
+            )
+    for package in previous_by_package.keys() - by_package.keys():
+        remove_package_dir(index_root_path, package)
+    manifest.save(index_root_path)
+    return [index_root_path] + simple_index + package_paths
+
+
+def _leaf_contents(records: dict[str, DistributionRecord]) -> dict[str, str]:
+    return {filename: record.sha256 for filename, record in records.items()}
 
 
 def simple_root_from_index_root(index_root: Path) -> Path:
@@ -100,49 +148,168 @@ def generate_simple_index_dir(
     simple_fs_root = simple_root_from_index_root(index_root_path)
     simple_fs_root.mkdir(parents=True, exist_ok=True)
     simple_url_root = simple_url_from_index_url(index_root_url)
+    package_dirs = list(package_dirs)
     simple_root_index_contents = generate_root(
         simple_url_root, simple_fs_root, package_dirs
     )
-    simple_root_index_path = simple_fs_root / "index.html"
-    with open(simple_root_index_path, "w") as simple_root_index:
-        simple_root_index.write(simple_root_index_contents)
-    return [simple_fs_root, simple_root_index_path]
+    return (
+        [simple_fs_root]
+        + write_page(simple_fs_root / "index.html", simple_root_index_contents)
+        + write_page(
+            simple_fs_root / "index.json",
+            generate_root_json(simple_url_root, simple_fs_root, package_dirs),
+        )
+    )
+
+
+def existing_simple_index_dir(index_root_path: Path) -> list[Path]:
+    """The paths generate_simple_index_dir would return, if it doesn't need rerunning."""
+    simple_fs_root = simple_root_from_index_root(index_root_path)
+    return [simple_fs_root] + page_paths(simple_fs_root)
+
+
+def write_page(path: Path, contents: str) -> list[Path]:
+    """
+    Write an index page, and a gzipped copy of it for servers that can send
+    precompressed files. The page is replaced atomically, since it may be being
+    served. Returns the paths written.
+    """
+    encoded = contents.encode()
+    written = []
+    for target, data in (
+        (path, encoded),
+        (path.with_name(path.name + ".gz"), gzip.compress(encoded, mtime=0)),
+    ):
+        temp_path = target.with_name(f".{target.name}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, target)
+        written.append(target)
+    return written
+
+
+def page_paths(directory: Path) -> list[Path]:
+    """The paths of the pages written for an index directory."""
+    return [
+        directory / name
+        for page in ("index.html", "index.json")
+        for name in (page, f"{page}.gz")
+    ]
 
 
 def generate_and_fill_package_dir(
-    index_root_url: str, index_root_path: Path, package_name: str, dists: set[Path]
+    index_root_url: str,
+    index_root_path: Path,
+    package_name: str,
+    records: dict[str, DistributionRecord],
+    previous_records: dict[str, DistributionRecord] | None = None,
+    link_mode: LinkMode = "copy",
 ) -> list[Path]:
     simple_fs_root = simple_root_from_index_root(index_root_path)
     package_dir = simple_fs_root / package_name
     package_dir.mkdir(parents=True, exist_ok=True)
-    dists_in_package = list(copy_dists_to_leaf(package_dir, dists))
+    dists_in_package = list(
+        copy_dists_to_leaf(package_dir, records, previous_records or {}, link_mode)
+    )
     simple_root_url = simple_url_from_index_url(index_root_url)
     package_url = urljoin(simple_root_url, f"{package_dir.name}/")
-    leaf_index_contents = generate_leaf(
-        package_url,
-        package_dir,
-        dists_in_package,
+    digests = {
+        package_dir / filename: record.sha256 for filename, record in records.items()
+    }
+    metadata_digests = {
+        package_dir / filename: record.metadata_sha256
+        for filename, record in records.items()
+    }
+    requires_python = {
+        package_dir / filename: record.requires_python
+        for filename, record in records.items()
+    }
+    pages = write_page(
+        package_dir / "index.html",
+        generate_leaf(
+            package_url,
+            package_dir,
+            dists_in_package,
+            digests,
+            metadata_digests,
+            requires_python,
+        ),
+    ) + write_page(
+        package_dir / "index.json",
+        generate_leaf_json(
+            package_url,
+            package_dir,
+            dists_in_package,
+            digests,
+            metadata_digests,
+            requires_python,
+        ),
     )
-    leaf_index_path = package_dir / "index.html"
-    with open(leaf_index_path, "w") as leaf_index:
-        leaf_index.write(leaf_index_contents)
-    return [package_dir, leaf_index_path] + dists_in_package
+    return [package_dir] + pages + _leaf_files(package_dir, records)
 
 
-def copy_dists_to_leaf(package_dir: Path, dists: Iterable[Path]) -> Iterator[Path]:
-    """Copy distribution files to the leaf directory"""
-    for dist in dists:
-        target_path = package_dir / dist.name
-        copyfile(dist, target_path)
-        yield target_path
+def existing_package_dir(
+    index_root_path: Path, package_name: str, records: dict[str, DistributionRecord]
+) -> list[Path]:
+    """The paths generate_and_fill_package_dir would return, if it doesn't need rerunning."""
+    package_dir = simple_root_from_index_root(index_root_path) / package_name
+    return [package_dir] + page_paths(package_dir) + _leaf_files(package_dir, records)
+
+
+def remove_package_dir(index_root_path: Path, package_name: str) -> None:
+    """Remove the leaf directory of a package that no longer has distributions."""
+    shutil.rmtree(
+        simple_root_from_index_root(index_root_path) / package_name, ignore_errors=True
+    )
+
+
+def _leaf_files(
+    package_dir: Path, records: dict[str, DistributionRecord]
+) -> list[Path]:
+    """The distributions in a leaf dir, and their metadata files."""
+    files: list[Path] = []
+    for filename, record in records.items():
+        files.append(package_dir / filename)
+        if record.metadata_sha256:
+            files.append(metadata_path(package_dir / filename))
+    return files
 
 
-def collate_to_packages(distributions: Iterable[Path]) -> dict[str, set[Path]]:
+def copy_dists_to_leaf(
+    package_dir: Path,
+    records: dict[str, DistributionRecord],
+    previous_records: dict[str, DistributionRecord],
+    link_mode: LinkMode = "copy",
+) -> Iterator[Path]:
     """
-    Turns the flat list of paths to distributions into a mapping of package names to
-    a set of distributions for the package.
+    Put distribution files in the leaf directory, by copying or linking them
+    according to link_mode, and write their core metadata there. Files that are
+    already there - from last time, or because an identical file is - are left
+    alone, and ones that were there last time and are gone now are removed.
     """
-    result: defaultdict[str, set[Path]] = defaultdict(set)
-    for dist in distributions:
-        result[Wheel(dist).name].add(dist)
-    return result
+    for filename in previous_records.keys() - records.keys():
+        (package_dir / filename).unlink(missing_ok=True)
+        metadata_path(package_dir / filename).unlink(missing_ok=True)
+    for filename, record in records.items():
+        target_path = package_dir / filename
+        previous = previous_records.get(filename)
+        changed = not previous or previous.sha256 != record.sha256
+        if (
+            changed
+            or not target_path.is_file()
+            or target_path.stat().st_size != record.size
+        ) and not is_identical(
+            Path(record.path), target_path, record.size, record.sha256
+        ):
+            place_file(Path(record.path), target_path, link_mode)
+        if record.metadata_sha256 and (
+            changed or not metadata_path(target_path).is_file()
+        ):
+            write_metadata(Path(record.path), metadata_path(target_path))
+        yield target_path
+
+
+def write_metadata(distribution: Path, target_path: Path) -> None:
+    """Extract a wheel's core metadata to target_path, for PEP 658."""
+    metadata = read_core_metadata(distribution)
+    if metadata is not None:
+        target_path.write_bytes(metadata)
@@ -1,17 +1,66 @@
 """generate_index.package_leaf: generate metadata in a package leaf dir"""
+from dataclasses import dataclass
+from html import escape
 from pathlib import Path
-from hashlib import sha256
-from typing import Iterable
-from binascii import hexlify
+from typing import Any, Iterable, Mapping
 from urllib.parse import urljoin
+import json
 
 from airium import Airium  # type: ignore[import]
 
+from .hashing import hash_files
+
+#: The suffix of a distribution's PEP 658 core metadata file
+METADATA_SUFFIX = ".metadata"
+
+
+def metadata_path(distribution: Path) -> Path:
+    """Where the core metadata for a distribution in a leaf dir goes."""
+    return distribution.with_name(distribution.name + METADATA_SUFFIX)
+
+
+@dataclass
+class _LeafFile:
+    name: str
+    url: str
+    sha256: str
+    metadata_sha256: str | None
+    requires_python: str | None
+
+
+def _leaf_files(
+    package_url: str,
+    package_path: Path,
+    distributions: Iterable[Path],
+    digests: Mapping[Path, str] | None,
+    metadata_digests: Mapping[Path, str | None] | None,
+    requires_python: Mapping[Path, str | None] | None,
+) -> list[_LeafFile]:
+    distributions = list(distributions)
+    known = digests or {}
+    all_digests = {
+        **hash_files(dist for dist in distributions if dist not in known),
+        **known,
+    }
+    return [
+        _LeafFile(
+            name=dist.name,
+            url=urljoin(package_url, str(dist.relative_to(package_path))),
+            sha256=all_digests[dist],
+            metadata_sha256=(metadata_digests or {}).get(dist),
+            requires_python=(requires_python or {}).get(dist),
+        )
+        for dist in distributions
+    ]
+
 
 def generate(
     package_url: str,
     package_path: Path,
     distributions: Iterable[Path],
+    digests: Mapping[Path, str] | None = None,
+    metadata_digests: Mapping[Path, str | None] | None = None,
+    requires_python: Mapping[Path, str | None] | None = None,
 ) -> str:
     """Generate a package leaf directory with index and hashes
 
@@ -22,30 +71,87 @@ def generate(
     distributions: iterable of the files to serve for the package. these paths should be true
                    filesystem paths (we need to read the files to get their hex digests) and
                    should be in the package directory.
+    digests: the hex sha256 digests of distributions, if they're already known. any
+             distribution not in here is hashed, several at a time.
+    metadata_digests: the hex sha256 digests of the PEP 658 core metadata files for
+                      distributions that have them (see metadata_path)
+    requires_python: the Requires-Python of distributions that have one
 
     Returns
     -------
     The generated html file
     """
+    files = _leaf_files(
+        package_url,
+        package_path,
+        distributions,
+        digests,
+        metadata_digests,
+        requires_python,
+    )
     idx = Airium()
     idx("<!DOCTYPE html>")
     with idx.html():
         with idx.head():
+            idx.meta(name="pypi:repository-version", content="1.0")
             with idx.title():
                 idx(f"{package_path.name} at Opentrons Python Package Index")
         with idx.body():
-            for dist in distributions:
-                digest = hexlify(sha256(open(dist, "rb").read()).digest())
-                with idx.a(
-                    href=(
-                        str(
-                            urljoin(
-                                package_url,
-                                str(dist.relative_to(package_path))
-                                + f"#sha256={digest.decode()}",
-                            )
-                        )
+            for leaf_file in files:
+                attributes: dict[str, Any] = {
+                    "href": f"{leaf_file.url}#sha256={leaf_file.sha256}"
+                }
+                if leaf_file.requires_python:
+                    attributes["data-requires-python"] = escape(
+                        leaf_file.requires_python
                     )
-                ):
-                    idx(dist.name)
+                if leaf_file.metadata_sha256:
+                    # data-dist-info-metadata is what pip before 23.2 understands
+                    metadata = f"sha256={leaf_file.metadata_sha256}"
+                    attributes["data-core-metadata"] = metadata
+                    attributes["data-dist-info-metadata"] = metadata
+                with idx.a(**attributes):
+                    idx(leaf_file.name)
     return str(idx)
+
+
+def generate_json(
+    package_url: str,
+    package_path: Path,
+    distributions: Iterable[Path],
+    digests: Mapping[Path, str] | None = None,
+    metadata_digests: Mapping[Path, str | None] | None = None,
+    requires_python: Mapping[Path, str | None] | None = None,
+) -> str:
+    """Generate the PEP 691 JSON version of a package leaf index.
+
+    Takes the same arguments as generate.
+    """
+    files = _leaf_files(
+        package_url,
+        package_path,
+        distributions,
+        digests,
+        metadata_digests,
+        requires_python,
+    )
+    entries: list[dict[str, Any]] = []
+    for leaf_file in files:
+        entry: dict[str, Any] = {
+            "filename": leaf_file.name,
+            "url": leaf_file.url,
+            "hashes": {"sha256": leaf_file.sha256},
+        }
+        if leaf_file.requires_python:
+            entry["requires-python"] = leaf_file.requires_python
+        metadata = (
+            {"sha256": leaf_file.metadata_sha256}
+            if leaf_file.metadata_sha256
+            else False
+        )
+        entry["core-metadata"] = metadata
+        entry["dist-info-metadata"] = metadata
+        entries.append(entry)
+    return json.dumps(
+        {"meta": {"api-version": "1.0"}, "name": package_path.name, "files": entries}
+    )
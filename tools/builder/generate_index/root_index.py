@@ -2,6 +2,7 @@
 from pathlib import Path
 from typing import Iterable
 from urllib.parse import urljoin
+import json
 
 from airium import Airium  # type: ignore[import]
 
@@ -31,6 +32,7 @@ def generate(
     idx("<!DOCTYPE html>")
     with idx.html():
         with idx.head():
+            idx.meta(name="pypi:repository-version", content="1.0")
             with idx.title():
                 idx("Opentrons Python Package Index")
         with idx.body():
@@ -44,3 +46,18 @@ def generate(
                 ):
                     idx(package.name)
     return str(idx)
+
+
+def generate_json(
+    simple_root_url: str, simple_root_path: Path, package_dirs: Iterable[Path]
+) -> str:
+    """Generate the PEP 691 JSON version of the simple index root.
+
+    Takes the same arguments as generate.
+    """
+    return json.dumps(
+        {
+            "meta": {"api-version": "1.0"},
+            "projects": [{"name": package.name} for package in package_dirs],
+        }
+    )
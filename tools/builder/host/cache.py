@@ -0,0 +1,14 @@
+"""host.cache: where the build caches are, on the host and in the container"""
+import os
+from pathlib import Path
+
+#: Where the cache root is mounted in the container
+CONTAINER_CACHE_ROOT = "/build-environment/cache"
+
+
+def host_cache_root(cache_root: str, repo_root: str) -> Path:
+    """Where a --cache-root is on the host; like in the container, a relative
+    path is in the repo."""
+    if os.path.isabs(cache_root):
+        return Path(cache_root)
+    return Path(os.path.realpath(os.path.join(repo_root, cache_root)))
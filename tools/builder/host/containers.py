@@ -1,15 +1,27 @@
 """Code for managing the containers to build the repo."""
+import hashlib
 import subprocess
 import io
 import os
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 import builder
 from builder.common.shellcommand import run_simple
+from .cache import CONTAINER_CACHE_ROOT
 
 CONTAINER_NAME = "ghcr.io/opentrons/python-package-builder"
 DEFAULT_TAG = "main"
 
+#: Everything in the tools directory that goes into the container image
+IMAGE_INPUTS = [
+    "Dockerfile",
+    "README.md",
+    "pyproject.toml",
+    "poetry.lock",
+    "builder",
+    "support",
+]
+
 
 def run_container(
     container_str: str,
@@ -17,6 +29,7 @@ def run_container(
     root_path: str,
     output: io.TextIOBase,
     verbose: bool = False,
+    cache_path: Optional[str] = None,
 ) -> None:
     """Run the container with a forwarded argv.
 
@@ -25,10 +38,12 @@ def run_container(
     forwarded_argv: the arguments to pass to the container
     root_path: the path to the root of the packages repo
     output: an output file stream for capturing the container
+    cache_path: the host directory to mount as the container's cache root, so the
+                caches outlive the container
     """
     print("Running build", file=output)
     run_simple(
-        _container_run_invoke_cmd(container_str, forwarded_argv, root_path),
+        _container_run_invoke_cmd(container_str, forwarded_argv, root_path, cache_path),
         name="package build",
         output=output,
         verbose=verbose,
@@ -59,11 +74,20 @@ def prep_container(
     require_tag: if True, raise an error if the specified tag cannot be pulled.
     force_build: if True, always build the container even if one is available
                  to pull
+
+    Unless require_tag or force_build is True, an image that was built locally
+    from the same sources (see content_tag) is used as it is, without pulling or
+    building.
     """
     if pull_tag is None:
         tag = DEFAULT_TAG
     else:
         tag = pull_tag
+    content_image = _container_image_content(root_path)
+    if not require_tag and not force_build:
+        if local_image(content_image):
+            print(f"Using {content_image}, built from these sources", file=output)
+            return content_image
     if not force_build:
         try:
             return pull_container(tag, output, verbose=verbose)
@@ -72,7 +96,46 @@ def prep_container(
             pass
     if require_tag:
         raise RuntimeError(f"Could not pull {tag}")
-    return build_container(root_path, output, verbose=verbose)
+    return build_container(root_path, output, content_image, verbose=verbose)
+
+
+def _image_input_files(root_path: str) -> Iterator[str]:
+    """The files that go into the image, relative to root_path, in a stable order."""
+    for name in IMAGE_INPUTS:
+        path = os.path.join(root_path, name)
+        if os.path.isfile(path):
+            yield name
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+            for filename in sorted(filenames):
+                if filename.endswith((".pyc", ".pyo")):
+                    continue
+                yield os.path.relpath(os.path.join(dirpath, filename), root_path)
+
+
+def content_tag(root_path: str) -> str:
+    """
+    A tag for the image built from the sources in root_path - the tools directory -
+    that changes when any of them do, so an image with it can be reused as is.
+    """
+    digest = hashlib.sha256()
+    for name in _image_input_files(root_path):
+        digest.update(name.replace(os.sep, "/").encode() + b"\0")
+        with open(os.path.join(root_path, name), "rb") as input_file:
+            digest.update(hashlib.sha256(input_file.read()).digest())
+    return f"content-{digest.hexdigest()[:16]}"
+
+
+def local_image(image: str) -> Optional[str]:
+    """The id of an image if docker has it locally, without pulling it."""
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode().strip() or None
 
 
 def pull_container(tag: str, output: io.TextIOBase, verbose: bool = False) -> str:
@@ -105,7 +168,10 @@ def pull_container(tag: str, output: io.TextIOBase, verbose: bool = False) -> st
 
 
 def build_container(
-    root_path: str, output: io.TextIOBase, verbose: bool = False
+    root_path: str,
+    output: io.TextIOBase,
+    content_image: Optional[str] = None,
+    verbose: bool = False,
 ) -> str:
     """Build the docker container for the build locally.
 
@@ -113,10 +179,14 @@ def build_container(
     ------
     root_path: str, the absolute path to the root of the package repo
     output: file stream to send logs to
+    content_image: the image name with the content tag of the sources in root_path,
+                   if the caller already has it
 
     """
+    if content_image is None:
+        content_image = _container_image_content(root_path)
     return _build_container(
-        os.geteuid(), os.getegid(), root_path, output, verbose=verbose
+        os.geteuid(), os.getegid(), root_path, content_image, output, verbose=verbose
     )
 
 
@@ -129,8 +199,12 @@ def _container_image_latest() -> str:
     return f"{CONTAINER_NAME}:latest"
 
 
+def _container_image_content(root_path: str) -> str:
+    return f"{CONTAINER_NAME}:{content_tag(root_path)}"
+
+
 def _container_build_invoke_cmd(
-    effective_uid: int, effective_gid: int, root_path: str
+    effective_uid: int, effective_gid: int, root_path: str, content_image: str
 ) -> List[str]:
     """Create the string used to invoke the container build"""
     return [
@@ -142,6 +216,8 @@ def _container_build_invoke_cmd(
         f"{_container_image_specific()}",
         "-t",
         f"{_container_image_latest()}",
+        "-t",
+        content_image,
         root_path,
     ]
 
@@ -150,12 +226,15 @@ def _build_container(
     effective_uid: int,
     effective_gid: int,
     root_path: str,
+    content_image: str,
     output: io.TextIOBase,
     verbose: bool = False,
 ) -> str:
     """Build the docker container and return a keyword usable to run it."""
     print("Creating container", file=output)
-    invoke_str = _container_build_invoke_cmd(effective_uid, effective_gid, root_path)
+    invoke_str = _container_build_invoke_cmd(
+        effective_uid, effective_gid, root_path, content_image
+    )
     run_simple(
         invoke_str,
         name="build container",
@@ -163,19 +242,23 @@ def _build_container(
         cwd=root_path,
         verbose=verbose,
     )
-    print(f"Created container: {_container_image_specific()}", file=output)
-    return _container_image_specific()
+    print(f"Created container: {content_image}", file=output)
+    return content_image
 
 
 def _container_run_invoke_cmd(
-    container_str: str, forwarded_argv: List[str], root_path: str
+    container_str: str,
+    forwarded_argv: List[str],
+    root_path: str,
+    cache_path: Optional[str] = None,
 ) -> List[str]:
     """Build the string to run the container."""
     volume_path = os.path.realpath(os.path.join(root_path, os.path.pardir))
-    return [
-        "docker",
-        "run",
-        "--rm",
-        f"--volume={volume_path}:/build-environment/python-package-index:rw,delegated",
-        container_str,
-    ] + forwarded_argv
+    volumes = [
+        f"--volume={volume_path}:/build-environment/python-package-index:rw,delegated"
+    ]
+    if cache_path:
+        volumes.append(f"--volume={cache_path}:{CONTAINER_CACHE_ROOT}:rw,delegated")
+        # the last --cache-root wins, so this overrides whatever was forwarded
+        forwarded_argv = forwarded_argv + [f"--cache-root={CONTAINER_CACHE_ROOT}"]
+    return ["docker", "run", "--rm"] + volumes + [container_str] + forwarded_argv
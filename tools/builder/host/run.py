@@ -7,13 +7,16 @@ from typing import List, NoReturn
 
 import builder.common.args
 from builder.common.shellcommand import ShellCommandFailed
+from builder.common.cache_areas import run_cache_command
 import builder
 
+from .cache import host_cache_root
 from .containers import run_container, prep_container
 
 ROOT_PATH = os.path.realpath(
     os.path.join(os.path.dirname(builder.__file__), os.path.pardir)
 )
+REPO_ROOT = os.path.realpath(os.path.join(ROOT_PATH, os.path.pardir))
 
 
 def run_from_cmdline() -> NoReturn:
@@ -26,8 +29,18 @@ def run_from_cmdline() -> NoReturn:
     """
     parser = build_arg_parser()
     args = parser.parse_args()
+    builder.common.args.check_command(parser, args)
     try:
-        run_build(sys.argv, args)
+        if args.command == "cache":
+            # the caches are on the host, so this doesn't need the container
+            run_cache_command(
+                args.action,
+                host_cache_root(args.cache_root, REPO_ROOT),
+                args.cache_budget_mb,
+                args.output,
+            )
+        else:
+            run_build(sys.argv, args)
     except ShellCommandFailed as scf:
         # Special handling for shell commands that fail: mostly they're not going to
         # be interesting especially if they're from the package build
@@ -82,7 +95,17 @@ def run_build(argv: List[str], parsed_args: argparse.Namespace) -> None:
     )
     if parsed_args.prep_container_only:
         return
-    run_container(container_str, argv[1:], ROOT_PATH, parsed_args.output, True)
+    cache_root = host_cache_root(parsed_args.cache_root, REPO_ROOT)
+    # made here so that it belongs to the host user rather than to docker's root
+    cache_root.mkdir(parents=True, exist_ok=True)
+    run_container(
+        container_str,
+        argv[1:],
+        ROOT_PATH,
+        parsed_args.output,
+        True,
+        cache_path=str(cache_root),
+    )
 
 
 def build_arg_parser() -> argparse.ArgumentParser:
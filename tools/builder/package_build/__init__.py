@@ -8,6 +8,7 @@ to import in a build.py for  a single package build.
 from typing import overload
 from .types import GithubDevSource, GithubReleaseSDistSource
 from .orchestrate import build_package
+from .extract import DEFAULT_EXCLUDE
 
 
 @overload
@@ -18,13 +19,24 @@ def github_source(
     tag: str,
     sdist_archive: str,
     name: str | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    sha256: str | None = None,
 ) -> GithubReleaseSDistSource:
     pass
 
 
 @overload
 def github_source(
-    *, org: str, repo: str, tag: str, name: str | None = None, path: str | None = None
+    *,
+    org: str,
+    repo: str,
+    tag: str,
+    name: str | None = None,
+    path: str | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    sha256: str | None = None,
 ) -> GithubDevSource:
     pass
 
@@ -37,6 +49,9 @@ def github_source(
     sdist_archive: str | None = None,
     name: str | None = None,
     path: str | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    sha256: str | None = None,
 ) -> GithubDevSource | GithubReleaseSDistSource:
     """
     Tell the system this package is fetched from github.
@@ -55,15 +70,45 @@ def github_source(
                          should be the directory containing the package metadata - the
                          pyproject.toml or setup.py or whatever.
     name: Optional str - a name for the source. If not specified, repo is used.
+    include: Optional list of str - globs of the only parts of the source to unpack.
+    exclude: Optional list of str - globs of parts of the source not to unpack, e.g.
+                                    test suites. If not specified, DEFAULT_EXCLUDE is
+                                    used; to add to it, use
+                                    [*package_build.DEFAULT_EXCLUDE, 'pandas/tests'],
+                                    and to unpack everything, use [].
+    sha256: Optional str - the hex sha256 of the archive that's downloaded. If it's
+                           specified, the download is checked against it as it
+                           arrives and the build fails if it doesn't match, and a
+                           cached archive is used only if it has this digest. The
+                           build prints the digest of unpinned sources.
+
+    The globs work like .gitignore: they are matched against paths inside the
+    package source (below path, or the archive's top level directory), * does not
+    match /, ** matches anything, a glob with no / in it matches at any depth, and
+    a glob that matches a directory matches everything in it.
     """
     sourcename = name or repo
     if sdist_archive:
         return GithubReleaseSDistSource(
-            name=sourcename, org=org, repo=repo, tag=tag, package_name=sdist_archive
+            name=sourcename,
+            org=org,
+            repo=repo,
+            tag=tag,
+            package_name=sdist_archive,
+            include=include,
+            exclude=exclude,
+            sha256=sha256,
         )
     return GithubDevSource(
-        name=sourcename, org=org, repo=repo, tag=tag, package_source_path=path
+        name=sourcename,
+        org=org,
+        repo=repo,
+        tag=tag,
+        package_source_path=path,
+        include=include,
+        exclude=exclude,
+        sha256=sha256,
     )
 
 
-__all__ = ["github_source", "build_package"]
+__all__ = ["github_source", "build_package", "DEFAULT_EXCLUDE"]
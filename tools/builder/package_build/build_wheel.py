@@ -1,14 +1,99 @@
 """build.build_wheel - utilities to build a single wheel"""
-from .shell_environment import SDKSubshell
+from .shell_environment import (
+    EchoFunc,
+    SDKShell,
+    scoped_sdk_shell,
+    echo_wrap_prevent_double_newlines,
+)
 from pathlib import Path
 from .types import GlobalBuildContext
+from .venv_cache import VenvCache
+from .compiler_cache import CompilerCache, compiler_cache_for, read_stats_log
+from .report import COMMAND, BuildReport
+from .pipeline import COMPILE, DEPS
+from .lockfile import (
+    DependencyLock,
+    discard_directory,
+    lock_downloaded,
+    pip_download_command,
+    pip_fill_command,
+    pip_install_command,
+    resolving_directory,
+)
+from .wheelhouse import WHEELHOUSE_DIR, check_available, pip_index_args
+from contextlib import contextmanager
+from functools import partial
+from builder.common.cache import record_lookups, remove
+import os
 import re
+import time
 from typing import Iterator
 
 
-def args_for_build_ext(source_dir: Path, build_dir: Path, dist_dir: Path) -> list[str]:
-    """args for build ext"""
-    return [f"--build-lib={build_dir}", f"--build-temp={build_dir}"]
+def available_cpus() -> int:
+    """How many CPUs this process may run on, which in a container may be fewer
+    than the machine has."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def compile_parallelism(
+    requested: int | None, jobs: int, cpus: int | None = None
+) -> int:
+    """
+    How many compiler processes one package build should run at once.
+
+    The CPUs are split between the packages that may compile at the same time, so
+    that with several jobs they aren't oversubscribed. A package can ask for less
+    than its share - e.g. 1, if its build can't run in parallel - but not more.
+    """
+    share = max(1, (cpus or available_cpus()) // max(jobs, 1))
+    return max(1, min(requested or share, share))
+
+
+def parallel_build_environment(parallel: int) -> dict[str, str]:
+    """Environment that tells make-driven builds how many jobs to run."""
+    return {"MAKEFLAGS": f"-j{parallel}", "CMAKE_BUILD_PARALLEL_LEVEL": str(parallel)}
+
+
+#: setup.py commands that throw away what the build commands made
+CLEAN_COMMANDS = frozenset({"clean"})
+
+_building_extension_re = re.compile(r"^building '([^']+)' extension", re.MULTILINE)
+_running_command_re = re.compile(r"^running (\w+)$")
+
+
+def build_layout(build_dir: Path) -> tuple[Path, Path, Path]:
+    """
+    Where setup.py puts its build products in build_dir: the built package, which
+    the wheel is made from; compiler intermediates; and the tree bdist_wheel
+    installs into to zip it up. They're kept apart so intermediates never end up in
+    the wheel and bdist_wheel never writes over what it's packaging.
+    """
+    return build_dir / "lib", build_dir / "temp", build_dir / "wheel"
+
+
+def args_for_build(
+    source_dir: Path, build_dir: Path, dist_dir: Path, parallel: int = 1
+) -> list[str]:
+    """
+    args for build. build_ext and bdist_wheel's own build both take their
+    directories from the build command, so giving them to it once means they agree.
+    """
+    lib, temp, _ = build_layout(build_dir)
+    args = [f"--build-base={build_dir}", f"--build-lib={lib}", f"--build-temp={temp}"]
+    if parallel > 1:
+        args.append(f"--parallel={parallel}")
+    return args
+
+
+def args_for_build_ext(
+    source_dir: Path, build_dir: Path, dist_dir: Path, parallel: int = 1
+) -> list[str]:
+    """args for build ext; its directories come from build"""
+    return [f"--parallel={parallel}"] if parallel > 1 else []
 
 
 def args_for_bdist_wheel(
@@ -17,19 +102,21 @@ def args_for_bdist_wheel(
     """args for wheel"""
     return [
         f"--dist-dir={str(dist_dir)}",
-        f"--bdist-dir={str(build_dir)}",
+        f"--bdist-dir={str(build_layout(build_dir)[2])}",
         "--plat-name=linux_armv7l",
     ]
 
 
 def args_for_command(
-    command: str, source_dir: Path, build_dir: Path, dist_dir: Path
+    command: str, source_dir: Path, build_dir: Path, dist_dir: Path, parallel: int = 1
 ) -> list[str]:
     """Different setup.py commands use different arguments. Look them up."""
 
     match command:
+        case "build":
+            return args_for_build(source_dir, build_dir, dist_dir, parallel)
         case "build_ext":
-            return args_for_build_ext(source_dir, build_dir, dist_dir)
+            return args_for_build_ext(source_dir, build_dir, dist_dir, parallel)
         case "bdist_wheel":
             return args_for_bdist_wheel(source_dir, build_dir, dist_dir)
         case _:
@@ -37,6 +124,121 @@ def args_for_command(
     return []
 
 
+def check_single_compile(commands: list[str]) -> None:
+    """
+    Make sure a sequence of setup.py commands compiles everything once: no command
+    is repeated, and nothing cleans up what an earlier command built. Raises
+    ValueError if it doesn't.
+    """
+    seen: set[str] = set()
+    for command in commands:
+        if command in seen:
+            raise ValueError(
+                f"setup.py command {command} is listed more than once in {commands}"
+            )
+        if command in CLEAN_COMMANDS and seen:
+            raise ValueError(
+                f"setup.py command {command} would throw away what {sorted(seen)} built"
+            )
+        seen.add(command)
+
+
+def setup_py_command_line(
+    commands: list[str],
+    source_dir: Path,
+    build_dir: Path,
+    dist_dir: Path,
+    parallel: int = 1,
+) -> list[str]:
+    """
+    The one setup.py command line that runs all of commands.
+
+    Running them in one process means a command that another one depends on runs
+    only once: when bdist_wheel runs build, the build_ext that already ran is
+    skipped, or finds its extensions up to date in the shared build directory, so
+    nothing is compiled twice. build comes first so its options apply to all of
+    them.
+    """
+    check_single_compile(commands)
+    command_line = ["python", "setup.py"]
+    for command in setup_py_commands(commands):
+        command_line += [command] + args_for_command(
+            command, source_dir, build_dir, dist_dir, parallel
+        )
+    return command_line
+
+
+def setup_py_commands(commands: list[str]) -> list[str]:
+    """The setup.py commands in the order setup_py_command_line runs them."""
+    return ["build"] + [command for command in commands if command != "build"]
+
+
+class SetupPyCommandTimer:
+    """
+    Times each command of a setup.py run that does several of them in one process.
+
+    setup.py prints "running <command>" as each command starts, so the output is
+    fed through echo as it arrives and a command is taken to last until the next
+    one starts. The time before the first of them, when setup.py itself runs (and
+    e.g. cythonizes), is its own span. A command that another one already ran as a
+    sub-command is skipped by setup.py and so gets no span; e.g. with build first,
+    build_ext's span starts when build runs it.
+    """
+
+    def __init__(self, commands: list[str], echo: EchoFunc) -> None:
+        self._commands = commands
+        self._echo = echo
+        #: (command, wall clock start, perf_counter start) of each one seen
+        self._started: list[tuple[str, float, float]] = []
+        self._watching = False
+
+    def echo(self, line: str) -> None:
+        self._echo(line)
+        if not self._watching:
+            return
+        match = _running_command_re.match(line.strip())
+        if not match or match.group(1) not in self._commands:
+            return
+        if match.group(1) in (command for command, _, _ in self._started):
+            return
+        self._started.append((match.group(1), time.time(), time.perf_counter()))
+
+    @contextmanager
+    def timing(self, report: BuildReport, package: str | None) -> Iterator[None]:
+        """Record a phase span for each command that starts during the context."""
+        self._started = [("", time.time(), time.perf_counter())]
+        self._watching = True
+        failed: str | None = None
+        try:
+            yield
+        except BaseException as exc:
+            failed = type(exc).__name__
+            raise
+        finally:
+            self._watching = False
+            ended = time.perf_counter()
+            ends = [began for _, _, began in self._started[1:]] + [ended]
+            for index, ((command, start, began), end) in enumerate(
+                zip(self._started, ends)
+            ):
+                # only the command that was running when it failed failed
+                last = index == len(ends) - 1
+                args = {"failed": failed} if failed and last else {}
+                report.add_span(
+                    f"setup.py {command}".strip(),
+                    start,
+                    end - began,
+                    package=package,
+                    **args,
+                )
+
+
+def recompiled_extensions(output: str) -> list[str]:
+    """The extensions that setup.py output says were built more than once."""
+    built = _building_extension_re.findall(output)
+    return sorted({name for name in built if built.count(name) > 1})
+
+
 def update_build_dependencies(deps: list[str]) -> Iterator[str]:
     """some build dependencies need alteration to actually match what buildroot does."""
     for dep in deps:
@@ -55,6 +257,194 @@ def update_build_dependencies(deps: list[str]) -> Iterator[str]:
             yield dep
 
 
+def normalized_build_dependencies(deps: list[str]) -> list[str]:
+    """The full, canonically ordered list of requirements to install in a build venv."""
+    return sorted(
+        {dep.strip() for dep in update_build_dependencies(deps) if dep.strip()}
+        | {"wheel"}
+    )
+
+
+_interpreter_re = re.compile(r"^xxxinterpreterxxx:(.*)$", flags=re.MULTILINE)
+
+
+def interpreter_identity(shell: SDKShell) -> str:
+    """Identify the python that the shell will make venvs with."""
+    output = shell.run(
+        [
+            "python",
+            "-c",
+            "import sys; print('xxxinterpreterxxx:' + sys.executable + ':' + sys.version)",
+        ]
+    )
+    match = _interpreter_re.search(output)
+    if not match:
+        raise RuntimeError("Could not identify the build interpreter")
+    return match.group(1).strip()
+
+
+def pip_environment(cache_root: Path | None = None) -> dict[str, str]:
+    """Environment for running pip in a build venv with the SDK active."""
+    # we have to allow importing from the system python path because
+    # with the activated buildroot sdk, we'll be using the python in there,
+    # and that python doesn't have ssl, and we need ssl to use pypi. things
+    # still get installed to the venv if we don't provide a path that includes
+    # site-packages.
+    own_paths = [
+        "/usr/local/lib/python3.10",
+        "/usr/local/lib/python3.10/lib-dynload",
+    ]
+    env = {"PYTHONPATH": ":".join(own_paths)}
+    if cache_root:
+        # pip's own cache would otherwise go away with the container
+        env["PIP_CACHE_DIR"] = str(cache_root / "pip")
+    return env
+
+
+def prepare_venv(
+    shell: SDKShell,
+    venv_dir: Path,
+    dependencies: list[str],
+    lock_path: Path | None = None,
+    wheelhouse: Path | None = None,
+    *,
+    offline: bool = False,
+    cache_root: Path | None = None,
+) -> None:
+    """
+    Create a venv in venv_dir and install dependencies in it - or, if there's a
+    lock_path, exactly what it locks, from wheelhouse. pip looks for distributions in
+    the wheelhouse first, and if offline, only there.
+    """
+    shell.run(["python", "-m", "venv", str(venv_dir)])
+    python = str(venv_dir / "bin" / "python")
+    env = pip_environment(cache_root)
+    index_args = pip_index_args(wheelhouse, offline) if wheelhouse else []
+    if lock_path is None or wheelhouse is None:
+        shell.run([python, "-m", "pip", "install"] + index_args + dependencies, env=env)
+        return
+    lock = DependencyLock.load(lock_path)
+    complete = lock is not None and not lock.missing_from(wheelhouse)
+    record_lookups(wheelhouse, hits=int(complete), misses=int(not complete))
+    if not complete:
+        # a lock from the repo, or a wheelhouse that's been cleared
+        if offline and lock is not None:
+            check_available(lock, lock_path, wheelhouse)
+        shell.run(pip_fill_command(python, lock_path, wheelhouse, index_args), env=env)
+    shell.run(pip_install_command(python, lock_path, wheelhouse), env=env)
+
+
+def wheelhouse_for(context: GlobalBuildContext, venv_dir: Path) -> Path:
+    """
+    Where build dependencies are downloaded to (see
+    builder.package_build.wheelhouse).
+    """
+    if context.cache_root is None:
+        return venv_dir.parent / WHEELHOUSE_DIR
+    return context.cache_root / WHEELHOUSE_DIR
+
+
+def lock_build_dependencies(
+    shell: SDKShell,
+    venv_dir: Path,
+    dependencies: list[str],
+    lock_path: Path,
+    wheelhouse: Path,
+    *,
+    context: GlobalBuildContext,
+) -> DependencyLock:
+    """
+    The lock of dependencies in lock_path, resolving them and writing it if it's
+    missing, was resolved from different dependencies, or locks are being refreshed.
+    Resolving leaves a bare venv in venv_dir.
+    """
+    lock = DependencyLock.load(lock_path)
+    if lock and lock.matches(dependencies) and not context.refresh_locks:
+        return lock
+    context.write(f"Resolving build dependencies into {lock_path}")
+    # the venv may be an earlier clone that shares its files with the cache
+    remove(venv_dir)
+    shell.run(["python", "-m", "venv", str(venv_dir)])
+    downloaded = resolving_directory(wheelhouse)
+    try:
+        shell.run(
+            pip_download_command(
+                str(venv_dir / "bin" / "python"),
+                dependencies,
+                downloaded,
+                pip_index_args(wheelhouse, context.offline),
+            ),
+            env=pip_environment(context.cache_root),
+        )
+        lock = lock_downloaded(dependencies, downloaded, wheelhouse)
+    finally:
+        discard_directory(downloaded)
+    lock.write(lock_path)
+    context.write_verbose(f"Locked build dependencies:\n{lock.render()}")
+    return lock
+
+
+def prepare_venv_cached(
+    shell: SDKShell,
+    venv_dir: Path,
+    dependencies: list[str],
+    *,
+    context: GlobalBuildContext,
+    lock_path: Path | None = None,
+) -> None:
+    """
+    Make venv_dir a venv with dependencies installed, cloning it from the venv
+    cache if possible and adding it to the cache if not. With a lock_path, the
+    dependencies are installed from their lock (see builder.package_build.lockfile),
+    and the venv is cached by exactly what the lock pins.
+    """
+    installs = dependencies
+    wheelhouse = wheelhouse_for(context, venv_dir)
+    if lock_path is not None:
+        installs = lock_build_dependencies(
+            shell, venv_dir, dependencies, lock_path, wheelhouse, context=context
+        ).pins()
+    prepare = partial(
+        prepare_venv,
+        shell,
+        venv_dir,
+        dependencies,
+        lock_path,
+        wheelhouse,
+        offline=context.offline,
+        cache_root=context.cache_root,
+    )
+    if context.cache_root is None:
+        prepare()
+        return
+    venv_cache = VenvCache(context.cache_root / "venvs")
+    key = venv_cache.key(installs, interpreter_identity(shell))
+    cached = venv_cache.lookup(key)
+    if cached:
+        context.write(f"Using cached build venv {cached}")
+        venv_cache.clone_to(cached, venv_dir)
+        return
+    context.write(f"Preparing build venv with {' '.join(dependencies)}")
+    # the venv may be an earlier clone that shares its files with the cache
+    remove(venv_dir)
+    prepare()
+    stored = venv_cache.store(key, venv_dir)
+    context.write_verbose(f"Cached build venv in {stored}")
+
+
+def _record_compiler_cache_stats(
+    compiler_cache: CompilerCache, package: str | None, context: GlobalBuildContext
+) -> None:
+    stats = read_stats_log(compiler_cache.stats_log)
+    record_lookups(
+        compiler_cache.cache_dir,
+        hits=stats.get("hits", 0),
+        misses=stats.get("misses", 0),
+    )
+    if package:
+        context.report.record_stats(package, "ccache", stats)
+
+
 def build_with_setup_py(
     commands: list[str],
     source_dir: Path,
@@ -64,37 +454,66 @@ def build_with_setup_py(
     build_dependencies: list[str],
     *,
     context: GlobalBuildContext,
+    package: str | None = None,
+    parallel: int = 1,
+    lock_path: Path | None = None,
 ) -> Path:
-    """Build a package."""
-    context.write(f'Building package with python setup.py {" ".join(commands)}')
-    with SDKSubshell.scoped(
+    """
+    Build a package.
+
+    package: the name of the package in the build report, if it's being timed
+    parallel: how many compiler processes to run at once (see compile_parallelism)
+    lock_path: where the lock of build_dependencies is, or should be written, if
+               they're installed from one (see builder.package_build.lockfile)
+    """
+    context.write(
+        f'Building package with python setup.py {" ".join(commands)} '
+        f"({parallel} parallel compiles)"
+    )
+    command_timer = SetupPyCommandTimer(
+        setup_py_commands(commands),
+        echo_wrap_prevent_double_newlines(context.write_verbose),
+    )
+    with scoped_sdk_shell(
+        context.sdk_environment,
         source_dir,
         context.sdk_path,
-        SDKSubshell.echo_wrap_prevent_double_newlines(context.write),
-        SDKSubshell.echo_wrap_prevent_double_newlines(context.write_verbose),
+        echo_wrap_prevent_double_newlines(context.write),
+        command_timer.echo,
+        context.cache_root / "sdk-env" if context.cache_root else None,
+        partial(context.report.span, category=COMMAND, package=package),
     ) as shell:
-        shell.run(["python", "-m", "venv", str(venv_dir)])
-        shell.run(["source", str(venv_dir / "bin" / "activate")])
-        # we have to allow importing from the system python path because
-        # with the activated buildroot sdk, we'll be using the python in there,
-        # and that python doesn't have ssl, and we need ssl to use pypi. things
-        # still get installed to the venv if we don't provide a path that includes
-        # site-packages.
-        own_paths = [
-            "/usr/local/lib/python3.10",
-            "/usr/local/lib/python3.10/lib-dynload",
-        ]
-        shell.run(
-            [f'PYTHONPATH={":".join(own_paths)}', "python", "-m", "pip", "install"]
-            + [dep for dep in build_dependencies]
-            + ["wheel"]
+        with context.stage(DEPS), context.report.span("venv", package=package):
+            prepare_venv_cached(
+                shell,
+                venv_dir,
+                normalized_build_dependencies(build_dependencies),
+                context=context,
+                lock_path=lock_path,
+            )
+        shell.activate_venv(venv_dir)
+        compiler_cache = compiler_cache_for(
+            context.cache_root, build_dir.parent, build_dir.parent / "ccache-stats.log"
+        )
+        shell.initiate_python_environment(context.sdk_path, compiler_cache)
+        command_line = setup_py_command_line(
+            commands, source_dir, build_dir, dist_dir, parallel
         )
-        shell.initiate_python_environment(context.sdk_path)
-        output = ""
-        for command in commands:
-            output += shell.run(
-                ["python", "setup.py", command]
-                + args_for_command(command, source_dir, build_dir, dist_dir)
+        # products of an earlier build of a different source could look up to date
+        for directory in build_layout(build_dir):
+            remove(directory)
+        try:
+            with context.stage(COMPILE), command_timer.timing(context.report, package):
+                output = shell.run(
+                    command_line, env=parallel_build_environment(parallel)
+                )
+        finally:
+            if compiler_cache:
+                _record_compiler_cache_stats(compiler_cache, package, context)
+        recompiled = recompiled_extensions(output)
+        if recompiled:
+            context.write(
+                f"Warning: extensions compiled twice: {', '.join(recompiled)}"
             )
         wheelname = re.search(r"^creating.*?([\w\-\.]*\.whl).*$", output, re.MULTILINE)
         if not wheelname:
@@ -0,0 +1,83 @@
+"""builder.package_build.compiler_cache - cache compiled objects with ccache"""
+from dataclasses import dataclass
+from pathlib import Path
+import shutil
+
+#: The variables holding compilers to wrap
+WRAPPED_COMPILERS = ("CC", "CXX")
+#: How big the compiler cache may grow; ccache evicts old objects past this
+CCACHE_MAX_SIZE = "5G"
+
+
+@dataclass
+class CompilerCache:
+    cache_dir: Path
+    #: Where ccache keeps its objects, shared by all packages
+    base_dir: Path
+    #: Paths under this are hashed relative to the compile directory, so builds of
+    #: the same source in different places can share objects
+    stats_log: Path
+    #: Where ccache logs the result of each compilation for this package
+    launcher: str = "ccache"
+    #: The ccache executable
+
+    def environment(self) -> dict[str, str]:
+        """The variables that configure ccache for a build."""
+        return {
+            "CCACHE_DIR": str(self.cache_dir),
+            "CCACHE_BASEDIR": str(self.base_dir),
+            "CCACHE_NOHASHDIR": "1",
+            # the sdk is relocated into place, so its compiler's mtime says
+            # nothing about whether it changed
+            "CCACHE_COMPILERCHECK": "content",
+            "CCACHE_SLOPPINESS": "include_file_ctime,time_macros",
+            "CCACHE_MAXSIZE": CCACHE_MAX_SIZE,
+            "CCACHE_STATSLOG": str(self.stats_log),
+        }
+
+    def wrap(self, compiler: str) -> str:
+        """Wrap a compiler command line in ccache."""
+        if not compiler or compiler.split()[0] == self.launcher:
+            return compiler
+        return f"{self.launcher} {compiler}"
+
+
+def compiler_cache_for(
+    cache_root: Path | None, base_dir: Path, stats_log: Path
+) -> CompilerCache | None:
+    """
+    The compiler cache for a package build, or None if there is no cache root or
+    ccache isn't installed.
+    """
+    if cache_root is None:
+        return None
+    launcher = shutil.which("ccache")
+    if not launcher:
+        return None
+    stats_log.unlink(missing_ok=True)
+    return CompilerCache(cache_root / "ccache", base_dir, stats_log, launcher)
+
+
+def read_stats_log(stats_log: Path) -> dict[str, int]:
+    """
+    Summarize a ccache stats log: a line naming each input file, followed by the
+    counters that compilation bumped (e.g. direct_cache_hit, cache_miss).
+    """
+    counters: dict[str, int] = {}
+    try:
+        lines = stats_log.read_text().splitlines()
+    except FileNotFoundError:
+        return {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        counters[line] = counters.get(line, 0) + 1
+    hits = sum(count for name, count in counters.items() if name.endswith("_hit"))
+    misses = counters.get("cache_miss", 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "uncacheable": sum(counters.values()) - hits - misses,
+        **counters,
+    }
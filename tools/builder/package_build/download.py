@@ -2,139 +2,507 @@
 builder.package_build.download - tools to download package sources
 """
 
+import fcntl
 import os
-import zipfile
-import tarfile
+import threading
+import time
 import requests
+from contextlib import ExitStack, contextmanager
+from hashlib import sha256
 from pathlib import Path
+from typing import Any, Callable, ContextManager, Iterator
+from requests.adapters import HTTPAdapter
+from builder.common.cache import (
+    atomic_path,
+    evict_lru,
+    link_or_copy,
+    record_lookups,
+    touch,
+)
 from .types import HTTPFetchableSource, GlobalBuildContext
+from .extract import MemberFilter, extract_tar, extract_zip
+
+
+class DownloadCache:
+    """
+    A cache of downloaded source archives that can be shared between package
+    builds, build trees and concurrent builders.
+
+    Archives are stored once, under the sha256 of their contents, in blobs/;
+    urls/ maps the sha256 of each fetched URL to the digest of what it returned.
+    When the blobs grow past max_bytes, the least recently used are evicted.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = root / "blobs"
+        self._urls = root / "urls"
+        self._incoming = root / "incoming"
+
+    def blob_path(self, digest: str) -> Path:
+        return self._blobs / digest
+
+    def lookup(
+        self, url: str, sha256: str | None = None, count: bool = True
+    ) -> Path | None:
+        """
+        Find the cached archive for a URL, if there is one. If the archive's sha256
+        is pinned, only an archive with that digest is returned. Blobs are named
+        by the digest of what was streamed into them, so this needs neither the
+        network nor reading the archive again. Unless count is False, the lookup
+        counts towards the cache's hit rate.
+        """
+        blob = self._find(url, sha256)
+        if count:
+            record_lookups(self.root, hits=int(bool(blob)), misses=int(not blob))
+        if blob:
+            touch(blob)
+        return blob
+
+    def _find(self, url: str, sha256: str | None) -> Path | None:
+        if sha256:
+            digest = sha256.lower()
+        else:
+            try:
+                digest = (self._urls / _url_key(url)).read_text().strip()
+            except OSError:
+                return None
+        blob = self.blob_path(digest)
+        return blob if blob.is_file() else None
+
+    def incoming_path(self, url: str) -> Path:
+        """
+        Where to download a URL to before storing it with store_file. The path is
+        the same every time, so an interrupted download can be resumed.
+        """
+        self._incoming.mkdir(parents=True, exist_ok=True)
+        return self._incoming / _url_key(url)
+
+    def store_file(self, url: str, path: Path, digest: str) -> Path:
+        """Move a file downloaded from a URL, with sha256 digest, into the cache."""
+        for directory in (self._blobs, self._urls):
+            directory.mkdir(parents=True, exist_ok=True)
+        blob = self.blob_path(digest)
+        os.replace(path, blob)
+        with atomic_path(self._urls / _url_key(url)) as pointer:
+            pointer.write_text(digest)
+        evict_lru(self._blobs, self.max_bytes, keep=(blob,))
+        return blob
+
+
+def _url_key(url: str) -> str:
+    return sha256(url.encode()).hexdigest()
+
+
+#: HTTP statuses that mean the request may work if it's tried again
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+#: How much of a download to read at a time, and so at most how much a dropped
+#: connection loses
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+#: The longest a server can ask us to wait before retrying
+MAX_RETRY_AFTER = 60.0
+
+
+class DownloadFailed(RuntimeError):
+    """A download failed, and retrying wouldn't help or didn't."""
+
+
+class ChecksumMismatch(DownloadFailed):
+    """A download's contents didn't have the sha256 they were pinned to."""
+
+
+class _RetryableError(Exception):
+    def __init__(self, reason: str, delay: float | None = None) -> None:
+        super().__init__(reason)
+        self.delay = delay
+
+
+class _PartialDownload:
+    """
+    A download in progress in a .part file, with the hash of what's been written so
+    far and the validator (ETag or Last-Modified) of the response it came from, so
+    that it can be resumed with a Range request.
+    """
+
+    def __init__(self, target: Path) -> None:
+        self.path = target.with_name(target.name + ".part")
+        self._validator_path = target.with_name(target.name + ".part.validator")
+        self.hasher: Any = sha256()
+        self.size = 0
+        self.validator: str | None = None
+
+    def resume(self) -> None:
+        """Pick up where an earlier process left off, if it left a resumable file."""
+        try:
+            validator = self._validator_path.read_text().strip()
+            with open(self.path, "rb") as part:
+                for chunk in iter(lambda: part.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    self.hasher.update(chunk)
+                    self.size += len(chunk)
+            self.validator = validator
+        except OSError:
+            self.restart()
+
+    def restart(self) -> None:
+        """Throw away what's been downloaded."""
+        self.path.unlink(missing_ok=True)
+        self._validator_path.unlink(missing_ok=True)
+        self.hasher = sha256()
+        self.size = 0
+        self.validator = None
+
+    def set_validator(self, validator: str | None) -> None:
+        # a weak validator can't be used to resume a byte range
+        if validator and not validator.startswith("W/"):
+            self.validator = validator
+            self._validator_path.write_text(validator)
+        else:
+            self.validator = None
+            self._validator_path.unlink(missing_ok=True)
+
+    def finish(self, target: Path) -> str:
+        os.replace(self.path, target)
+        self._validator_path.unlink(missing_ok=True)
+        return str(self.hasher.hexdigest())
+
+
+@contextmanager
+def _locked(lock_path: Path) -> Iterator[None]:
+    """
+    Keep other builders from writing the same partial download. The lock file is
+    removed before the lock is released, so a builder that was waiting on it finds
+    it gone and locks a new one instead.
+    """
+    while True:
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(lock_path)
+            except FileNotFoundError:
+                continue
+            if not os.path.samestat(current, os.fstat(lock_file.fileno())):
+                continue
+            try:
+                yield
+            finally:
+                lock_path.unlink(missing_ok=True)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return
+
+
+def _download_lock(target: Path) -> ContextManager[None]:
+    return _locked(target.with_name(target.name + ".lock"))
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    try:
+        return min(float(response.headers["Retry-After"]), MAX_RETRY_AFTER)
+    except (KeyError, ValueError):
+        return None
+
+
+def _expected_size(response: requests.Response, offset: int) -> int | None:
+    """How big the whole file will be once this response has been written."""
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _resumes_at(response: requests.Response, offset: int) -> bool:
+    """Whether a response is the rest of a file from offset on."""
+    return response.status_code == 206 and response.headers.get(
+        "Content-Range", ""
+    ).startswith(f"bytes {offset}-")
+
+
+class DownloadManager:
+    """
+    Downloads files over a pool of kept-alive connections, a few at a time.
+
+    Failed attempts - dropped connections, timeouts, and statuses in
+    RETRY_STATUSES - are retried with exponential backoff. Each attempt resumes
+    from the end of what the previous ones wrote, with a Range request, and the
+    contents are hashed as they're written.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        retries: int = 5,
+        backoff: float = 1.0,
+        timeout: tuple[float, float] = (10.0, 60.0),
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    ) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_concurrent, pool_maxsize=max_concurrent
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def download(
+        self,
+        url: str,
+        target: Path,
+        echo: Callable[[str], None] | None = None,
+        expected_sha256: str | None = None,
+        locked: bool = False,
+    ) -> str:
+        """
+        Download url to target and return the hex sha256 digest of its contents.
+        If an earlier download of it to target was interrupted, this one picks up
+        where that left off. Raises DownloadFailed if it can't be downloaded, and
+        ChecksumMismatch if expected_sha256 is given and the contents don't have
+        it, in which case nothing is left at target.
+
+        Other builders are kept from downloading to target at the same time with
+        _download_lock(target), unless locked says the caller already holds it.
+        """
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with ExitStack() as stack:
+            if not locked:
+                stack.enter_context(_download_lock(target))
+            return self._download(url, target, echo, expected_sha256)
+
+    def _download(
+        self,
+        url: str,
+        target: Path,
+        echo: Callable[[str], None] | None,
+        expected_sha256: str | None,
+    ) -> str:
+        partial = _PartialDownload(target)
+        with self._slots:
+            partial.resume()
+            for attempt in range(self.retries + 1):
+                try:
+                    self._attempt(url, partial)
+                    _verify(url, partial, expected_sha256)
+                    return partial.finish(target)
+                except _RetryableError as retry:
+                    if attempt == self.retries:
+                        raise DownloadFailed(
+                            f"Could not download {url} in {attempt + 1} attempts: {retry}"
+                        ) from retry
+                    delay = (
+                        self.backoff * 2**attempt
+                        if retry.delay is None
+                        else retry.delay
+                    )
+                    if echo:
+                        echo(
+                            f"Download of {url} failed ({retry}), retrying in {delay:.1f}s "
+                            f"from byte {partial.size}"
+                        )
+                    time.sleep(delay)
+                except requests.RequestException as exc:
+                    raise DownloadFailed(f"Could not download {url}: {exc}") from exc
+        raise DownloadFailed(f"Could not download {url}")
+
+    def _attempt(self, url: str, partial: _PartialDownload) -> None:
+        # compressed transfers would make byte ranges mean something else
+        headers = {"Accept-Encoding": "identity"}
+        if partial.size:
+            headers["Range"] = f"bytes={partial.size}-"
+            if partial.validator:
+                headers["If-Range"] = partial.validator
+        try:
+            with self.session.get(
+                url, headers=headers, stream=True, timeout=self.timeout
+            ) as response:
+                self._write_response(response, partial)
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as exc:
+            raise _RetryableError(type(exc).__name__) from exc
+
+    def _write_response(
+        self, response: requests.Response, partial: _PartialDownload
+    ) -> None:
+        if response.status_code in RETRY_STATUSES:
+            raise _RetryableError(
+                f"HTTP {response.status_code}", _retry_after(response)
+            )
+        if response.status_code == 416:
+            partial.restart()
+            raise _RetryableError("HTTP 416", 0.0)
+        response.raise_for_status()
+        if not _resumes_at(response, partial.size):
+            # the server sent the whole thing, because it doesn't do ranges or
+            # because the file changed
+            partial.restart()
+        partial.set_validator(
+            response.headers.get("ETag") or response.headers.get("Last-Modified")
+        )
+        expected = _expected_size(response, partial.size)
+        with open(partial.path, "ab") as part:
+            for chunk in response.iter_content(self.chunk_size):
+                part.write(chunk)
+                partial.hasher.update(chunk)
+                partial.size += len(chunk)
+        if expected is not None and partial.size != expected:
+            raise _RetryableError(f"got {partial.size} of {expected} bytes")
+
+
+def _verify(url: str, partial: _PartialDownload, expected_sha256: str | None) -> None:
+    # the digest was computed as the download was written, so there's nothing to read
+    digest = partial.hasher.hexdigest()
+    if expected_sha256 and digest != expected_sha256.lower():
+        partial.restart()
+        raise ChecksumMismatch(
+            f"{url} has sha256 {digest}, but it is pinned to {expected_sha256}"
+        )
+
+
+_shared_manager: DownloadManager | None = None
+_shared_manager_lock = threading.Lock()
+
+
+def shared_download_manager() -> DownloadManager:
+    """The download manager all the package builds in this process share."""
+    global _shared_manager
+    with _shared_manager_lock:
+        if _shared_manager is None:
+            _shared_manager = DownloadManager()
+        return _shared_manager
 
 
 def fetch_source(
     source: HTTPFetchableSource, to_path: Path, *, context: GlobalBuildContext
 ) -> Path:
-    """Fetch a source to a specified download directory."""
-    context.write(f"Fetching {source.name} from {source.url()}")
+    """
+    Fetch a source to a specified download directory.
+
+    If the build context has a cache root, the source goes through the download
+    cache there and is linked into the download directory. Downloads go through
+    the shared DownloadManager, so they're retried and resumed if they fail.
+
+    If the source pins its archive's sha256, the download is checked against it
+    as it's streamed, and only a cached archive with that digest is used.
+    """
     download_to = to_path / source.archive_name()
-    with (
-        requests.get(source.url(), stream=True) as response,
-        open(download_to, "wb") as writefile,
-    ):
-        response.raise_for_status()
-        for chunk in response.iter_content(chunk_size=None):
-            writefile.write(chunk)
-    return download_to
+    expected_sha256: str | None = getattr(source, "sha256", None)
+    manager = shared_download_manager()
+    if context.cache_root is None:
+        context.write(f"Fetching {source.name} from {source.url()}")
+        digest = manager.download(
+            source.url(), download_to, context.write, expected_sha256
+        )
+        _suggest_pin(source, digest, expected_sha256, context=context)
+        return download_to
+    cache = DownloadCache(
+        context.cache_root / "downloads", context.download_cache_mb * 1024 * 1024
+    )
+    cached = cache.lookup(source.url(), expected_sha256)
+    if cached:
+        context.write(f"Using cached {source.name} from {cached}")
+        try:
+            return link_or_copy(cached, download_to)
+        except FileNotFoundError:
+            # another builder evicted it between the lookup and the link
+            context.write_verbose(f"{cached} was evicted, fetching again")
+    incoming = cache.incoming_path(source.url())
+    with _download_lock(incoming):
+        # another builder may have fetched it while this one waited for the lock
+        cached = cache.lookup(source.url(), expected_sha256, count=False)
+        if cached:
+            context.write(f"Using {source.name} just cached by another build")
+        else:
+            context.write(f"Fetching {source.name} from {source.url()}")
+            digest = manager.download(
+                source.url(), incoming, context.write, expected_sha256, locked=True
+            )
+            _suggest_pin(source, digest, expected_sha256, context=context)
+            cached = cache.store_file(source.url(), incoming, digest)
+    return link_or_copy(cached, download_to)
+
+
+def _suggest_pin(
+    source: HTTPFetchableSource,
+    digest: str,
+    expected_sha256: str | None,
+    *,
+    context: GlobalBuildContext,
+) -> None:
+    if not expected_sha256:
+        context.write(
+            f"{source.name} is not pinned; add sha256='{digest}' to its source "
+            "in build.py to pin it"
+        )
 
 
 def unpack_source(
-    path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
+    path: Path,
+    archive: Path,
+    from_archive_path: Path,
+    *,
+    context: GlobalBuildContext,
+    member_filter: MemberFilter | None = None,
 ) -> Path:
     """Unpack a downloaded archive. Returns the path to the actual content - if the
     top level of the archive that is unpacked (either the top level, or from_archive_path)
-    is a directory, the returned path includes that directory."""
+    is a directory, the returned path includes that directory. If member_filter is
+    specified, only the members it wants are unpacked."""
     if ".tar" in archive.name:
-        return _unpack_tar_to(path, archive, from_archive_path, context=context)
+        return _unpack_tar_to(
+            path,
+            archive,
+            from_archive_path,
+            context=context,
+            member_filter=member_filter,
+        )
     else:
-        return _unpack_zip_to(path, archive, from_archive_path, context=context)
-
-
-def _verify_tar_member(
-    path: Path, member: tarfile.TarInfo, *, context: GlobalBuildContext
-) -> tarfile.TarInfo:
-    unpack_to = Path(os.path.realpath(path / Path(member.name).name))
-    try:
-        common = Path(os.path.commonpath([unpack_to, path]))
-    except ValueError:
-        pass
-    if common != path:
-        raise RuntimeError(
-            f"Will not unpack archive member {member.name} to {unpack_to}: outside unpack dir: {common}"
+        return _unpack_zip_to(
+            path,
+            archive,
+            from_archive_path,
+            context=context,
+            member_filter=member_filter,
         )
-    # this archive member is trying to unpack itself somewhere above
-    # the unpack location, i.e. contains a path traversal (possibly by
-    # accident but we still can't allow it)
-    dest = path / member.name
-    match member.type:
-        case tarfile.LNKTYPE | tarfile.SYMTYPE:
-            target_realpath = Path(os.path.realpath(path / member.linkname))
-            try:
-                common = Path(os.path.commonpath([unpack_to, target_realpath]))
-            except ValueError:
-                pass
-            if common != unpack_to:
-                raise RuntimeError(
-                    f"Will not unpack archive member {member.name}: links outside unpack dir"
-                )
-            context.write_verbose(f"unpack: {dest} (symlink to {target_realpath} ok")
-        case tarfile.REGTYPE:
-            context.write_verbose(f"unpack: {dest} file ok")
-        case tarfile.DIRTYPE:
-            context.write_verbose(f"unpack: {dest} directory ok")
-        case _:
-            raise RuntimeError(
-                f"Cannot handle archive member of type {str(member.type)}"
-            )
-    return member
 
 
-def _unpack_member_to(
-    tf: tarfile.TarFile,
+def _unpack_tar_to(
     path: Path,
-    member: tarfile.TarInfo,
+    archive: Path,
     from_archive_path: Path,
     *,
     context: GlobalBuildContext,
-) -> Path | None:
-    # make sure this is something we can unpack
-    verified = _verify_tar_member(path, member, context=context)
-    # if this member is not inside from_archive_path, don't extract it
-    try:
-        common = Path(os.path.commonpath([verified.name, from_archive_path]))
-    except ValueError:
-        pass
-    if common != from_archive_path:
-        return None
-    destpath = path / Path(verified.name).relative_to(from_archive_path)
-    context.write_verbose(f"unpack: {path} -> {destpath}")
-    tf.extract(verified, path, set_attrs=True)
-    return destpath
-
-
-def _unpack_tar_to(
-    path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
+    member_filter: MemberFilter | None = None,
 ) -> Path:
     context.write(f"Untarring {archive} to {path}")
-    with tarfile.open(archive, "r") as tf:
-        members = sorted(tf.getmembers(), key=lambda m: m.name, reverse=True)
-        unpacked = [
-            _unpack_member_to(tf, path, member, from_archive_path, context=context)
-            for member in members
-        ]
-        return Path(
-            os.path.commonpath(
-                [unpacked_file for unpacked_file in unpacked if unpacked_file]
-            )
-        )
+    return extract_tar(
+        path,
+        archive,
+        from_archive_path,
+        context.write_verbose if context.verbose else None,
+        member_filter,
+    )
 
 
 def _unpack_zip_to(
-    path: Path, archive: Path, from_archive_path: Path, *, context: GlobalBuildContext
+    path: Path,
+    archive: Path,
+    from_archive_path: Path,
+    *,
+    context: GlobalBuildContext,
+    member_filter: MemberFilter | None = None,
 ) -> Path:
     context.write(f"Unzipping {archive} to {path}")
-    unzipped: list[Path] = []
-    with zipfile.ZipFile(archive) as zf:
-        for member in zf.infolist():
-            # skip archive members not in the from_archive_path
-            try:
-                common = Path(os.path.commonpath([member.filename, from_archive_path]))
-            except ValueError:
-                pass
-            if common != from_archive_path:
-                continue
-            # and then just extract them, because zipfile extraction prevents
-            # traversal unlike tarfile extraction
-            context.write_verbose(
-                f"unpack: {member.filename} -> {path/member.filename}"
-            )
-            unzipped.append(Path(zf.extract(member, path=path)))
-    return Path(os.path.commonpath(unzipped))
+    return extract_zip(
+        path,
+        archive,
+        from_archive_path,
+        context.write_verbose if context.verbose else None,
+        member_filter,
+    )
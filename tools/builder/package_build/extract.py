@@ -0,0 +1,427 @@
+"""builder.package_build.extract - fast, safe extraction of source archives"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from collections import deque
+from typing import IO, Callable, Iterable, Sequence
+import os
+import posixpath
+import re
+import shutil
+import stat
+import tarfile
+import zipfile
+
+#: How many bytes of file contents may be waiting to be written at once
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+#: Files bigger than this are written as they are read rather than queued
+MAX_QUEUED_FILE_BYTES = 8 * 1024 * 1024
+#: How many threads write files
+WRITER_THREADS = min(8, os.cpu_count() or 1)
+
+EchoFunc = Callable[[str], None]
+
+#: What to leave out of a package source unless its build.py says otherwise: version
+#: control and CI metadata, documentation, benchmarks and notebooks, none of which a
+#: wheel build reads
+DEFAULT_EXCLUDE = (
+    ".git",
+    ".github",
+    ".circleci",
+    ".azure-pipelines",
+    "/doc",
+    "/docs",
+    "/asv_bench",
+    "/benchmarks",
+    "*.ipynb",
+)
+
+
+class UnsafeArchiveMember(RuntimeError):
+    pass
+
+
+def _normalize(name: str) -> str:
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def _is_outside(normalized: str) -> bool:
+    return normalized == ".." or normalized.startswith("../")
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    Translate a glob to a regex the way .gitignore does: * and ? don't match /, **
+    matches anything, and a pattern with no / in it (other than at the end) matches
+    at any depth. A pattern that matches a directory matches everything in it.
+    """
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    parts = re.split(r"(\*\*/?|\*|\?)", pattern)
+    translated = "".join(
+        {"**/": "(?:.*/)?", "**": ".*", "*": "[^/]*", "?": "[^/]"}.get(
+            part, re.escape(part)
+        )
+        for part in parts
+    )
+    prefix = "" if anchored else "(?:.*/)?"
+    return f"{prefix}{translated}(?:/.*)?"
+
+
+class MemberFilter:
+    """
+    Which archive members to extract, by glob: a member is extracted if it matches
+    one of include (or include is empty) and none of exclude. Members are matched
+    by their path inside the package source, i.e. below from_archive_path or the
+    archive's top level directory.
+    """
+
+    def __init__(self, include: Sequence[str] = (), exclude: Sequence[str] = ()):
+        self.include = _compile_globs(include)
+        self.exclude = _compile_globs(exclude)
+
+    def wanted(self, relative: str) -> bool:
+        if not relative:
+            return True
+        if self.include and not self.include.fullmatch(relative):
+            return False
+        return not (self.exclude and self.exclude.fullmatch(relative))
+
+
+def _compile_globs(patterns: Sequence[str]) -> re.Pattern[str] | None:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{_glob_to_regex(glob)})" for glob in patterns))
+
+
+class ExtractionPlan:
+    """
+    Everything about an extraction that can be worked out once rather than per member:
+    where it goes, which part of the archive is wanted, and which links have been
+    extracted so far.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        from_archive_path: Path,
+        member_filter: MemberFilter | None = None,
+    ) -> None:
+        self.path = path
+        self.member_filter = member_filter
+        self.root = os.path.realpath(path)
+        prefix = _normalize(str(from_archive_path))
+        self.prefix = "" if prefix == "." else prefix
+        self._links: set[str] = set()
+        self._common: list[str] | None = None
+
+    def wanted(self, normalized: str) -> bool:
+        """Whether a member is inside from_archive_path and passes the filter."""
+        if not self.prefix:
+            relative = normalized.partition("/")[2]
+        elif normalized == self.prefix:
+            relative = ""
+        elif normalized.startswith(self.prefix + "/"):
+            relative = normalized[len(self.prefix) + 1 :]
+        else:
+            return False
+        return not self.member_filter or self.member_filter.wanted(relative)
+
+    def destination(self, name: str) -> tuple[str, Path]:
+        """
+        Check that a member named name would be extracted inside the extraction
+        directory, and return its normalized name and destination.
+        """
+        normalized = _normalize(name)
+        if _is_outside(normalized) or os.path.isabs(name):
+            raise UnsafeArchiveMember(
+                f"Will not unpack archive member {name}: outside unpack dir"
+            )
+        dest = self.path / normalized
+        if self._links and self._under_link(normalized):
+            # the only way out of the extraction directory is through a link
+            # that was extracted earlier, so this is the only time we need to
+            # look at real paths
+            real_parent = os.path.realpath(dest.parent)
+            if os.path.commonpath([real_parent, self.root]) != self.root:
+                raise UnsafeArchiveMember(
+                    f"Will not unpack archive member {name}: outside unpack dir"
+                )
+        return normalized, dest
+
+    def _under_link(self, normalized: str) -> bool:
+        parts = normalized.split("/")
+        return any(
+            "/".join(parts[:index]) in self._links for index in range(1, len(parts))
+        )
+
+    def _is_real_outside(self, path: Path) -> bool:
+        real = os.path.realpath(path)
+        return os.path.commonpath([real, self.root]) != self.root
+
+    def check_symlink(self, normalized: str, linkname: str) -> None:
+        target = _normalize(posixpath.join(posixpath.dirname(normalized), linkname))
+        if os.path.isabs(linkname) or _is_outside(target):
+            raise UnsafeArchiveMember(
+                f"Will not unpack archive member {normalized}: links outside unpack dir"
+            )
+        self._links.add(normalized)
+
+    def check_links(self) -> None:
+        """
+        Check that every symlink extracted so far really points inside the
+        extraction directory, now that the latest one exists. A target that is
+        lexically inside can still lead out through another link (e.g. d -> ..
+        then s -> d/..), and a new link can change where an earlier one leads, so
+        they're all resolved again. Removes the offending link before raising.
+        """
+        for link in self._links:
+            if self._is_real_outside(self.path / link):
+                os.unlink(self.path / link)
+                raise UnsafeArchiveMember(
+                    f"Will not unpack archive member {link}: links outside unpack dir"
+                )
+
+    def check_hardlink(self, normalized: str, linkname: str) -> str:
+        target = _normalize(linkname)
+        if (
+            os.path.isabs(linkname)
+            or _is_outside(target)
+            or (self._links and self._is_real_outside(self.path / target))
+        ):
+            raise UnsafeArchiveMember(
+                f"Will not unpack archive member {normalized}: links outside unpack dir"
+            )
+        return target
+
+    def extracted(self, normalized: str) -> None:
+        """Track the common path of everything extracted."""
+        parts = normalized.split("/")
+        if self._common is None:
+            self._common = parts
+            return
+        for index, (mine, theirs) in enumerate(zip(self._common, parts)):
+            if mine != theirs:
+                del self._common[index:]
+                return
+        del self._common[len(parts) :]
+
+    def common_path(self) -> Path:
+        """The deepest path containing everything extracted."""
+        if not self._common:
+            return self.path
+        return self.path.joinpath(*self._common)
+
+
+class _Writer:
+    """Writes files on a pool of threads, bounding how much data is waiting."""
+
+    def __init__(self, threads: int = WRITER_THREADS) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._pending: deque[tuple[Future[None], int]] = deque()
+        self._pending_bytes = 0
+        self._made_dirs: set[Path] = set()
+
+    def __enter__(self) -> "_Writer":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        try:
+            self.wait()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def makedirs(self, directory: Path) -> None:
+        if directory in self._made_dirs:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        self._made_dirs.add(directory)
+
+    def write(
+        self, dest: Path, data: bytes, mode: int | None, mtime: float | None
+    ) -> None:
+        self.makedirs(dest.parent)
+        self._pending.append(
+            (self._pool.submit(_write_file, dest, data, mode, mtime), len(data))
+        )
+        self._pending_bytes += len(data)
+        while self._pending_bytes > MAX_PENDING_BYTES:
+            future, size = self._pending.popleft()
+            future.result()
+            self._pending_bytes -= size
+
+    def copy(
+        self, dest: Path, source: IO[bytes], mode: int | None, mtime: float | None
+    ) -> None:
+        """Write a file from a stream, in this thread."""
+        self.makedirs(dest.parent)
+        _remove_existing(dest)
+        with open(dest, "wb") as destfile:
+            shutil.copyfileobj(source, destfile, 1024 * 1024)
+        _set_attrs(dest, mode, mtime)
+
+    def wait(self) -> None:
+        pending, self._pending = self._pending, deque()
+        self._pending_bytes = 0
+        for future, _ in pending:
+            future.result()
+
+
+def _remove_existing(dest: Path) -> None:
+    if dest.is_symlink() or dest.is_file():
+        dest.unlink()
+
+
+def _set_attrs(dest: Path, mode: int | None, mtime: float | None) -> None:
+    if mode:
+        os.chmod(dest, mode)
+    if mtime is not None:
+        os.utime(dest, (mtime, mtime))
+
+
+def _write_file(dest: Path, data: bytes, mode: int | None, mtime: float | None) -> None:
+    _remove_existing(dest)
+    with open(dest, "wb") as destfile:
+        destfile.write(data)
+    _set_attrs(dest, mode, mtime)
+
+
+def _report(echo: EchoFunc | None, kind: str, normalized: str, dest: Path) -> None:
+    if echo:
+        echo(f"unpack: {normalized} -> {dest} ({kind})")
+
+
+def _extract_link(
+    plan: ExtractionPlan,
+    writer: _Writer,
+    member: tarfile.TarInfo,
+    normalized: str,
+    dest: Path,
+) -> bool:
+    """Extract a symlink or hardlink. Returns False if it was filtered out."""
+    if member.issym():
+        plan.check_symlink(normalized, member.linkname)
+    else:
+        target = plan.check_hardlink(normalized, member.linkname)
+        if not plan.wanted(target):
+            # the file it links to was filtered out, so it goes too
+            return False
+    # a link replaces whatever is there, so earlier writes must land first
+    writer.wait()
+    writer.makedirs(dest.parent)
+    _remove_existing(dest)
+    if member.issym():
+        os.symlink(member.linkname, dest)
+        plan.check_links()
+    else:
+        os.link(plan.path / target, dest)
+    return True
+
+
+def extract_tar(
+    path: Path,
+    archive: Path,
+    from_archive_path: Path,
+    echo: EchoFunc | None = None,
+    member_filter: MemberFilter | None = None,
+) -> Path:
+    """
+    Extract the members of a tar archive under from_archive_path that pass
+    member_filter into path, in one streaming pass. Returns the common path of
+    everything extracted.
+    """
+    plan = ExtractionPlan(path, from_archive_path, member_filter)
+    directories: list[tuple[Path, tarfile.TarInfo]] = []
+    with tarfile.open(archive, "r|*") as tf, _Writer() as writer:
+        for member in tf:
+            normalized, dest = plan.destination(member.name)
+            if not plan.wanted(normalized):
+                continue
+            if member.isdir():
+                writer.makedirs(dest)
+                directories.append((dest, member))
+            elif member.isreg():
+                source = tf.extractfile(member)
+                assert source
+                mode = member.mode & 0o777
+                if member.size > MAX_QUEUED_FILE_BYTES:
+                    writer.copy(dest, source, mode, member.mtime)
+                else:
+                    writer.write(dest, source.read(), mode, member.mtime)
+            elif member.issym() or member.islnk():
+                if not _extract_link(plan, writer, member, normalized, dest):
+                    continue
+            else:
+                raise UnsafeArchiveMember(
+                    f"Cannot handle archive member of type {str(member.type)}"
+                )
+            _report(echo, "tar", normalized, dest)
+            plan.extracted(normalized)
+    # like tarfile.extractall, set directory attributes after their contents are
+    # written, deepest first, so read-only directories don't block extraction
+    for dest, member in sorted(
+        directories, key=lambda item: str(item[0]), reverse=True
+    ):
+        _set_attrs(dest, member.mode & 0o777, member.mtime)
+    return plan.common_path()
+
+
+def _zip_mode(member: zipfile.ZipInfo) -> int | None:
+    mode = member.external_attr >> 16
+    if not mode or not stat.S_ISREG(mode):
+        return None
+    return stat.S_IMODE(mode)
+
+
+def _extract_zip_members(
+    archive: Path, members: Iterable[tuple[zipfile.ZipInfo, Path]]
+) -> None:
+    with zipfile.ZipFile(archive) as zf:
+        for member, dest in members:
+            with zf.open(member) as source, open(dest, "wb") as destfile:
+                shutil.copyfileobj(source, destfile, 1024 * 1024)
+            mode = _zip_mode(member)
+            if mode:
+                os.chmod(dest, mode)
+
+
+def extract_zip(
+    path: Path,
+    archive: Path,
+    from_archive_path: Path,
+    echo: EchoFunc | None = None,
+    member_filter: MemberFilter | None = None,
+) -> Path:
+    """
+    Extract the members of a zip archive under from_archive_path that pass
+    member_filter into path. The
+    directory tree is made up front and then files are decompressed and written by
+    several threads, each with its own handle on the archive. Returns the common
+    path of everything extracted.
+    """
+    plan = ExtractionPlan(path, from_archive_path, member_filter)
+    files: list[tuple[zipfile.ZipInfo, Path]] = []
+    directories: set[Path] = set()
+    with zipfile.ZipFile(archive) as zf:
+        for member in zf.infolist():
+            normalized, dest = plan.destination(member.filename)
+            if not plan.wanted(normalized):
+                continue
+            if member.is_dir():
+                directories.add(dest)
+            else:
+                directories.add(dest.parent)
+                files.append((member, dest))
+            _report(echo, "zip", normalized, dest)
+            plan.extracted(normalized)
+    for directory in sorted(directories):
+        directory.mkdir(parents=True, exist_ok=True)
+    threads = max(1, min(WRITER_THREADS, len(files) // 64))
+    # largest files first, round robin, so each thread gets a similar share
+    files.sort(key=lambda item: item[0].file_size, reverse=True)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for result in [
+            pool.submit(_extract_zip_members, archive, files[index::threads])
+            for index in range(threads)
+        ]:
+            result.result()
+    return plan.common_path()
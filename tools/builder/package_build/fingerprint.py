@@ -0,0 +1,104 @@
+"""builder.package_build.fingerprint - decide whether a package needs rebuilding"""
+from dataclasses import asdict, is_dataclass
+from hashlib import sha256
+from pathlib import Path
+import json
+
+from builder import __version__
+from .types import HTTPFetchableSource
+
+MANIFEST_NAME = "build-manifest.json"
+
+
+def sdk_identity(sdk_path: Path) -> str:
+    """Identify an SDK by its location and the state of its environment-setup."""
+    try:
+        setup_stat = (sdk_path / "environment-setup").stat()
+    except OSError:
+        return str(sdk_path)
+    return f"{sdk_path}:{setup_stat.st_size}:{setup_stat.st_mtime_ns}"
+
+
+def source_identity(source: HTTPFetchableSource) -> dict[str, str]:
+    """Everything that identifies a source: where it comes from and how it's used."""
+    identity = {"url": source.url(), "archive": source.archive_name()}
+    if is_dataclass(source):
+        identity.update({key: str(value) for key, value in asdict(source).items()})
+    return identity
+
+
+def _file_digest(path: Path | None) -> str | None:
+    if path is None:
+        return None
+    try:
+        return sha256(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+def package_fingerprint(
+    build_file: Path,
+    source: HTTPFetchableSource,
+    setup_py_commands: list[str],
+    build_dependencies: list[str],
+    sdk_path: Path,
+    dependency_lock: Path | None = None,
+) -> str:
+    """
+    Compute the fingerprint of a package build. If its build dependencies are
+    locked, the lock is part of it, since it decides what they are.
+    """
+    fingerprint_data = {
+        "build_py": sha256(build_file.read_bytes()).hexdigest(),
+        "source": source_identity(source),
+        "setup_py_commands": setup_py_commands,
+        "build_dependencies": build_dependencies,
+        "builder_version": __version__,
+        "sdk": sdk_identity(sdk_path),
+        "dependency_lock": _file_digest(dependency_lock),
+    }
+    return sha256(json.dumps(fingerprint_data, sort_keys=True).encode()).hexdigest()
+
+
+def read_manifest(dist_path: Path) -> dict[str, str] | None:
+    """Read the build manifest in a dist directory, if there is a valid one."""
+    try:
+        with open(dist_path / MANIFEST_NAME) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict):
+        return None
+    return manifest
+
+
+def write_manifest(dist_path: Path, fingerprint: str, wheel: Path) -> Path:
+    """Record that wheel was built with fingerprint."""
+    manifest_path = dist_path / MANIFEST_NAME
+    temp_path = manifest_path.with_suffix(".tmp")
+    with open(temp_path, "w") as manifest_file:
+        json.dump(
+            {
+                "fingerprint": fingerprint,
+                "wheel": wheel.name,
+                "builder_version": __version__,
+            },
+            manifest_file,
+            indent=2,
+        )
+    temp_path.replace(manifest_path)
+    return manifest_path
+
+
+def up_to_date_wheel(dist_path: Path, fingerprint: str) -> Path | None:
+    """
+    If the dist directory holds a wheel built with this fingerprint, return
+    its path; otherwise, return None.
+    """
+    manifest = read_manifest(dist_path)
+    if not manifest or manifest.get("fingerprint") != fingerprint:
+        return None
+    wheel = dist_path / str(manifest.get("wheel", ""))
+    if not manifest.get("wheel") or not wheel.is_file():
+        return None
+    return wheel
@@ -0,0 +1,187 @@
+"""builder.package_build.ledger - remember how long package builds took"""
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from statistics import median
+from typing import Iterator
+import sqlite3
+import time
+
+from builder import __version__
+from .report import BuildReport
+
+LEDGER_NAME = "build-ledger.sqlite3"
+
+#: The result of a build that produced a wheel
+BUILT = "built"
+#: The result of a build that was skipped because its wheel was up to date
+UP_TO_DATE = "up-to-date"
+#: The result of a build that failed
+FAILED = "failed"
+
+#: How many of a package's most recent builds its expected duration is based on
+HISTORY_LENGTH = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    package TEXT NOT NULL,
+    fingerprint TEXT,
+    finished REAL NOT NULL,
+    duration REAL NOT NULL,
+    result TEXT NOT NULL,
+    wheel_size INTEGER,
+    tool_version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_by_package ON builds (package, finished);
+CREATE TABLE IF NOT EXISTS phases (
+    build_id INTEGER NOT NULL REFERENCES builds (id),
+    phase TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_by_build ON phases (build_id);
+"""
+
+
+@dataclass
+class BuildRecord:
+    package: str
+    #: The package's label, e.g. pandas/1.5.0
+    duration: float
+    #: How long the whole build took, in seconds
+    result: str
+    #: BUILT, UP_TO_DATE or FAILED
+    fingerprint: str | None = None
+    #: The package's fingerprint, if the build got far enough to compute it
+    wheel_size: int | None = None
+    #: The size of the wheel, if there is one
+    phases: dict[str, float] = field(default_factory=dict)
+    #: How long each phase took, in seconds
+    finished: float = field(default_factory=time.time)
+    #: When the build finished, in seconds since the epoch
+    tool_version: str = __version__
+    #: The version of the builder that ran the build
+
+
+class BuildLedger:
+    """The build history in a build root."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @classmethod
+    def in_build_root(cls, build_root: Path) -> "BuildLedger":
+        return cls(build_root / LEDGER_NAME)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # a connection per operation, so nothing is shared between threads
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            connection.executescript(_SCHEMA)
+            with connection:
+                yield connection
+
+    def record(self, record: BuildRecord) -> None:
+        """Add a build to the ledger."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO builds (package, fingerprint, finished, duration, "
+                "result, wheel_size, tool_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.package,
+                    record.fingerprint,
+                    record.finished,
+                    record.duration,
+                    record.result,
+                    record.wheel_size,
+                    record.tool_version,
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO phases (build_id, phase, duration) VALUES (?, ?, ?)",
+                [
+                    (cursor.lastrowid, phase, duration)
+                    for phase, duration in record.phases.items()
+                ],
+            )
+
+    def history(self, package: str, limit: int = HISTORY_LENGTH) -> list[BuildRecord]:
+        """A package's most recent builds, newest first."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, package, duration, result, fingerprint, wheel_size, "
+                "finished, tool_version FROM builds WHERE package = ? "
+                "ORDER BY finished DESC LIMIT ?",
+                (package, limit),
+            ).fetchall()
+            records = []
+            for (
+                build_id,
+                package,
+                duration,
+                result,
+                fingerprint,
+                wheel_size,
+                finished,
+                tool_version,
+            ) in rows:
+                phases = connection.execute(
+                    "SELECT phase, duration FROM phases WHERE build_id = ?",
+                    (build_id,),
+                ).fetchall()
+                records.append(
+                    BuildRecord(
+                        package=package,
+                        duration=duration,
+                        result=result,
+                        fingerprint=fingerprint,
+                        wheel_size=wheel_size,
+                        phases=dict(phases),
+                        finished=finished,
+                        tool_version=tool_version,
+                    )
+                )
+            return records
+
+    def expected_durations(self, packages: list[str]) -> dict[str, float]:
+        """
+        How long each package is expected to take to build: the median of its most
+        recent builds that actually built something. Packages that have never been
+        built aren't included.
+        """
+        expected: dict[str, float] = {}
+        with self._connect() as connection:
+            for package in packages:
+                durations = [
+                    duration
+                    for (duration,) in connection.execute(
+                        "SELECT duration FROM builds WHERE package = ? AND result = ? "
+                        "ORDER BY finished DESC LIMIT ?",
+                        (package, BUILT, HISTORY_LENGTH),
+                    )
+                ]
+                if durations:
+                    expected[package] = median(durations)
+        return expected
+
+
+def record_from_report(
+    package: str, report: BuildReport, succeeded: bool
+) -> BuildRecord:
+    """Make a ledger record for a package from what its build put in a report."""
+    stats = report.stats.get(package, {}).get("build", {})
+    if not succeeded:
+        result = FAILED
+    elif stats.get("up_to_date"):
+        result = UP_TO_DATE
+    else:
+        result = BUILT
+    return BuildRecord(
+        package=package,
+        duration=report.package_durations().get(package, 0.0),
+        result=result,
+        fingerprint=stats.get("fingerprint"),
+        wheel_size=stats.get("wheel_size"),
+        phases=report.phase_durations(package),
+    )
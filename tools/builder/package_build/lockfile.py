@@ -0,0 +1,203 @@
+"""builder.package_build.lockfile - pin build dependencies to exact files"""
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+import json
+import os
+import re
+import shutil
+import tempfile
+from typing import Sequence
+
+from builder.common.cache import atomic_path
+
+LOCK_NAME = "build-dependencies.lock"
+
+_HEADER = "# Build dependencies for this package, locked by the package builder.\n"
+_REQUIREMENTS_PREFIX = "# requirements: "
+_line_re = re.compile(
+    r"^(?P<name>[^=\s]+)==(?P<version>\S+)\s+--hash=sha256:(?P<sha256>[0-9a-f]{64})"
+    r"\s+#\s+(?P<filename>\S+)$"
+)
+_sdist_suffixes = (".tar.gz", ".tar.bz2", ".zip")
+
+#: Where pip downloads a resolution in the wheelhouse before it's locked
+RESOLVING_PREFIX = ".resolving-"
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+@dataclass(frozen=True)
+class LockedRequirement:
+    name: str
+    #: The distribution's normalized name
+    version: str
+    #: Its exact version
+    sha256: str
+    #: The hex sha256 of the file that was resolved
+    filename: str
+    #: The name of that file in the wheelhouse
+
+    @classmethod
+    def from_file(cls, path: Path) -> "LockedRequirement":
+        """Lock the distribution in a downloaded wheel or sdist."""
+        if path.name.endswith(".whl"):
+            name, version = path.name.split("-")[:2]
+        else:
+            stem = next(
+                (
+                    path.name[: -len(suffix)]
+                    for suffix in _sdist_suffixes
+                    if path.name.endswith(suffix)
+                ),
+                None,
+            )
+            if not stem or "-" not in stem:
+                raise ValueError(f"Can't tell what distribution {path.name} is")
+            name, version = stem.rsplit("-", 1)
+        digest = sha256()
+        with open(path, "rb") as dist:
+            for chunk in iter(lambda: dist.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return cls(normalize_name(name), version, digest.hexdigest(), path.name)
+
+    def line(self) -> str:
+        return f"{self.name}=={self.version} --hash=sha256:{self.sha256}  # {self.filename}"
+
+
+@dataclass
+class DependencyLock:
+    requirements: list[str]
+    #: The requirements this was resolved from
+    locked: list[LockedRequirement]
+    #: What they resolved to
+
+    def matches(self, requirements: list[str]) -> bool:
+        """Whether this lock was resolved from these requirements."""
+        return sorted(self.requirements) == sorted(requirements)
+
+    def pins(self) -> list[str]:
+        """The exact distributions, to identify what's installed from the lock."""
+        return [requirement.line() for requirement in self.locked]
+
+    def render(self) -> str:
+        return (
+            _HEADER
+            + _REQUIREMENTS_PREFIX
+            + json.dumps(sorted(self.requirements))
+            + "\n"
+            + "".join(line + "\n" for line in sorted(self.pins()))
+        )
+
+    @classmethod
+    def parse(cls, text: str) -> "DependencyLock":
+        requirements: list[str] | None = None
+        locked: list[LockedRequirement] = []
+        for line in text.splitlines():
+            if line.startswith(_REQUIREMENTS_PREFIX):
+                requirements = json.loads(line[len(_REQUIREMENTS_PREFIX) :])
+                continue
+            if not line.strip() or line.startswith("#"):
+                continue
+            match = _line_re.match(line.strip())
+            if not match:
+                raise ValueError(f"Bad line in dependency lock: {line}")
+            locked.append(LockedRequirement(**match.groupdict()))
+        if requirements is None:
+            raise ValueError("Dependency lock doesn't say what it was resolved from")
+        return cls(requirements, locked)
+
+    @classmethod
+    def load(cls, path: Path) -> "DependencyLock | None":
+        """Read a lockfile, if there is a valid one."""
+        try:
+            return cls.parse(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def write(self, path: Path) -> Path:
+        with atomic_path(path) as temp_path:
+            temp_path.write_text(self.render())
+        return path
+
+    def missing_from(self, wheelhouse: Path) -> list[LockedRequirement]:
+        """The locked files that aren't in a wheelhouse."""
+        return [
+            requirement
+            for requirement in self.locked
+            if not (wheelhouse / requirement.filename).is_file()
+        ]
+
+
+def pip_download_command(
+    python: str, requirements: list[str], dest: Path, index_args: Sequence[str] = ()
+) -> list[str]:
+    """Resolve requirements and download everything they resolve to into dest."""
+    return (
+        [python, "-m", "pip", "download", "--dest", str(dest)]
+        + list(index_args)
+        + requirements
+    )
+
+
+def pip_fill_command(
+    python: str, lock_path: Path, wheelhouse: Path, index_args: Sequence[str] = ()
+) -> list[str]:
+    """Download exactly the files in a lockfile, checking their hashes."""
+    return [
+        python,
+        "-m",
+        "pip",
+        "download",
+        "--no-deps",
+        "--require-hashes",
+        "--dest",
+        str(wheelhouse),
+        *index_args,
+        "-r",
+        str(lock_path),
+    ]
+
+
+def pip_install_command(python: str, lock_path: Path, wheelhouse: Path) -> list[str]:
+    """Install exactly the files in a lockfile from a wheelhouse, without an index."""
+    return [
+        python,
+        "-m",
+        "pip",
+        "install",
+        "--no-deps",
+        "--require-hashes",
+        "--no-index",
+        "--find-links",
+        str(wheelhouse),
+        "-r",
+        str(lock_path),
+    ]
+
+
+def lock_downloaded(
+    requirements: list[str], downloaded: Path, wheelhouse: Path
+) -> DependencyLock:
+    """
+    Lock what requirements resolved to from the files pip downloaded for them, and
+    move those files into the wheelhouse.
+    """
+    locked = [
+        LockedRequirement.from_file(path) for path in sorted(downloaded.iterdir())
+    ]
+    for path in downloaded.iterdir():
+        os.replace(path, wheelhouse / path.name)
+    return DependencyLock(list(requirements), locked)
+
+
+def resolving_directory(wheelhouse: Path) -> Path:
+    """A new directory in the wheelhouse for pip to download a resolution to."""
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(dir=wheelhouse, prefix=RESOLVING_PREFIX))
+
+
+def discard_directory(directory: Path) -> None:
+    shutil.rmtree(directory, ignore_errors=True)
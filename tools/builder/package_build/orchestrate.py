@@ -3,14 +3,35 @@ from .types import (
     GithubReleaseSDistSource,
     GlobalBuildContext,
     PackageBuildContext,
+    PackageBuildResult,
     BuildPaths,
 )
 from .download import fetch_source, unpack_source
-from .build_wheel import build_with_setup_py
-from typing import Iterator
+from .build_wheel import (
+    build_with_setup_py,
+    check_single_compile,
+    compile_parallelism,
+)
+from .report import BuildReport, PACKAGE
+from .fingerprint import package_fingerprint, up_to_date_wheel, write_manifest
+from .lockfile import LOCK_NAME
+from .ledger import BUILT, BuildLedger, record_from_report
+from .schedule import estimate_schedule, longest_first
+from .pipeline import FETCH, UNPACK, Pipeline, StageLimits
+from builder.common.shellcommand import ShellCommandFailed
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import ContextVar
+from dataclasses import replace
+from typing import Iterable, Iterator
+import sqlite3
 
 from pathlib import Path
 
+#: The package that build_package is building, set while its build.py runs
+_package_build_context: ContextVar[PackageBuildContext] = ContextVar(
+    "opentrons_package_build_context"
+)
+
 
 def discover_build_packages_sync(
     package_root: Path,
@@ -19,10 +40,26 @@ def discover_build_packages_sync(
     *,
     context: GlobalBuildContext,
 ) -> None:
-    for _ in discover_build_packages(
-        package_root, build_root, dist_root, context=context
-    ):
-        pass
+    results = list(
+        discover_build_packages(package_root, build_root, dist_root, context=context)
+    )
+    failed = [result for result in results if not result.succeeded]
+    context.write(
+        f"Build summary: {len(results) - len(failed)} succeeded, {len(failed)} failed"
+    )
+    for result in results:
+        if result.succeeded:
+            context.write(f"\tok: {result.paths.label()}")
+        else:
+            context.write(
+                f"\tFAILED: {result.paths.label()}: {result.error} "
+                f"(log in {result.log_path})"
+            )
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} package builds failed: "
+            f"{', '.join(result.paths.label() for result in failed)}"
+        )
 
 
 def discover_build_packages(
@@ -31,14 +68,69 @@ def discover_build_packages(
     dist_root: Path,
     *,
     context: GlobalBuildContext,
-) -> Iterator[None]:
+) -> Iterator[PackageBuildResult]:
     context.write("Building all packages")
+    ledger = BuildLedger.in_build_root(build_root)
+    packages = list(
+        discover_packages(package_root, build_root, dist_root, context=context)
+    )
+    expected = _expected_durations(ledger, packages, context=context)
     yield from build_packages(
-        discover_packages(package_root, build_root, dist_root, context=context),
+        longest_first(packages, BuildPaths.label, expected),
         context=context,
+        ledger=ledger,
+        expected=expected,
     )
 
 
+def _expected_durations(
+    ledger: BuildLedger, packages: list[BuildPaths], *, context: GlobalBuildContext
+) -> dict[str, float]:
+    """Look up how long packages usually take, and say how long the build should."""
+    labels = [package.label() for package in packages]
+    try:
+        expected = ledger.expected_durations(labels)
+    except sqlite3.Error as exc:
+        context.write(f"Could not read build history from {ledger.path}: {exc}")
+        return {}
+    if expected:
+        estimate = estimate_schedule(
+            longest_first(labels, str, expected), expected, context.jobs
+        )
+        context.write(
+            f"Expected build time {estimate.total:.0f}s with {context.jobs} jobs "
+            f"(longest: {estimate.longest} at {estimate.critical_path:.0f}s"
+            + (
+                f"; {estimate.unknown} packages with no history)"
+                if estimate.unknown
+                else ")"
+            )
+        )
+    return expected
+
+
+def _record_result(
+    result: PackageBuildResult,
+    ledger: BuildLedger | None,
+    expected: dict[str, float],
+    *,
+    context: GlobalBuildContext,
+) -> None:
+    """Put a finished build in the ledger, and compare it to what was expected."""
+    label = result.paths.label()
+    record = record_from_report(label, context.report, result.succeeded)
+    if label in expected and record.result == BUILT:
+        context.write(
+            f"{label} took {record.duration:.1f}s, expected {expected[label]:.1f}s"
+        )
+    if not ledger:
+        return
+    try:
+        ledger.record(record)
+    except sqlite3.Error as exc:
+        context.write(f"Could not record build of {label} in {ledger.path}: {exc}")
+
+
 def discover_packages(
     package_root: Path,
     build_root: Path,
@@ -72,11 +164,109 @@ def discover_packages(
 
 
 def build_packages(
-    packages: Iterator[BuildPaths], *, context: GlobalBuildContext
-) -> Iterator[None]:
-    for package in packages:
-        discover_build_package(package, context=context)
-        yield
+    packages: Iterable[BuildPaths],
+    *,
+    context: GlobalBuildContext,
+    ledger: BuildLedger | None = None,
+    expected: dict[str, float] | None = None,
+) -> Iterator[PackageBuildResult]:
+    """
+    Build each package, yielding results as the builds finish.
+
+    With one job, packages build in order and log to the global output, and a
+    failure propagates immediately. With more than one job, packages build
+    concurrently through a pipeline (see builder.package_build.pipeline) that
+    compiles up to that many at once while the next ones download and unpack. Each
+    package logs to build.log in its build directory, and failures are reported in
+    the results.
+    Packages are started in the order they're given.
+
+    If there's a ledger, every build is recorded in it, and builds that took a
+    different time than expected say so.
+    """
+    if context.jobs <= 1:
+        for package in packages:
+            try:
+                discover_build_package(package, context=context)
+            except Exception:
+                _record_result(
+                    PackageBuildResult(paths=package, succeeded=False),
+                    ledger,
+                    expected or {},
+                    context=context,
+                )
+                raise
+            result = PackageBuildResult(paths=package, succeeded=True)
+            _record_result(result, ledger, expected or {}, context=context)
+            yield result
+        return
+    for result in _build_packages_parallel(packages, context=context):
+        _record_result(result, ledger, expected or {}, context=context)
+        yield result
+
+
+def _build_packages_parallel(
+    packages: Iterable[BuildPaths], *, context: GlobalBuildContext
+) -> Iterator[PackageBuildResult]:
+    pipeline = Pipeline(StageLimits(compile=context.jobs))
+    # each package logs to its own file
+    worker_context = replace(context, output=None, pipeline=pipeline)
+    # a package holds a worker from when it starts fetching until it's built, so
+    # the number of workers bounds how far ahead of the compiles the fetches get
+    with ThreadPoolExecutor(max_workers=pipeline.limits.in_flight) as pool:
+        futures = [
+            pool.submit(_build_package_in_worker, package, worker_context)
+            for package in packages
+        ]
+        context.write(
+            f"Building {len(futures)} packages with {context.jobs} jobs "
+            f"(up to {pipeline.limits.fetch} fetching, "
+            f"{pipeline.limits.unpack} unpacking)"
+        )
+        for future in as_completed(futures):
+            result = future.result()
+            if result.report:
+                context.report.extend(result.report)
+            status = "Built" if result.succeeded else "Failed to build"
+            context.write(f"{status} {result.paths.label()} (log in {result.log_path})")
+            yield result
+
+
+def _build_package_in_worker(
+    package: BuildPaths, context: GlobalBuildContext
+) -> PackageBuildResult:
+    """Build one package in a worker thread, logging to its own file."""
+    package.build_path.mkdir(parents=True, exist_ok=True)
+    log_path = package.build_path / "build.log"
+    report = BuildReport()
+    with open(log_path, "w") as log:
+        # jobs stays the pool's, so each package compiles with its share of the CPUs
+        package_log_context = replace(context, output=log, report=report)
+        try:
+            discover_build_package(package, context=package_log_context)
+        except ShellCommandFailed as scf:
+            if not context.verbose:
+                package_log_context.write(scf.output)
+            package_log_context.write(f"{scf.message}: {scf.returncode}")
+            return PackageBuildResult(
+                paths=package,
+                succeeded=False,
+                log_path=log_path,
+                error=str(scf),
+                report=report,
+            )
+        except Exception as exc:
+            package_log_context.write(f"Build failed: {exc}")
+            return PackageBuildResult(
+                paths=package,
+                succeeded=False,
+                log_path=log_path,
+                error=str(exc),
+                report=report,
+            )
+    return PackageBuildResult(
+        paths=package, succeeded=True, log_path=log_path, report=report
+    )
 
 
 def discover_build_package(package: BuildPaths, *, context: GlobalBuildContext) -> None:
@@ -84,17 +274,27 @@ def discover_build_package(package: BuildPaths, *, context: GlobalBuildContext)
     package_context = PackageBuildContext(paths=package, context=context)
     package_build_file = package.source_path / "build.py"
     build_obj = compile(package_build_file.open().read(), package_build_file, "exec")
-    injected_globals = globals()
-    injected_globals["opentrons_package_build_context"] = package_context
-    exec(build_obj, injected_globals)
+    # build_package() finds its context in a context variable, which is private to
+    # each worker thread; the build.py itself gets a namespace of its own
+    token = _package_build_context.set(package_context)
+    try:
+        with context.report.span("build", PACKAGE, package.label()):
+            exec(
+                build_obj,
+                {**globals(), "opentrons_package_build_context": package_context},
+            )
+    finally:
+        _package_build_context.reset(token)
 
 
 # This function is called by the exec'd build_package call in build.py
-# package build files. It relies on having the build paths in the globals.
+# package build files. It finds the package it's building in the
+# _package_build_context context variable, which discover_build_package sets.
 def build_package(
     source: GithubDevSource | GithubReleaseSDistSource,
     setup_py_commands: list[str] | None = None,
     build_dependencies: list[str] | None = None,
+    parallel: int | None = None,
 ) -> Path:
     """
     Build a package. The main entry point for package builds.
@@ -110,19 +310,41 @@ def build_package(
     setup_py_command: The command to use with setup.py to build the package. If
                       not specified, build_wheel.
     build_dependencies: any python dependencies required for the build.
+    parallel: how many compiler processes the build may run at once - passed to
+              build_ext as --parallel, and to make as -j. If not specified, the
+              package gets its share of the CPUs: all of them divided by the
+              number of packages that may compile at once. It never gets more.
 
     Returns
     -------
     The path to the built wheel.
     """
-    global opentrons_package_build_context
-    # this is injected as a global because this function gets called from an exec'd file
-    context: PackageBuildContext = opentrons_package_build_context  # type: ignore[name-defined]
+    # this is set by discover_build_package, because this function gets called from
+    # an exec'd file
+    context = _package_build_context.get()
     context.context.write_verbose(
         f"building package {source.name}:\n"
         f"{context.prettyprint()}\n"
         f"{source.prettyprint()}"
     )
+    commands = setup_py_commands or ["bdist_wheel"]
+    check_single_compile(commands)
+    lock_path = context.paths.source_path / LOCK_NAME
+    fingerprint = package_fingerprint(
+        context.paths.source_path / "build.py",
+        source,
+        commands,
+        build_dependencies or [],
+        context.context.sdk_path,
+        lock_path,
+    )
+    if not context.context.force_rebuild and not context.context.refresh_locks:
+        up_to_date = up_to_date_wheel(context.paths.dist_path, fingerprint)
+        if up_to_date:
+            context.context.write(f"{source.name} is up to date: {up_to_date}")
+            _record_build_stats(context, fingerprint, up_to_date, up_to_date=True)
+            return up_to_date
+
     context.paths.build_path.mkdir(parents=True, exist_ok=True)
     context.paths.dist_path.mkdir(parents=True, exist_ok=True)
 
@@ -131,19 +353,20 @@ def build_package(
     unpack_dir = context.paths.build_path / "unpack/"
     venv_dir = context.paths.build_path / "venv"
 
-    commands = setup_py_commands or ["bdist_wheel"]
-
     for dirname in (download_dir, build_dir, unpack_dir, venv_dir):
         dirname.mkdir(exist_ok=True)
 
-    fetched = fetch_source(source, download_dir, context=context.context)
+    with context.context.stage(FETCH), context.span("fetch"):
+        fetched = fetch_source(source, download_dir, context=context.context)
     context.context.write(f"Fetched to {fetched}")
-    unpacked = unpack_source(
-        unpack_dir,
-        download_dir / source.archive_name(),
-        getattr(source, "package_source_path", None) or Path("."),
-        context=context.context,
-    )
+    with context.context.stage(UNPACK), context.span("unpack"):
+        unpacked = unpack_source(
+            unpack_dir,
+            download_dir / source.archive_name(),
+            getattr(source, "package_source_path", None) or Path("."),
+            context=context.context,
+            member_filter=source.member_filter(),
+        )
     context.context.write(f"Unpacked to {str(unpacked)}")
     wheelfile = build_with_setup_py(
         commands,
@@ -153,6 +376,34 @@ def build_package(
         venv_dir,
         build_dependencies or [],
         context=context.context,
+        package=context.paths.label(),
+        parallel=compile_parallelism(parallel, context.context.jobs),
+        lock_path=lock_path,
     )
+    # the build may have written or refreshed the lock
+    fingerprint = package_fingerprint(
+        context.paths.source_path / "build.py",
+        source,
+        commands,
+        build_dependencies or [],
+        context.context.sdk_path,
+        lock_path,
+    )
+    write_manifest(context.paths.dist_path, fingerprint, wheelfile)
+    _record_build_stats(context, fingerprint, wheelfile, up_to_date=False)
     context.context.write(f"Built {wheelfile}")
     return wheelfile
+
+
+def _record_build_stats(
+    context: PackageBuildContext, fingerprint: str, wheel: Path, up_to_date: bool
+) -> None:
+    context.context.report.record_stats(
+        context.paths.label(),
+        "build",
+        {
+            "fingerprint": fingerprint,
+            "wheel_size": wheel.stat().st_size,
+            "up_to_date": up_to_date,
+        },
+    )
@@ -0,0 +1,48 @@
+"""builder.package_build.pipeline - overlap the stages of package builds"""
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from typing import Iterator
+import threading
+
+FETCH = "fetch"
+UNPACK = "unpack"
+DEPS = "deps"
+COMPILE = "compile"
+
+
+@dataclass(frozen=True)
+class StageLimits:
+    fetch: int = 4
+    #: How many packages may download their sources at once
+    unpack: int = 2
+    #: How many packages may unpack their sources at once
+    deps: int = 2
+    #: How many packages may install their build dependencies at once
+    compile: int = 1
+    #: How many packages may compile at once; this is the number of jobs
+
+    @property
+    def in_flight(self) -> int:
+        """
+        How many packages may be in the pipeline at once: enough to keep every
+        compile slot busy with the next packages' sources downloaded and waiting.
+        This bounds how many unpacked sources sit on disk waiting to be compiled.
+        """
+        return self.compile + self.fetch
+
+
+class Pipeline:
+    """The slots in each stage of the build, shared by all the packages building."""
+
+    def __init__(self, limits: StageLimits) -> None:
+        self.limits = limits
+        self._slots = {
+            field.name: threading.BoundedSemaphore(getattr(limits, field.name))
+            for field in fields(limits)
+        }
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Wait for a slot in a stage and hold it for the body of the context."""
+        with self._slots[name]:
+            yield
@@ -0,0 +1,179 @@
+"""builder.package_build.report - time the phases of a build"""
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+import json
+import os
+import threading
+import time
+
+#: A span around the whole build of a package
+PACKAGE = "package"
+#: A span around one phase of a package build
+PHASE = "phase"
+#: A span around one command run in the SDK environment
+COMMAND = "command"
+
+
+@dataclass
+class Span:
+    name: str
+    #: What was timed, e.g. fetch or setup.py build_ext
+    category: str
+    #: The kind of span, e.g. PHASE
+    start: float
+    #: When it started, in seconds since the epoch
+    duration: float
+    #: How long it took, in seconds
+    package: str | None
+    #: The package it was part of, if any
+    pid: int
+    #: The process it ran in
+    tid: int
+    #: The thread it ran in
+    args: dict[str, Any] = field(default_factory=dict)
+    #: Anything else worth recording
+
+
+@dataclass
+class BuildReport:
+    spans: list[Span] = field(default_factory=list)
+    #: Everything that was timed
+    stats: dict[str, dict[str, Any]] = field(default_factory=dict)
+    #: Other numbers worth reporting, by package
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        category: str = PHASE,
+        package: str | None = None,
+        **args: Any,
+    ) -> Iterator[None]:
+        """Time the body of the context as a span. Spans are recorded even on failure."""
+        start = time.time()
+        began = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            args["failed"] = type(exc).__name__
+            raise
+        finally:
+            self.add_span(
+                name, start, time.perf_counter() - began, category, package, **args
+            )
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        duration: float,
+        category: str = PHASE,
+        package: str | None = None,
+        **args: Any,
+    ) -> None:
+        """Record a span that was timed some other way, e.g. from a command's output."""
+        self.spans.append(
+            Span(
+                name=name,
+                category=category,
+                start=start,
+                duration=duration,
+                package=package,
+                pid=os.getpid(),
+                tid=threading.get_native_id(),
+                args=args,
+            )
+        )
+
+    def record_stats(self, package: str, kind: str, values: dict[str, Any]) -> None:
+        """Record some numbers, e.g. cache hits, for a package."""
+        self.stats.setdefault(package, {})[kind] = values
+
+    def extend(self, other: "BuildReport") -> None:
+        """Add the contents of a report from somewhere else, e.g. another build."""
+        self.spans.extend(other.spans)
+        for package, stats in other.stats.items():
+            self.stats.setdefault(package, {}).update(stats)
+
+    def phase_durations(self, package: str) -> dict[str, float]:
+        """How long each phase of a package's build took, in seconds."""
+        durations: dict[str, float] = {}
+        for span in self.spans:
+            if span.package == package and span.category == PHASE:
+                durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def package_durations(self) -> dict[str, float]:
+        """How long each package's build took, in seconds."""
+        return {
+            span.package: span.duration
+            for span in self.spans
+            if span.category == PACKAGE and span.package
+        }
+
+    def summary(self) -> str:
+        """A human-readable summary of where the time went."""
+        lines = ["Build timing:"]
+        for package, total in sorted(
+            self.package_durations().items(), key=lambda item: -item[1]
+        ):
+            phases = ", ".join(
+                f"{name} {duration:.1f}s"
+                for name, duration in self.phase_durations(package).items()
+            )
+            ccache = self.stats.get(package, {}).get("ccache")
+            if ccache:
+                compiles = ccache.get("hits", 0) + ccache.get("misses", 0)
+                phases += f"; ccache {ccache.get('hits', 0)}/{compiles} hits"
+            lines.append(f"\t{package}: {total:.1f}s ({phases})")
+        return "\n".join(lines)
+
+    def write_json(self, path: Path) -> Path:
+        """Write the report as JSON, with per-package phase totals and every span."""
+        packages = {
+            package: {
+                "duration": duration,
+                "phases": self.phase_durations(package),
+                "stats": self.stats.get(package, {}),
+            }
+            for package, duration in self.package_durations().items()
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as report_file:
+            json.dump(
+                {"packages": packages, "spans": [asdict(span) for span in self.spans]},
+                report_file,
+                indent=2,
+            )
+        return path
+
+    def write_chrome_trace(self, path: Path) -> Path:
+        """Write the spans as Chrome trace events (for Perfetto or chrome://tracing)."""
+        events: list[dict[str, Any]] = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": span.pid,
+                "tid": span.tid,
+                "args": {"package": span.package, **span.args},
+            }
+            for span in self.spans
+        ]
+        for pid in sorted({span.pid for span in self.spans}):
+            events.append(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": f"builder {pid}"},
+                }
+            )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        return path
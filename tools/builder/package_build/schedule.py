@@ -0,0 +1,57 @@
+"""builder.package_build.schedule - decide what order to build packages in"""
+from dataclasses import dataclass
+from heapq import heapify, heapreplace
+from typing import Iterable, TypeVar, Callable
+
+T = TypeVar("T")
+
+
+def longest_first(
+    items: Iterable[T], label: Callable[[T], str], expected: dict[str, float]
+) -> list[T]:
+    """
+    Order items so those without an expected duration come first, in their
+    original order, and then the rest from longest expected to shortest.
+    """
+    unknown: list[T] = []
+    known: list[T] = []
+    for item in items:
+        (known if label(item) in expected else unknown).append(item)
+    known.sort(key=lambda item: -expected[label(item)])
+    return unknown + known
+
+
+@dataclass
+class ScheduleEstimate:
+    total: float
+    #: How long the whole build is expected to take, in seconds
+    critical_path: float
+    #: The longest single build, which no number of jobs can make faster
+    longest: str | None
+    #: The package with the longest build, if any have history
+    unknown: int
+    #: How many packages have no history, and aren't in the estimate
+
+
+def estimate_schedule(
+    labels: list[str], expected: dict[str, float], jobs: int
+) -> ScheduleEstimate:
+    """
+    Estimate how long building packages in this order takes with some number of
+    jobs, by giving each package to whichever worker becomes free first.
+    """
+    workers = [0.0] * max(jobs, 1)
+    heapify(workers)
+    longest: str | None = None
+    for label in labels:
+        if label not in expected:
+            continue
+        heapreplace(workers, workers[0] + expected[label])
+        if longest is None or expected[label] > expected[longest]:
+            longest = label
+    return ScheduleEstimate(
+        total=max(workers),
+        critical_path=expected[longest] if longest else 0.0,
+        longest=longest,
+        unknown=len([label for label in labels if label not in expected]),
+    )
@@ -1,18 +1,86 @@
 """shell_environment - utils for running commands through the shell."""
 import subprocess
 from pathlib import Path
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from io import TextIOBase
 from dataclasses import dataclass
-from typing import Callable, TypeVar, Type, Iterator, cast
+from hashlib import sha256
+from typing import (
+    Callable,
+    ContextManager,
+    TypeVar,
+    Type,
+    Iterator,
+    Literal,
+    Mapping,
+    Protocol,
+    cast,
+)
+import json
+import os
 import shlex
 import re
 import time
 from functools import wraps
-from builder.common.shellcommand import ShellCommandFailed
+from builder.common.shellcommand import ShellCommandFailed, run_simple
+from builder.common.cache import atomic_path, record_lookups
+from .compiler_cache import CompilerCache, WRAPPED_COMPILERS
 
 _SubshellType = TypeVar("_SubshellType", bound="SDKSubshell")
+_SnapshotType = TypeVar("_SnapshotType", bound="SDKSnapshotEnvironment")
 EchoFunc = Callable[[str], None]
+SDKEnvironmentMode = Literal["snapshot", "subshell"]
+
+
+class SDKShell(Protocol):
+    """The interface to an environment with the buildroot SDK active."""
+
+    def run(self, cmd: list[str], env: Mapping[str, str] | None = None) -> str:
+        ...
+
+    def activate_venv(self, venv_dir: Path) -> None:
+        ...
+
+    def initiate_python_environment(
+        self, sdk_path: Path, compiler_cache: CompilerCache | None = None
+    ) -> None:
+        ...
+
+
+def echo_wrap_prevent_double_newlines(echoer: EchoFunc) -> EchoFunc:
+    @wraps(echoer)
+    def _remove_nl_wrapper(logstr: str) -> None:
+        if logstr.endswith("\n"):
+            logstr = logstr[:-1]
+        echoer(logstr)
+
+    return _remove_nl_wrapper
+
+
+def python_environment(sdk_path: Path) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    The environment changes needed to cross-compile python packages with the SDK.
+
+    Returns a tuple of (variables to set, flags to append to variables).
+    """
+    sysroot = sdk_path / "arm-buildroot-linux-gnueabihf" / "sysroot"
+    sysconfigdata_name = "_sysconfigdata__linux_arm-linux-gnueabihf"
+    pythonpath = sysroot / "usr" / "lib" / "python3.10"
+    set_vars = {
+        "_PYTHON_HOST_PLATFORM": "linux-x86_64-linux-gnu",
+        "_PYTHON_SYSCONFIGDATA_NAME": sysconfigdata_name,
+        "PYTHONPATH": str(pythonpath),
+        "SETUPTOOLS_USE_DISTUTILS": "stdlib",
+        "_python_sysroot": str(sysroot),
+        "_python_prefix": "/usr",
+        "_python_exec_prefix": "/usr",
+        "PYTHONNOUSERSITE": "1",
+    }
+    # Fix for pandas complex number compilation issue
+    # Add compiler flags to ensure proper complex number support for ARM cross-compilation
+    complex_flags = "-D_Complex_I=I -D_GNU_SOURCE -std=gnu99"
+    appended_flags = {"CFLAGS": complex_flags, "CPPFLAGS": complex_flags}
+    return set_vars, appended_flags
 
 
 @dataclass
@@ -36,15 +104,7 @@ class SDKSubshell:
 
     _result_re = re.compile(r"^xxxresultxxx:xxx(-?\d+)xxx$", flags=re.MULTILINE)
 
-    @staticmethod
-    def echo_wrap_prevent_double_newlines(echoer: EchoFunc) -> EchoFunc:
-        @wraps(echoer)
-        def _remove_nl_wrapper(logstr: str) -> None:
-            if logstr.endswith("\n"):
-                logstr = logstr[:-1]
-            echoer(logstr)
-
-        return _remove_nl_wrapper
+    echo_wrap_prevent_double_newlines = staticmethod(echo_wrap_prevent_double_newlines)
 
     @classmethod
     @contextmanager
@@ -88,35 +148,44 @@ class SDKSubshell:
         while self._proc.poll():
             time.sleep(0.1)
 
-    def run(self, cmd: list[str]) -> str:
-        return "\n".join(self._guarded_shellcall(shlex.join(cmd)))
+    def run(self, cmd: list[str], env: Mapping[str, str] | None = None) -> str:
+        assignments = [
+            f"{name}={shlex.quote(value)}" for name, value in (env or {}).items()
+        ]
+        return "\n".join(
+            self._guarded_shellcall(" ".join(assignments + [shlex.join(cmd)]))
+        )
+
+    def activate_venv(self, venv_dir: Path) -> None:
+        self._guarded_shellcall(
+            f"source {shlex.quote(str(venv_dir / 'bin' / 'activate'))}"
+        )
 
-    def initiate_python_environment(self, sdk_path: Path) -> None:
+    def initiate_python_environment(
+        self, sdk_path: Path, compiler_cache: CompilerCache | None = None
+    ) -> None:
         """
         Prepare the shell environment for building python.
 
         This _must_ be called _before_ you try and build packages and _after_
         any python-side prep (activating venvs, installing dependencies) because
         it messes with extremely core python behavior in the shell.
+
+        If compiler_cache is specified, the SDK's compilers are wrapped in it.
         """
-        sysroot = sdk_path / "arm-buildroot-linux-gnueabihf" / "sysroot"
-        sysconfigdata_name = "_sysconfigdata__linux_arm-linux-gnueabihf"
-        pythonpath = sysroot / "usr" / "lib" / "python3.10"
-        self._guarded_shellcall("export _PYTHON_HOST_PLATFORM=linux-x86_64-linux-gnu")
-        self._guarded_shellcall(
-            f"export _PYTHON_SYSCONFIGDATA_NAME={sysconfigdata_name}"
-        )
-        self._guarded_shellcall(f"export PYTHONPATH={pythonpath}")
-        self._guarded_shellcall("export SETUPTOOLS_USE_DISTUTILS=stdlib")
-        self._guarded_shellcall(f"export _python_sysroot={sysroot}")
-        self._guarded_shellcall("export _python_prefix=/usr")
-        self._guarded_shellcall("export _python_exec_prefix=/usr")
-        self._guarded_shellcall("export PYTHONNOUSERSITE=1")
-        # Fix for pandas complex number compilation issue
-        # Add compiler flags to ensure proper complex number support for ARM cross-compilation
-        complex_flags = "-D_Complex_I=I -D_GNU_SOURCE -std=gnu99"
-        self._guarded_shellcall(f'export CFLAGS="$CFLAGS {complex_flags}"')
-        self._guarded_shellcall(f'export CPPFLAGS="$CPPFLAGS {complex_flags}"')
+        set_vars, appended_flags = python_environment(sdk_path)
+        if compiler_cache:
+            set_vars.update(compiler_cache.environment())
+        for name, value in set_vars.items():
+            self._guarded_shellcall(f"export {name}={shlex.quote(value)}")
+        for name, flags in appended_flags.items():
+            self._guarded_shellcall(f'export {name}="${name} {flags}"')
+        if compiler_cache:
+            launcher = shlex.quote(compiler_cache.launcher)
+            for name in WRAPPED_COMPILERS:
+                self._guarded_shellcall(
+                    f'export {name}="${{{name}:+{launcher} ${name}}}"'
+                )
 
     def _shellcall(
         self,
@@ -200,3 +269,245 @@ class SDKSubshell:
             stdin=cast(TextIOBase, self._proc.stdin),
             stdout=cast(TextIOBase, self._proc.stdout),
         )
+
+
+_captured_environments: dict[str, dict[str, str | None]] = {}
+
+#: Separates the environment before sourcing the SDK from the one after
+_SOURCED_MARKER = "xxxsdksourcedxxx"
+#: Variables the shell itself changes, which aren't the SDK's doing
+_SHELL_VARIABLES = frozenset({"_", "SHLVL", "OLDPWD", "PWD"})
+
+
+def sdk_environment_key(
+    sdk_path: Path, base_environment: Mapping[str, str] | None = None
+) -> str:
+    """
+    Identify an SDK's activated environment by the SDK's path and setup script, and
+    the environment it's sourced in, since what it sets can build on that (e.g.
+    PATH).
+    """
+    setup_script = sdk_path / "environment-setup"
+    try:
+        mtime = setup_script.stat().st_mtime_ns
+    except OSError:
+        mtime = 0
+    base = json.dumps(
+        sorted(
+            (base_environment if base_environment is not None else os.environ).items()
+        )
+    )
+    return sha256(f"{sdk_path.resolve()}:{mtime}:{base}".encode()).hexdigest()
+
+
+def _parse_env(output: bytes) -> dict[str, str]:
+    return dict(
+        entry.split("=", 1) for entry in output.decode().split("\0") if "=" in entry
+    )
+
+
+def _source_sdk(sdk_path: Path) -> dict[str, str | None]:
+    """
+    Source the SDK's environment-setup and return what it changed: the variables it
+    set, and None for the ones it unset.
+    """
+    setup_script = shlex.quote(str(sdk_path / "environment-setup"))
+    result = subprocess.run(
+        [
+            "/usr/bin/env",
+            "bash",
+            "-c",
+            f"env -0 && printf '{_SOURCED_MARKER}\\0' && source {setup_script} >&2 "
+            "&& env -0",
+        ],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise ShellCommandFailed(
+            command=f"source {setup_script}",
+            returncode=result.returncode,
+            message="could not activate sdk",
+            output=result.stderr.decode(errors="replace"),
+        )
+    before, _, after = result.stdout.partition(f"{_SOURCED_MARKER}\0".encode())
+    base, sourced = _parse_env(before), _parse_env(after)
+    changes: dict[str, str | None] = {
+        name: value for name, value in sourced.items() if base.get(name) != value
+    }
+    changes.update({name: None for name in base.keys() - sourced.keys()})
+    for name in _SHELL_VARIABLES:
+        changes.pop(name, None)
+    return changes
+
+
+def capture_sdk_environment(
+    sdk_path: Path, cache_dir: Path | None = None
+) -> dict[str, str]:
+    """
+    Source the SDK's environment-setup and return the environment it makes.
+
+    Only what the setup script changes is kept, and it's applied to this process's
+    environment. The changes are remembered for this process and, if cache_dir is
+    given, saved there keyed by the SDK path, the setup script's mtime and the
+    environment it was sourced in, so the SDK only needs to be sourced once across
+    packages and runs.
+    """
+    key = sdk_environment_key(sdk_path)
+    if key not in _captured_environments:
+        cache_file = cache_dir / f"{key}.json" if cache_dir else None
+        cached = bool(cache_file and cache_file.is_file())
+        if cache_dir:
+            record_lookups(cache_dir, hits=int(cached), misses=int(not cached))
+        if cache_file and cached:
+            changes: dict[str, str | None] = json.loads(cache_file.read_text())
+        else:
+            changes = _source_sdk(sdk_path)
+            if cache_file:
+                with atomic_path(cache_file) as temp_file:
+                    temp_file.write_text(json.dumps(changes))
+        _captured_environments[key] = changes
+    environment = dict(os.environ)
+    for name, value in _captured_environments[key].items():
+        if value is None:
+            environment.pop(name, None)
+        else:
+            environment[name] = value
+    return environment
+
+
+class SDKSnapshotEnvironment:
+    """
+    Runs commands with the buildroot SDK active, without a long-running shell.
+
+    The SDK's environment-setup is sourced once and the resulting environment is
+    captured (see capture_sdk_environment); after that, every command is a plain
+    subprocess run with that environment. That skips starting an interactive shell
+    and sourcing the SDK for every package, and the round trip through the shell
+    for every command, and commands can run concurrently.
+
+    Environment changes that would be made in a shell - activating a venv,
+    preparing to cross-compile python - are made to the captured environment.
+    """
+
+    @classmethod
+    @contextmanager
+    def scoped(
+        cls: Type[_SnapshotType],
+        in_directory: Path,
+        sdk_path: Path,
+        echo: EchoFunc | None = None,
+        echo_verbose: EchoFunc | None = None,
+        cache_dir: Path | None = None,
+    ) -> Iterator[_SnapshotType]:
+        """Provides the same context manager interface as SDKSubshell.scoped."""
+        yield cls(
+            in_directory,
+            capture_sdk_environment(sdk_path, cache_dir),
+            echo,
+            echo_verbose,
+        )
+
+    def __init__(
+        self,
+        in_directory: Path,
+        environment: dict[str, str],
+        echo: EchoFunc | None,
+        echo_verbose: EchoFunc | None,
+    ) -> None:
+        self._in_directory = in_directory
+        self.environment = environment
+        self._echo: EchoFunc = echo or (lambda _: None)
+        self._echo_verbose: EchoFunc = echo_verbose or (lambda _: None)
+
+    def run(self, cmd: list[str], env: Mapping[str, str] | None = None) -> str:
+        self._echo(shlex.join(cmd))
+        return run_simple(
+            cmd,
+            name=cmd[0],
+            output=None,
+            cwd=str(self._in_directory),
+            sinks=[self._echo_verbose],
+            env={**self.environment, **(env or {})},
+            # callers parse the output, e.g. for the name of the wheel
+            capture=True,
+        )
+
+    def activate_venv(self, venv_dir: Path) -> None:
+        """Make the same environment changes as sourcing bin/activate."""
+        self.environment["VIRTUAL_ENV"] = str(venv_dir)
+        self.environment["PATH"] = os.pathsep.join(
+            [str(venv_dir / "bin"), self.environment.get("PATH", "")]
+        )
+        self.environment.pop("PYTHONHOME", None)
+
+    def initiate_python_environment(
+        self, sdk_path: Path, compiler_cache: CompilerCache | None = None
+    ) -> None:
+        """See SDKSubshell.initiate_python_environment."""
+        set_vars, appended_flags = python_environment(sdk_path)
+        self.environment.update(set_vars)
+        for name, flags in appended_flags.items():
+            self.environment[name] = f"{self.environment.get(name, '')} {flags}"
+        if compiler_cache:
+            self.environment.update(compiler_cache.environment())
+            for name in WRAPPED_COMPILERS:
+                if self.environment.get(name):
+                    self.environment[name] = compiler_cache.wrap(self.environment[name])
+
+
+SpanFactory = Callable[..., ContextManager[None]]
+
+
+class TimedSDKShell:
+    """Wraps an SDKShell to time each command it runs."""
+
+    def __init__(self, shell: SDKShell, span: SpanFactory) -> None:
+        self._shell = shell
+        self._span = span
+
+    def run(self, cmd: list[str], env: Mapping[str, str] | None = None) -> str:
+        with self._span(shlex.join(cmd[:3]), command=shlex.join(cmd)):
+            return self._shell.run(cmd, env)
+
+    def activate_venv(self, venv_dir: Path) -> None:
+        self._shell.activate_venv(venv_dir)
+
+    def initiate_python_environment(
+        self, sdk_path: Path, compiler_cache: CompilerCache | None = None
+    ) -> None:
+        self._shell.initiate_python_environment(sdk_path, compiler_cache)
+
+
+@contextmanager
+def scoped_sdk_shell(
+    mode: SDKEnvironmentMode,
+    in_directory: Path,
+    sdk_path: Path,
+    echo: EchoFunc | None = None,
+    echo_verbose: EchoFunc | None = None,
+    cache_dir: Path | None = None,
+    span: SpanFactory | None = None,
+) -> Iterator[SDKShell]:
+    """
+    Run commands in an SDK environment for the duration of the context.
+
+    mode: snapshot to run commands as subprocesses with a captured SDK environment
+          (see SDKSnapshotEnvironment); subshell to run them in an interactive shell
+          that sourced the SDK (see SDKSubshell).
+    cache_dir: where captured SDK environments can be saved between runs.
+    span: if specified, a context manager factory like BuildReport.span to time each
+          command with. it's called with the command name and a command keyword arg.
+    """
+    shell: SDKShell
+    with ExitStack() as stack:
+        if mode == "snapshot":
+            shell = stack.enter_context(
+                SDKSnapshotEnvironment.scoped(
+                    in_directory, sdk_path, echo, echo_verbose, cache_dir
+                )
+            )
+        else:
+            shell = stack.enter_context(
+                SDKSubshell.scoped(in_directory, sdk_path, echo, echo_verbose)
+            )
+        yield TimedSDKShell(shell, span) if span else shell
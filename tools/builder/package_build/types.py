@@ -1,10 +1,14 @@
 """build.types - types for building everything"""
 
-from dataclasses import dataclass
-from typing import Protocol
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Literal, Protocol
 from io import TextIOBase
 import os
 from pathlib import Path
+from .report import BuildReport
+from .extract import DEFAULT_EXCLUDE, MemberFilter
+from .pipeline import Pipeline
 
 
 @dataclass
@@ -24,6 +28,10 @@ class BuildPaths:
             f"\t{prefix}dist: {self.dist_path}"
         )
 
+    def label(self) -> str:
+        """A short name for the package, e.g. pandas/1.5.0"""
+        return f"{self.source_path.parent.name}/{self.source_path.name}"
+
 
 @dataclass
 class GlobalBuildContext:
@@ -33,6 +41,24 @@ class GlobalBuildContext:
     #: Whether that output should be verbose
     sdk_path: Path
     #: The path to the buildroot sdk, containing setup_environment
+    jobs: int = 1
+    #: How many packages may build at the same time
+    force_rebuild: bool = False
+    #: Whether to build packages whose dist is already up to date
+    refresh_locks: bool = False
+    #: Whether to resolve build dependencies again rather than use their lockfiles
+    offline: bool = False
+    #: Whether pip may only install build dependencies from the wheelhouse
+    cache_root: Path | None = None
+    #: Where caches shared between builds live, or None to not cache
+    download_cache_mb: int = 10240
+    #: How big the download cache may grow before old archives are evicted
+    sdk_environment: Literal["snapshot", "subshell"] = "subshell"
+    #: Whether to run commands with a captured SDK environment or in a subshell
+    report: BuildReport = field(default_factory=BuildReport)
+    #: Where build timing is recorded
+    pipeline: Pipeline | None = None
+    #: The stage limits shared by packages building at the same time, if they are
 
     def write(self, logstr: str) -> None:
         if not self.output:
@@ -40,6 +66,19 @@ class GlobalBuildContext:
         print(logstr, file=self.output)
         self.output.flush()
 
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Hold a slot in a stage of the build pipeline (see
+        builder.package_build.pipeline) for the body of the context, waiting for one
+        if there's a pipeline and it's full.
+        """
+        if self.pipeline is None:
+            yield
+            return
+        with self.pipeline.stage(name):
+            yield
+
     def write_verbose(self, logstr: str) -> None:
         if not self.output:
             return
@@ -53,7 +92,14 @@ class GlobalBuildContext:
             f"{prefix}Global build context:\n"
             f'\t{prefix}output: {getattr(self.output, "name", self.output)}\n'
             f"\t{prefix}verbose: {self.verbose}\n"
-            f"\t{prefix}sdk path: {str(self.sdk_path)}"
+            f"\t{prefix}sdk path: {str(self.sdk_path)}\n"
+            f"\t{prefix}jobs: {self.jobs}\n"
+            f"\t{prefix}force rebuild: {self.force_rebuild}\n"
+            f"\t{prefix}refresh locks: {self.refresh_locks}\n"
+            f"\t{prefix}offline: {self.offline}\n"
+            f"\t{prefix}cache root: {self.cache_root}\n"
+            f"\t{prefix}download cache size: {self.download_cache_mb}MB\n"
+            f"\t{prefix}sdk environment: {self.sdk_environment}"
         )
 
 
@@ -64,6 +110,12 @@ class PackageBuildContext:
     context: GlobalBuildContext
     #: Link up to the global build settings
 
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **args: Any) -> Iterator[None]:
+        """Time part of this package's build in the build report."""
+        with self.context.report.span(name, category, self.paths.label(), **args):
+            yield
+
     def prettyprint(self, prefix: str = "") -> str:
         next_pref = prefix + "\t"
         return (
@@ -73,6 +125,20 @@ class PackageBuildContext:
         )
 
 
+@dataclass
+class PackageBuildResult:
+    paths: BuildPaths
+    #: The paths of the package that was built
+    succeeded: bool
+    #: Whether the build produced a wheel
+    log_path: Path | None = None
+    #: Where the build log went, if it did not go to the global output
+    error: str | None = None
+    #: What went wrong, if the build failed
+    report: BuildReport | None = None
+    #: Build timing, if it was recorded somewhere other than the global report
+
+
 class HTTPFetchableSource(Protocol):
     @property
     def name(self) -> str:
@@ -113,12 +179,31 @@ class _GithubSource:
     tag: str
     """The tag name to pull for this version (e.g. v1.5.0 for pandas 1.5.0)"""
 
+    include: list[str] | None = field(default=None, kw_only=True)
+    """If set, globs of the only parts of the source to unpack"""
+
+    exclude: list[str] | None = field(default=None, kw_only=True)
+    """Globs of parts of the source not to unpack, or None for DEFAULT_EXCLUDE"""
+
+    sha256: str | None = field(default=None, kw_only=True)
+    """The hex sha256 the downloaded archive must have, if it's pinned"""
+
+    def member_filter(self) -> MemberFilter:
+        """Which members of the downloaded archive to unpack."""
+        return MemberFilter(
+            self.include or (),
+            DEFAULT_EXCLUDE if self.exclude is None else self.exclude,
+        )
+
     def prettyprint(self, prefix: str = "") -> str:
         return (
             f"{prefix}\tname: {self.name}\n"
             f"{prefix}\torg: {self.org}\n"
             f"{prefix}\trepo: {self.repo}\n"
-            f"{prefix}\ttag: {self.tag}"
+            f"{prefix}\ttag: {self.tag}\n"
+            f"{prefix}\tinclude: {self.include}\n"
+            f"{prefix}\texclude: {self.exclude}\n"
+            f"{prefix}\tsha256: {self.sha256}"
         )
 
 
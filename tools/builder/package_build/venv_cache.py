@@ -0,0 +1,102 @@
+"""builder.package_build.venv_cache - reuse prepared build virtualenvs"""
+from hashlib import sha256
+from pathlib import Path
+import json
+import os
+import shutil
+import tempfile
+
+from builder.common.cache import evict_lru, record_lookups, remove, touch
+
+VENV_CACHE_MAX_BYTES = 8 * 1024 * 1024 * 1024
+
+_ORIGIN_FILE = ".builder-venv-origin"
+
+
+def _link_file(source: str, dest: str) -> None:
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def _relocate_scripts(venv_dir: Path, old_path: str) -> None:
+    """Point the scripts in a cloned venv's bin/ at the clone instead of the original."""
+    old = old_path.encode()
+    new = str(venv_dir).encode()
+    for script in (venv_dir / "bin").iterdir():
+        if script.is_symlink() or not script.is_file():
+            continue
+        contents = script.read_bytes()
+        if old not in contents:
+            continue
+        # the script is hardlinked to the cache, so write a new file rather than
+        # changing the shared one
+        mode = script.stat().st_mode
+        relocated = script.with_name(f".{script.name}.relocating")
+        relocated.write_bytes(contents.replace(old, new))
+        relocated.chmod(mode)
+        relocated.replace(script)
+
+
+def clone_venv(source: Path, dest: Path, origin: str) -> Path:
+    """Clone the venv at source, which was created at origin, to dest."""
+    remove(dest)
+    shutil.copytree(source, dest, symlinks=True, copy_function=_link_file)
+    (dest / _ORIGIN_FILE).unlink(missing_ok=True)
+    _relocate_scripts(dest, origin)
+    return dest
+
+
+class VenvCache:
+    """
+    A cache of prepared build venvs, keyed by the dependencies installed in them and
+    the interpreter that made them. When the cache grows past max_bytes, the least
+    recently used venvs are evicted.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = VENV_CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = root / "entries"
+        self._incoming = root / "incoming"
+
+    @staticmethod
+    def key(dependencies: list[str], interpreter: str) -> str:
+        return sha256(
+            json.dumps(
+                {"dependencies": dependencies, "interpreter": interpreter}
+            ).encode()
+        ).hexdigest()
+
+    def lookup(self, key: str) -> Path | None:
+        """Find the cached venv for a key, if there is one."""
+        entry = self._entries / key
+        if not (entry / _ORIGIN_FILE).is_file():
+            record_lookups(self.root, misses=1)
+            return None
+        touch(entry)
+        record_lookups(self.root, hits=1)
+        return entry
+
+    def clone_to(self, entry: Path, venv_dir: Path) -> Path:
+        """Clone a cached venv from lookup() into venv_dir."""
+        origin = (entry / _ORIGIN_FILE).read_text()
+        return clone_venv(entry, venv_dir, origin)
+
+    def store(self, key: str, venv_dir: Path) -> Path:
+        """Store a copy of a freshly prepared venv in the cache."""
+        self._entries.mkdir(parents=True, exist_ok=True)
+        self._incoming.mkdir(parents=True, exist_ok=True)
+        incoming = Path(tempfile.mkdtemp(dir=self._incoming)) / key
+        shutil.copytree(venv_dir, incoming, symlinks=True, copy_function=_link_file)
+        (incoming / _ORIGIN_FILE).write_text(str(venv_dir))
+        entry = self._entries / key
+        try:
+            os.rename(incoming, entry)
+        except OSError:
+            # somebody else stored the same venv first, which is just as good
+            pass
+        remove(incoming.parent)
+        evict_lru(self._entries, self.max_bytes, keep=(entry,))
+        return entry
@@ -0,0 +1,111 @@
+"""builder.package_build.wheelhouse - a local store of build dependencies"""
+from dataclasses import dataclass, field
+from io import TextIOBase
+from pathlib import Path
+from typing import Sequence
+import sys
+
+from builder.common.cache import LOOKUPS_NAME, path_size, remove
+from builder.common.shellcommand import run_simple
+from .lockfile import LOCK_NAME, RESOLVING_PREFIX, DependencyLock, pip_fill_command
+
+WHEELHOUSE_DIR = "wheelhouse"
+
+
+class MissingFromWheelhouse(RuntimeError):
+    """Locked build dependencies aren't in the wheelhouse, and we may not fetch them."""
+
+
+@dataclass
+class WheelhouseChanges:
+    changed: list[Path] = field(default_factory=list)
+    #: The lockfiles that had files downloaded, or the files that were removed
+    skipped: list[Path] = field(default_factory=list)
+    #: The lockfiles that couldn't be read
+    bytes_removed: int = 0
+    #: How much space pruning freed
+
+
+def pip_index_args(wheelhouse: Path, offline: bool) -> list[str]:
+    """Where pip should find distributions: the wheelhouse, and PyPI unless offline."""
+    return ["--find-links", str(wheelhouse)] + (["--no-index"] if offline else [])
+
+
+def check_available(lock: DependencyLock, lock_path: Path, wheelhouse: Path) -> None:
+    """Raise MissingFromWheelhouse if any of a lock's files aren't in the wheelhouse."""
+    missing = lock.missing_from(wheelhouse)
+    if missing:
+        raise MissingFromWheelhouse(
+            f"{', '.join(requirement.filename for requirement in missing)} from "
+            f"{lock_path} not in {wheelhouse}; run build-packages wheelhouse populate "
+            "while online"
+        )
+
+
+def find_locks(package_root: Path) -> list[Path]:
+    """The lockfiles of all the packages in a package tree."""
+    return sorted(package_root.glob(f"*/*/{LOCK_NAME}"))
+
+
+def populate(
+    wheelhouse: Path,
+    package_root: Path,
+    output: TextIOBase | None,
+    verbose: bool = False,
+    *,
+    python: str = sys.executable,
+    index_args: Sequence[str] = (),
+) -> WheelhouseChanges:
+    """
+    Download everything the packages' lockfiles pin that isn't in the wheelhouse.
+
+    The files are chosen for the interpreter running this, which in the container
+    is the python that build venvs are made from. index_args replaces where pip
+    downloads from - PyPI by default.
+    """
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+    changes = WheelhouseChanges()
+    for lock_path in find_locks(package_root):
+        lock = DependencyLock.load(lock_path)
+        if lock is None:
+            changes.skipped.append(lock_path)
+            continue
+        if not lock.missing_from(wheelhouse):
+            continue
+        run_simple(
+            pip_fill_command(python, lock_path, wheelhouse, index_args),
+            name=f"download of {lock_path}",
+            output=output,
+            verbose=verbose,
+        )
+        changes.changed.append(lock_path)
+    return changes
+
+
+def prune(wheelhouse: Path, package_root: Path) -> WheelhouseChanges:
+    """
+    Remove the files in the wheelhouse that no lockfile pins, and anything left from
+    a resolution that didn't finish. If a lockfile can't be read, nothing is pruned,
+    since that lock's files can't be told apart from the rest.
+    """
+    changes = WheelhouseChanges()
+    pinned: set[str] = set()
+    for lock_path in find_locks(package_root):
+        lock = DependencyLock.load(lock_path)
+        if lock is None:
+            changes.skipped.append(lock_path)
+            continue
+        pinned.update(requirement.filename for requirement in lock.locked)
+    if changes.skipped or not wheelhouse.is_dir():
+        return changes
+    for entry in sorted(wheelhouse.iterdir()):
+        if entry.name in pinned and not entry.is_dir():
+            continue
+        if entry.name == LOOKUPS_NAME:
+            continue
+        if entry.is_dir() and not entry.name.startswith(RESOLVING_PREFIX):
+            continue
+        changes.bytes_removed += path_size(entry)
+        remove(entry)
+        changes.changed.append(entry)
+    return changes
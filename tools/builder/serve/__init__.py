@@ -0,0 +1,7 @@
+"""
+builder.serve: serve a generated index
+"""
+from .server import serve
+from .run import run_from_cmdline
+
+__all__ = ["serve", "run_from_cmdline"]
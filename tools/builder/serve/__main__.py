@@ -0,0 +1,3 @@
+from .run import run_from_cmdline
+
+run_from_cmdline()
@@ -0,0 +1,40 @@
+"""builder.serve.run - command line entrypoint for serving the index"""
+from pathlib import Path
+import argparse
+
+from .server import serve
+
+
+def run_from_cmdline() -> None:
+    """
+    Serve an index as a main function from a command line call.
+
+    That means it may write to sys.stdout and may call sys.exit.
+    """
+    parser = argparse.ArgumentParser("Serve a generated index.")
+    parser.add_argument(
+        "port",
+        type=int,
+        nargs="?",
+        default=8000,
+        help="The port to serve on",
+    )
+    parser.add_argument(
+        "--directory",
+        type=Path,
+        default=Path.cwd(),
+        help="The index root to serve, the directory that has simple/ in it",
+    )
+    parser.add_argument(
+        "--bind",
+        type=str,
+        default="",
+        help="The address to bind to (default: all interfaces)",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Don't log each request",
+    )
+    parsed_args = parser.parse_args()
+    serve(parsed_args.directory, parsed_args.port, parsed_args.bind, parsed_args.quiet)
@@ -0,0 +1,363 @@
+"""builder.serve.server - serve a generated index to a fleet of robots"""
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import parse_qs, unquote, urlsplit
+import mimetypes
+import os
+import posixpath
+import re
+
+HTML_TYPE = "text/html"
+SIMPLE_HTML_TYPE = "application/vnd.pypi.simple.v1+html"
+SIMPLE_JSON_TYPE = "application/vnd.pypi.simple.v1+json"
+
+#: The pages for an index directory, and the content types they can be sent as
+_DIRECTORY_PAGES = {
+    "index.json": (
+        SIMPLE_JSON_TYPE,
+        "application/vnd.pypi.simple.latest+json",
+    ),
+    "index.html": (
+        SIMPLE_HTML_TYPE,
+        "application/vnd.pypi.simple.latest+html",
+        HTML_TYPE,
+    ),
+}
+
+_CONTENT_TYPES = {
+    ".whl": "application/octet-stream",
+    ".metadata": "text/plain; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+    ".json": "application/json",
+}
+
+#: Pages change whenever the index does, so clients should always check them;
+#: other files only change when a package is rebuilt
+_PAGE_CACHE_CONTROL = "no-cache"
+_FILE_CACHE_CONTROL = "public, max-age=600"
+
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@dataclass
+class _Representation:
+    path: Path
+    #: The file to send
+    content_type: str
+    #: What to call it
+    encoding: str | None
+    #: How it's encoded, if it's a precompressed copy
+    is_page: bool
+    #: Whether it's an index page
+    negotiated: bool
+    #: Whether it was picked based on the Accept header
+
+
+def parse_accept(header: str | None) -> list[tuple[str, float]]:
+    """Parse an Accept header into (media type, quality) pairs, best first."""
+    if not header:
+        return [("*/*", 1.0)]
+    accepted: list[tuple[str, float]] = []
+    for item in header.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted.append((media_type.lower(), quality))
+    return sorted(accepted, key=lambda item: -item[1])
+
+
+def _matches(accepted: str, content_type: str) -> bool:
+    if accepted == "*/*":
+        return True
+    if accepted.endswith("/*"):
+        return content_type.startswith(accepted[:-1])
+    return accepted == content_type
+
+
+def negotiate_page(directory: Path, accept: str | None) -> tuple[Path, str] | None:
+    """
+    Pick the page for an index directory that best matches an Accept header, and
+    the content type to send it as. Returns None if nothing acceptable exists.
+    """
+    available = [
+        (directory / page, content_type)
+        for page, content_types in _DIRECTORY_PAGES.items()
+        if (directory / page).is_file()
+        for content_type in content_types
+    ]
+    # html first, so clients that don't ask for anything in particular get it
+    available.sort(key=lambda item: item[0].name != "index.html")
+    for accepted, quality in parse_accept(accept):
+        if quality <= 0:
+            continue
+        for path, content_type in available:
+            if _matches(accepted, content_type):
+                if accepted == "*/*" or accepted.endswith("/*"):
+                    # a wildcard gets html sent as plain html
+                    return path, _DIRECTORY_PAGES[path.name][-1]
+                return path, content_type
+    return None
+
+
+def accepts_gzip(header: str | None) -> bool:
+    for accepted, quality in parse_accept(header or "identity"):
+        if accepted in ("gzip", "*") and quality > 0:
+            return True
+    return False
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single-range Range header into an inclusive (start, end). Returns None
+    if the header isn't a single byte range, and raises ValueError if the range
+    can't be satisfied.
+    """
+    match = _range_re.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def etag_for(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    """Serves files from the server's index root."""
+
+    server: "IndexServer"
+    protocol_version = "HTTP/1.1"
+    server_version = "OpentronsIndex/1.0"
+
+    def do_GET(self) -> None:
+        self._serve(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._serve(send_body=False)
+
+    def log_message(self, format: str, *args: object) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _serve(self, send_body: bool) -> None:
+        url = urlsplit(self.path)
+        target = self._translate(url.path)
+        if target is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        if target.is_dir() and not url.path.endswith("/"):
+            self._redirect(url.path + "/" + (f"?{url.query}" if url.query else ""))
+            return
+        representation = self._representation(target, url.query)
+        if representation is None:
+            return
+        self._send_file(representation, send_body)
+
+    def _translate(self, url_path: str) -> Path | None:
+        """Find the file for a url path, without letting it leave the root."""
+        normalized = posixpath.normpath(unquote(url_path)).lstrip("/")
+        if normalized == ".":
+            return self.server.root
+        if normalized == ".." or normalized.startswith("../"):
+            return None
+        target = self.server.root / normalized
+        # symlinked distributions point outside the root, so this is checked
+        # lexically rather than with real paths
+        if not target.exists():
+            return None
+        return target
+
+    def _redirect(self, location: str) -> None:
+        self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _representation(self, target: Path, query: str) -> _Representation | None:
+        if target.is_dir():
+            # pip and other PEP 691 clients can also ask for a format in the query
+            requested = parse_qs(query).get("format")
+            accept = requested[0] if requested else self.headers.get("Accept")
+            negotiated = negotiate_page(target, accept)
+            if negotiated is None:
+                if any((target / page).is_file() for page in _DIRECTORY_PAGES):
+                    self.send_error(HTTPStatus.NOT_ACCEPTABLE)
+                else:
+                    self.send_error(HTTPStatus.NOT_FOUND)
+                return None
+            path, content_type = negotiated
+            if content_type == HTML_TYPE:
+                content_type += "; charset=utf-8"
+            return self._maybe_compressed(path, content_type, negotiated=True)
+        content_type = _CONTENT_TYPES.get(target.suffix) or (
+            mimetypes.guess_type(target.name)[0] or "application/octet-stream"
+        )
+        return self._maybe_compressed(target, content_type, negotiated=False)
+
+    def _maybe_compressed(
+        self, path: Path, content_type: str, negotiated: bool
+    ) -> _Representation:
+        is_page = path.name in _DIRECTORY_PAGES
+        compressed = path.with_name(path.name + ".gz")
+        if (
+            is_page
+            and accepts_gzip(self.headers.get("Accept-Encoding"))
+            and compressed.is_file()
+            and compressed.stat().st_mtime_ns >= path.stat().st_mtime_ns
+        ):
+            return _Representation(compressed, content_type, "gzip", True, negotiated)
+        return _Representation(path, content_type, None, is_page, negotiated)
+
+    def _not_modified(self, stat: os.stat_result, etag: str) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat.st_mtime) <= since
+        return False
+
+    def _requested_range(
+        self, stat: os.stat_result, etag: str
+    ) -> tuple[int, int] | None:
+        range_header = self.headers.get("Range")
+        if not range_header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range.strip() not in (
+            etag,
+            formatdate(stat.st_mtime, usegmt=True),
+        ):
+            # the client has an old version; send the whole new one
+            return None
+        return parse_range(range_header, stat.st_size)
+
+    def _send_headers(
+        self, representation: _Representation, stat: os.stat_result, etag: str
+    ) -> None:
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.send_header(
+            "Cache-Control",
+            _PAGE_CACHE_CONTROL if representation.is_page else _FILE_CACHE_CONTROL,
+        )
+        vary = (["Accept"] if representation.negotiated else []) + (
+            ["Accept-Encoding"] if representation.is_page else []
+        )
+        if vary:
+            self.send_header("Vary", ", ".join(vary))
+
+    def _send_file(self, representation: _Representation, send_body: bool) -> None:
+        try:
+            fileobj = open(representation.path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with fileobj:
+            stat = os.fstat(fileobj.fileno())
+            etag = etag_for(stat)
+            if representation.encoding:
+                etag = f'{etag[:-1]}-{representation.encoding}"'
+            if self._not_modified(stat, etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self._send_headers(representation, stat, etag)
+                self.end_headers()
+                return
+            try:
+                requested = self._requested_range(stat, etag)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send_contents(representation, fileobj, stat, etag, requested)
+            if not send_body:
+                return
+            start, end = requested or (0, stat.st_size - 1)
+            if end >= start:
+                self._send_body(fileobj, start, end - start + 1)
+
+    def _send_contents(
+        self,
+        representation: _Representation,
+        fileobj: BinaryIO,
+        stat: os.stat_result,
+        etag: str,
+        requested: tuple[int, int] | None,
+    ) -> None:
+        start, end = requested or (0, stat.st_size - 1)
+        if requested:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", representation.content_type)
+        if representation.encoding:
+            self.send_header("Content-Encoding", representation.encoding)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self._send_headers(representation, stat, etag)
+        self.end_headers()
+
+    def _send_body(self, fileobj: BinaryIO, start: int, length: int) -> None:
+        self.wfile.flush()
+        try:
+            # zero-copy where the platform can; socket.sendfile reads and sends
+            # by itself where it can't
+            self.connection.sendfile(fileobj, start, length)
+        except ConnectionError:
+            # the client went away, which robots on flaky links will do
+            self.close_connection = True
+
+
+class IndexServer(ThreadingHTTPServer):
+    """A threaded server for an index root."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self, address: tuple[str, int], root: Path, quiet: bool = False
+    ) -> None:
+        self.root = root
+        self.quiet = quiet
+        super().__init__(address, IndexRequestHandler)
+
+
+def serve(root: Path, port: int = 8000, bind: str = "", quiet: bool = False) -> None:
+    """Serve the index at root until interrupted."""
+    with IndexServer((bind, port), root, quiet) as server:
+        print(f"Serving {root} on http://{bind or '0.0.0.0'}:{server.server_port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1 @@
+"""Tests for code shared between the host and container sides."""
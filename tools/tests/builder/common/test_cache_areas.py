@@ -0,0 +1,61 @@
+import os
+from io import StringIO
+from pathlib import Path
+
+from builder.common import cache_areas
+from builder.common.cache import record_lookups
+
+
+def _write(path: Path, size: int, age: float) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (age, age))
+    return path
+
+
+def _fill(cache_root: Path) -> None:
+    _write(cache_root / "downloads" / "blobs" / "old-archive", 4000, 1000)
+    _write(cache_root / "downloads" / "blobs" / "new-archive", 4000, 3000)
+    venv = cache_root / "venvs" / "entries" / "somekey"
+    _write(venv / "bin" / "python", 2000, 2000)
+    os.utime(venv, (2000, 2000))
+    _write(cache_root / "ccache" / "a" / "b" / "objectR", 1000, 1500)
+    _write(cache_root / "ccache" / "ccache.conf", 10, 500)
+
+
+def test_stats(run_path: Path) -> None:
+    cache_root = run_path / "cache"
+    _fill(cache_root)
+    record_lookups(cache_root / "downloads", hits=3)
+    record_lookups(cache_root / "downloads", misses=1)
+    stats = {stat.area.name: stat for stat in cache_areas.cache_stats(cache_root)}
+    assert stats["downloads"].entries == 2
+    assert stats["downloads"].size >= 8000
+    assert stats["downloads"].hit_rate() == 0.75
+    assert stats["venvs"].entries == 1
+    assert stats["ccache"].entries == 1
+    assert stats["pip"].size == 0
+    assert stats["pip"].hit_rate() is None
+    table = cache_areas.format_stats(list(stats.values()))
+    assert "75%" in table
+
+
+def test_prune_evicts_least_recently_used(run_path: Path) -> None:
+    cache_root = run_path / "cache"
+    _fill(cache_root)
+    record_lookups(cache_root / "downloads", hits=1)
+    evicted = cache_areas.prune(cache_root, 5000)
+    assert [path.name for path in evicted] == ["old-archive", "objectR", "somekey"]
+    assert (cache_root / "downloads" / "blobs" / "new-archive").exists()
+    # counters and configuration stay
+    assert (cache_root / "ccache" / "ccache.conf").exists()
+    assert cache_areas.cache_stats(cache_root)[0].hits == 1
+
+
+def test_clear(run_path: Path) -> None:
+    cache_root = run_path / "cache"
+    _fill(cache_root)
+    output = StringIO()
+    cache_areas.run_cache_command("clear", cache_root, 100, output)
+    assert not any(cache_root.iterdir())
+    assert "Cleared" in output.getvalue()
@@ -0,0 +1,88 @@
+from io import StringIO
+import sys
+import time
+
+import pytest
+
+from builder.common.shellcommand import (
+    ShellCommandFailed,
+    ShellCommandTimedOut,
+    TailBuffer,
+    run_simple,
+)
+
+
+def _python(script: str) -> list[str]:
+    return [sys.executable, "-c", script]
+
+
+def test_run_simple_returns_output_unchanged() -> None:
+    result = run_simple(
+        _python("print('one'); print('two', end='')"),
+        name="test",
+        output=StringIO(),
+        capture=True,
+    )
+    assert result == "one\ntwo"
+
+
+def test_run_simple_keeps_only_tail_by_default() -> None:
+    assert run_simple(_python("print('one')"), name="test", output=StringIO()) == ""
+
+
+def test_run_simple_streams_to_sinks_and_output() -> None:
+    lines: list[str] = []
+    output = StringIO()
+    run_simple(
+        _python("for i in range(3): print(i)"),
+        name="test",
+        output=output,
+        verbose=True,
+        sinks=[lines.append],
+    )
+    assert lines == ["0\n", "1\n", "2\n"]
+    assert output.getvalue().endswith("0\n1\n2\n")
+
+
+def test_run_simple_does_not_poll_quiet_commands() -> None:
+    start = time.monotonic()
+    run_simple(
+        _python("import sys\nfor i in range(200): sys.stdout.write(f'{i}\\n')"),
+        name="test",
+        output=StringIO(),
+    )
+    # the old implementation slept 0.1s per line when not verbose
+    assert time.monotonic() - start < 5
+
+
+def test_run_simple_failure_keeps_tail() -> None:
+    with pytest.raises(ShellCommandFailed) as excinfo:
+        run_simple(
+            _python("import sys\nfor i in range(1000): print(i)\nsys.exit(4)"),
+            name="counter",
+            output=StringIO(),
+        )
+    assert excinfo.value.returncode == 4
+    assert excinfo.value.message == "counter failed"
+    assert excinfo.value.output.endswith("999\n")
+    assert not excinfo.value.output.startswith("0\n")
+
+
+def test_run_simple_times_out() -> None:
+    start = time.monotonic()
+    with pytest.raises(ShellCommandTimedOut) as excinfo:
+        run_simple(
+            _python("import time\nprint('started', flush=True)\ntime.sleep(30)"),
+            name="sleeper",
+            output=StringIO(),
+            timeout=0.5,
+        )
+    assert time.monotonic() - start < 10
+    assert "started" in excinfo.value.output
+
+
+def test_tail_buffer_is_bounded() -> None:
+    tail = TailBuffer(max_lines=2)
+    for line in ["a\n", "b\n", "c\n"]:
+        tail(line)
+    assert tail.text() == "b\nc\n"
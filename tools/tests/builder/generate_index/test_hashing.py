@@ -0,0 +1,42 @@
+from hashlib import sha256
+from pathlib import Path
+import os
+
+import pytest
+
+from builder.generate_index import hashing
+
+
+def test_file_sha256_streams_in_chunks(
+    run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(hashing, "CHUNK_SIZE", 7)
+    contents = os.urandom(1000)
+    path = run_path / "dist.whl"
+    path.write_bytes(contents)
+    assert hashing.file_sha256(path) == sha256(contents).hexdigest()
+
+
+def test_hash_files(run_path: Path) -> None:
+    paths = []
+    for index in range(5):
+        path = run_path / f"dist{index}.whl"
+        path.write_bytes(os.urandom(100 + index))
+        paths.append(path)
+    digests = hashing.hash_files(paths + paths[:2], threads=3)
+    assert set(digests.keys()) == set(paths)
+    for path, digest in digests.items():
+        assert digest == sha256(path.read_bytes()).hexdigest()
+
+
+def test_digests_are_reused(run_path: Path) -> None:
+    path = run_path / "dist.whl"
+    path.write_bytes(b"first")
+    first = hashing.file_sha256(path)
+    stat = path.stat()
+    # same size and mtime: the file is assumed unchanged
+    path.write_bytes(b"other")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert hashing.file_sha256(path) == first
+    path.write_bytes(b"changed")
+    assert hashing.file_sha256(path) == sha256(b"changed").hexdigest()
@@ -0,0 +1,77 @@
+from hashlib import sha256
+from pathlib import Path
+import os
+
+import pytest
+
+from builder.generate_index import link
+
+
+@pytest.fixture
+def source(run_path: Path) -> Path:
+    dist = run_path / "dist" / "pkg-1.0-py3-none-any.whl"
+    dist.parent.mkdir()
+    dist.write_bytes(b"wheel contents")
+    (run_path / "index").mkdir()
+    return dist
+
+
+def test_place_hardlink(source: Path, run_path: Path) -> None:
+    target = run_path / "index" / source.name
+    assert link.place_file(source, target, "hardlink") == "hardlink"
+    assert target.stat().st_ino == source.stat().st_ino
+
+
+def test_place_symlink_is_relative(source: Path, run_path: Path) -> None:
+    target = run_path / "index" / source.name
+    assert link.place_file(source, target, "symlink") == "symlink"
+    assert target.is_symlink()
+    assert not os.path.isabs(os.readlink(target))
+    assert target.read_bytes() == b"wheel contents"
+
+
+@pytest.mark.parametrize("mode", link.LINK_MODES)
+def test_place_contents(source: Path, run_path: Path, mode: link.LinkMode) -> None:
+    target = run_path / "index" / source.name
+    target.write_bytes(b"stale")
+    link.place_file(source, target, mode)
+    assert target.read_bytes() == b"wheel contents"
+    assert not list((run_path / "index").glob(".*"))
+
+
+def test_place_falls_back_to_copy(
+    source: Path, run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def _cross_device(*args: object) -> None:
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", _cross_device)
+    target = run_path / "index" / source.name
+    assert link.place_file(source, target, "hardlink") == "copy"
+    assert target.read_bytes() == b"wheel contents"
+    assert target.stat().st_ino != source.stat().st_ino
+
+
+def test_place_does_not_write_through_links(source: Path, run_path: Path) -> None:
+    target = run_path / "index" / source.name
+    link.place_file(source, target, "hardlink")
+    other = run_path / "dist" / "other.whl"
+    other.write_bytes(b"other contents")
+    link.place_file(other, target, "copy")
+    assert source.read_bytes() == b"wheel contents"
+    assert target.read_bytes() == b"other contents"
+
+
+def test_is_identical(source: Path, run_path: Path) -> None:
+    digest = sha256(b"wheel contents").hexdigest()
+    size = source.stat().st_size
+    target = run_path / "index" / source.name
+    assert not link.is_identical(source, target, size, digest)
+    link.place_file(source, target, "hardlink")
+    assert link.is_identical(source, target, size, digest)
+    target.unlink()
+    target.write_bytes(b"wheel contents")
+    assert link.is_identical(source, target, size, digest)
+    different = run_path / "index" / "different.whl"
+    different.write_bytes(b"wheel CONTENTS")
+    assert not link.is_identical(source, different, size, digest)
@@ -1,15 +1,118 @@
+from hashlib import sha256
 from pathlib import Path
-from builder.generate_index import orchestrate
+import json
 
+import pytest
+from bs4 import BeautifulSoup, Tag
 
-def test_collate_to_packages(
-    dist_path: Path, dist_files: set[Path], package_names: list[str]
+from builder.generate_index import link, manifest, orchestrate
+
+
+def _mtimes(index_root: Path) -> dict[Path, int]:
+    return {
+        path: path.stat().st_mtime_ns
+        for path in index_root.rglob("*")
+        if path.is_file()
+    }
+
+
+def test_generate_is_incremental(
+    dist_path: Path, run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    index_root = run_path / "index-out"
+    first = orchestrate.generate("http://localhost", index_root, dist_path)
+    assert (index_root / manifest.MANIFEST_NAME).exists()
+    leaf = index_root / "simple" / "pyudev" / "index.html"
+    assert leaf in first
+    before = _mtimes(index_root)
+
+    # nothing changed: nothing is inspected or rewritten, and the result is the same
+    def _inspect(path: Path) -> manifest.DistributionRecord:
+        raise AssertionError(f"{path} should not be inspected")
+
+    monkeypatch.setattr(manifest, "inspect_distribution", _inspect)
+    second = orchestrate.generate("http://localhost", index_root, dist_path)
+    assert sorted(second) == sorted(first)
+    after = _mtimes(index_root)
+    del after[index_root / manifest.MANIFEST_NAME]
+    del before[index_root / manifest.MANIFEST_NAME]
+    assert after == before
+    monkeypatch.undo()
+
+    # one distribution removed: only its package's page changes
+    removed = next((dist_path / "pyudev" / "0.23.0").glob("*.whl"))
+    removed.unlink()
+    third = orchestrate.generate("http://localhost", index_root, dist_path)
+    after = _mtimes(index_root)
+    assert not (index_root / "simple" / "pyudev" / removed.name).exists()
+    assert index_root / "simple" / "pyudev" / removed.name not in third
+    assert after[leaf] != before[leaf]
+    assert removed.name not in leaf.read_text()
+    airium_leaf = index_root / "simple" / "airium" / "index.html"
+    assert after[airium_leaf] == before[airium_leaf]
+
+
+def test_generate_removes_dropped_package(dist_path: Path, run_path: Path) -> None:
+    index_root = run_path / "index-out"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    assert (index_root / "simple" / "airium").is_dir()
+    for wheel in (dist_path / "airium").rglob("*.whl"):
+        wheel.unlink()
+    paths = orchestrate.generate("http://localhost", index_root, dist_path)
+    assert not (index_root / "simple" / "airium").exists()
+    assert not any("airium" in str(path) for path in paths)
+    assert "airium" not in (index_root / "simple" / "index.html").read_text()
+    assert (index_root / "simple" / "pyudev" / "index.html").is_file()
+
+
+def test_generate_url_change_rewrites_pages(dist_path: Path, run_path: Path) -> None:
+    index_root = run_path / "index-out"
+    orchestrate.generate("http://localhost", index_root, dist_path)
+    orchestrate.generate("http://otherhost", index_root, dist_path)
+    assert "otherhost" in (index_root / "simple" / "six" / "index.html").read_text()
+    assert "otherhost" in (index_root / "simple" / "index.html").read_text()
+
+
+def test_generate_core_metadata_and_json(dist_path: Path, run_path: Path) -> None:
+    index_root = run_path / "index-out"
+    paths = orchestrate.generate("http://localhost", index_root, dist_path)
+    package_dir = index_root / "simple" / "pyudev"
+    wheel = next(package_dir.glob("*.whl"))
+    metadata = package_dir / f"{wheel.name}.metadata"
+    assert metadata in paths
+    assert metadata.read_bytes() == manifest.read_core_metadata(wheel)
+    assert b"Name: pyudev" in metadata.read_bytes()
+    metadata_hash = f"sha256={sha256(metadata.read_bytes()).hexdigest()}"
+
+    soup = BeautifulSoup((package_dir / "index.html").read_text(), "html.parser")
+    link = soup.find("a", string=lambda text: text and text.strip() == wheel.name)
+    assert isinstance(link, Tag)
+    assert link.get("data-core-metadata") == metadata_hash
+    assert link.get("data-dist-info-metadata") == metadata_hash
+
+    leaf_json = json.loads((package_dir / "index.json").read_text())
+    assert leaf_json["meta"] == {"api-version": "1.0"}
+    assert leaf_json["name"] == "pyudev"
+    entry = next(
+        entry for entry in leaf_json["files"] if entry["filename"] == wheel.name
+    )
+    assert entry["url"] == f"http://localhost/simple/pyudev/{wheel.name}"
+    assert entry["hashes"]["sha256"] == sha256(wheel.read_bytes()).hexdigest()
+    assert entry["core-metadata"] == {"sha256": metadata_hash.split("=")[1]}
+
+    root_json = json.loads((index_root / "simple" / "index.json").read_text())
+    assert sorted(project["name"] for project in root_json["projects"]) == sorted(
+        ["airium", "pyudev", "six"]
+    )
+
+
+@pytest.mark.parametrize("link_mode", ["copy", "hardlink"])
+def test_generate_link_mode(
+    dist_path: Path, run_path: Path, link_mode: link.LinkMode
 ) -> None:
-    collated = orchestrate.collate_to_packages(dist_files)
-    assert sorted(collated.keys()) == sorted(package_names)
-    for package_name, dists in collated.items():
-        assert dists
-        for dist in dists:
-            assert package_name in str(dist.name)
-            dist_files.remove(dist)
-    assert not dist_files, f"Some distributions were not captured: {dist_files}"
+    index_root = run_path / "index-out"
+    orchestrate.generate("http://localhost", index_root, dist_path, link_mode)
+    dist = next((dist_path / "six").glob("**/*.whl"))
+    indexed = index_root / "simple" / "six" / dist.name
+    assert indexed.read_bytes() == dist.read_bytes()
+    assert (indexed.stat().st_ino == dist.stat().st_ino) == (link_mode == "hardlink")
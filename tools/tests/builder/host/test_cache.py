@@ -0,0 +1,8 @@
+from pathlib import Path
+
+from builder.host import cache
+
+
+def test_host_cache_root() -> None:
+    assert cache.host_cache_root("/abs/cache", "/repo") == Path("/abs/cache")
+    assert cache.host_cache_root("./cache", "/repo") == Path("/repo/cache")
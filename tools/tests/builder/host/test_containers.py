@@ -1,4 +1,11 @@
+import io
 import re
+from io import StringIO
+from pathlib import Path
+from typing import Any, cast
+
+import pytest
+
 from builder.host import containers
 from builder import __version__
 
@@ -15,3 +22,77 @@ def test_container_run_invoker() -> None:
     assert "my-cool-container" in invoke_str
     for arg in args:
         assert arg in invoke_str
+
+
+def test_container_run_mounts_cache() -> None:
+    invoke = containers._container_run_invoke_cmd(
+        "my-cool-container", ["--cache-root=./cache"], "/repo/tools", "/host/cache"
+    )
+    assert "--volume=/host/cache:/build-environment/cache:rw,delegated" in invoke
+    assert invoke.index("my-cool-container") < invoke.index("--cache-root=./cache")
+    assert invoke[-1] == "--cache-root=/build-environment/cache"
+
+
+def _image_sources(root: Path) -> Path:
+    (root / "builder" / "__pycache__").mkdir(parents=True)
+    (root / "builder" / "__init__.py").write_text("__version__ = '1'\n")
+    (root / "builder" / "__pycache__" / "__init__.cpython-310.pyc").write_bytes(b"1")
+    (root / "Dockerfile").write_text("FROM python:3.10\n")
+    (root / "pyproject.toml").write_text("[tool.poetry]\n")
+    return root
+
+
+def test_content_tag_tracks_image_sources(run_path: Path) -> None:
+    root = str(_image_sources(run_path / "tools"))
+    tag = containers.content_tag(root)
+    assert re.match("^content-[0-9a-f]{16}$", tag)
+    assert containers.content_tag(root) == tag
+    # bytecode and files that aren't copied into the image don't matter
+    (run_path / "tools" / "builder" / "__pycache__" / "x.pyc").write_bytes(b"2")
+    (run_path / "tools" / "notes.txt").write_text("notes")
+    assert containers.content_tag(root) == tag
+    (run_path / "tools" / "builder" / "__init__.py").write_text("__version__ = '2'\n")
+    assert containers.content_tag(root) != tag
+
+
+def test_prep_container_reuses_local_image(
+    run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    root = str(_image_sources(run_path / "tools"))
+    content_image = containers._container_image_content(root)
+    local = {content_image: "sha256:abc"}
+    monkeypatch.setattr(containers, "local_image", local.get)
+
+    def no_docker(*args: Any, **kwargs: Any) -> str:
+        raise AssertionError("should not pull or build")
+
+    monkeypatch.setattr(containers, "pull_container", no_docker)
+    monkeypatch.setattr(containers, "build_container", no_docker)
+    assert containers.prep_container(root, cast(io.TextIOBase, StringIO())) == (
+        content_image
+    )
+
+
+def test_prep_container_force_build_ignores_local_image(
+    run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    root = str(_image_sources(run_path / "tools"))
+    content_image = containers._container_image_content(root)
+    monkeypatch.setattr(containers, "local_image", {content_image: "sha256:abc"}.get)
+    built: list[Any] = []
+
+    def fake_build(*args: Any, **kwargs: Any) -> str:
+        built.append(args)
+        return str(args[2])
+
+    monkeypatch.setattr(containers, "build_container", fake_build)
+    assert (
+        containers.prep_container(
+            root, cast(io.TextIOBase, StringIO()), force_build=True
+        )
+        == content_image
+    )
+    assert len(built) == 1
+    assert content_image in containers._container_build_invoke_cmd(
+        0, 0, root, content_image
+    )
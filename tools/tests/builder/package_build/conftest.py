@@ -1,8 +1,18 @@
 import pytest
+from dataclasses import dataclass
+from functools import partial
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
 from io import StringIO
 from pathlib import Path
+from threading import Thread
 from builder.package_build.types import GlobalBuildContext, BuildPaths
-from typing import Protocol
+from typing import Any, Iterator, Protocol
+
+from ...conftest import TEST_DATA_DIR
 
 
 class PathsBuilder(Protocol):
@@ -25,3 +35,145 @@ def paths_builder(build_path: Path, dist_path: Path) -> PathsBuilder:
 @pytest.fixture
 def global_context() -> GlobalBuildContext:
     return GlobalBuildContext(StringIO(), True, Path("fake-sdk-path"))
+
+
+@dataclass
+class LocalSource:
+    """A source served by the local_http_server fixture."""
+
+    name: str
+    base_url: str
+    archive: str
+    sha256: str | None = None
+
+    def url(self) -> str:
+        return f"{self.base_url}/{self.archive}"
+
+    def archive_name(self) -> str:
+        return self.archive
+
+    def member_filter(self) -> None:
+        return None
+
+    def prettyprint(self, prefix: str = "") -> str:
+        return f"{prefix}Local source: {self.url()}"
+
+
+class _CountingHandler(SimpleHTTPRequestHandler):
+    requested: list[str]
+
+    def do_GET(self) -> None:
+        self.requested.append(self.path)
+        super().do_GET()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@dataclass
+class LocalHTTPServer:
+    base_url: str
+    requested: list[str]
+
+
+@pytest.fixture
+def local_http_server() -> Iterator[LocalHTTPServer]:
+    """A stand-in for github serving the test download archives."""
+    requested: list[str] = []
+    handler_class = type("Handler", (_CountingHandler,), {"requested": requested})
+    handler = partial(handler_class, directory=str(TEST_DATA_DIR / "download"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield LocalHTTPServer(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}",
+            requested=requested,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fake_sdk(run_path: Path) -> Path:
+    """An SDK whose environment-setup just sets a few variables."""
+    sdk = run_path / "fake-sdk"
+    (sdk / "bin").mkdir(parents=True)
+    (sdk / "environment-setup").write_text(
+        f"export PATH={sdk / 'bin'}:$PATH\n"
+        "export FAKE_SDK_ACTIVE=yes\n"
+        "export CFLAGS=-O2\n"
+        "export CC='arm-fake-gcc --sysroot=/sdk'\n"
+        "echo 'welcome to the fake sdk'\n"
+    )
+    return sdk
+
+
+@dataclass
+class FlakyHTTPServer:
+    base_url: str
+    content: bytes
+    faults: list[str]
+    #: What to do wrong with each request, in order: "drop" the connection halfway
+    #: through the body, answer "503", or "ignore-range"; anything else is served
+    #: properly
+    ranges: list[str | None]
+    #: The Range header of each request
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: FlakyHTTPServer
+
+    def do_GET(self) -> None:
+        content = self.state.content
+        requested_range = self.headers.get("Range")
+        self.state.ranges.append(requested_range)
+        fault = self.state.faults.pop(0) if self.state.faults else None
+        if fault == "503":
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        if requested_range and fault != "ignore-range":
+            start = int(requested_range.removeprefix("bytes=").split("-")[0])
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+            )
+        else:
+            self.send_response(200)
+        body = content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"flaky"')
+        self.end_headers()
+        if fault == "drop":
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def flaky_http_server() -> Iterator[FlakyHTTPServer]:
+    """A server for one file that fails in whatever ways it's told to."""
+    state = FlakyHTTPServer(
+        base_url="", content=bytes(range(256)) * 4096, faults=[], ranges=[]
+    )
+    handler_class = type("Handler", (_FlakyHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    state.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield state
+    finally:
+        server.shutdown()
+        server.server_close()
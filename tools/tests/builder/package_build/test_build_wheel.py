@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import pytest
+
+from builder.package_build import build_wheel
+from builder.package_build.report import BuildReport
+
+
+@pytest.mark.parametrize(
+    "requested,jobs,cpus,expected",
+    [
+        (None, 1, 8, 8),
+        (None, 2, 8, 4),
+        (None, 3, 8, 2),
+        (None, 16, 8, 1),
+        (2, 1, 8, 2),
+        (1, 1, 8, 1),
+        (32, 2, 8, 4),
+        (0, 1, 8, 8),
+    ],
+)
+def test_compile_parallelism(
+    requested: int | None, jobs: int, cpus: int, expected: int
+) -> None:
+    assert build_wheel.compile_parallelism(requested, jobs, cpus) == expected
+
+
+def test_build_ext_gets_parallel() -> None:
+    paths = (Path("/src"), Path("/build"), Path("/dist"))
+    assert "--parallel=4" in build_wheel.args_for_command("build_ext", *paths, 4)
+    assert not any(
+        arg.startswith("--parallel")
+        for arg in build_wheel.args_for_command("build_ext", *paths, 1)
+    )
+    assert build_wheel.parallel_build_environment(4)["MAKEFLAGS"] == "-j4"
+
+
+def test_single_command_line_shares_build_directories() -> None:
+    command_line = build_wheel.setup_py_command_line(
+        ["build_ext", "bdist_wheel"],
+        Path("/src"),
+        Path("/build"),
+        Path("/dist"),
+        2,
+    )
+    assert command_line[:3] == ["python", "setup.py", "build"]
+    assert "--build-lib=/build/lib" in command_line
+    assert "--build-temp=/build/temp" in command_line
+    assert command_line.index("build_ext") < command_line.index("bdist_wheel")
+    # bdist_wheel installs somewhere other than what it packages
+    assert "--bdist-dir=/build/wheel" in command_line
+    assert command_line.count("build") == 1
+
+
+@pytest.mark.parametrize(
+    "commands",
+    [["build_ext", "build_ext", "bdist_wheel"], ["build_ext", "clean", "bdist_wheel"]],
+)
+def test_check_single_compile_rejects(commands: list[str]) -> None:
+    with pytest.raises(ValueError):
+        build_wheel.check_single_compile(commands)
+
+
+def test_recompiled_extensions() -> None:
+    output = (
+        "building 'pkg.a' extension\n"
+        "building 'pkg.b' extension\n"
+        "skipping 'pkg.a' extension (up-to-date)\n"
+        "building 'pkg.b' extension\n"
+    )
+    assert build_wheel.recompiled_extensions(output) == ["pkg.b"]
+
+
+def test_setup_py_command_timer_splits_one_run() -> None:
+    report = BuildReport()
+    echoed: list[str] = []
+    timer = build_wheel.SetupPyCommandTimer(
+        build_wheel.setup_py_commands(["build_ext", "bdist_wheel"]), echoed.append
+    )
+    timer.echo("running build_ext")
+    with timer.timing(report, "pkg/1.0"):
+        for line in [
+            "Compiling pkg/a.pyx",
+            "running build",
+            "running build_py",
+            "running build_ext",
+            "building 'pkg.a' extension",
+            "running bdist_wheel",
+            "running build",
+            "running install",
+        ]:
+            timer.echo(line)
+    assert len(echoed) == 9
+    assert [span.name for span in report.spans] == [
+        "setup.py",
+        "setup.py build",
+        "setup.py build_ext",
+        "setup.py bdist_wheel",
+    ]
+    assert {span.package for span in report.spans} == {"pkg/1.0"}
+    assert all(
+        earlier.start <= later.start
+        for earlier, later in zip(report.spans, report.spans[1:])
+    )
@@ -0,0 +1,72 @@
+from pathlib import Path
+import shutil
+
+import pytest
+
+from builder.package_build.compiler_cache import (
+    CompilerCache,
+    compiler_cache_for,
+    read_stats_log,
+)
+from builder.package_build.shell_environment import SDKSnapshotEnvironment
+
+
+@pytest.fixture
+def compiler_cache(run_path: Path) -> CompilerCache:
+    return CompilerCache(
+        run_path / "ccache", run_path / "build", run_path / "stats.log", "ccache"
+    )
+
+
+def test_wrap(compiler_cache: CompilerCache) -> None:
+    assert compiler_cache.wrap("arm-gcc -O2") == "ccache arm-gcc -O2"
+    assert compiler_cache.wrap("ccache arm-gcc") == "ccache arm-gcc"
+    assert compiler_cache.wrap("") == ""
+
+
+def test_read_stats_log(run_path: Path) -> None:
+    stats_log = run_path / "stats.log"
+    assert read_stats_log(stats_log) == {}
+    stats_log.write_text(
+        "# /build/src/a.c\n"
+        "direct_cache_hit\n"
+        "# /build/src/b.c\n"
+        "preprocessed_cache_hit\n"
+        "# /build/src/c.c\n"
+        "cache_miss\n"
+        "# /build/lib.so\n"
+        "called_for_link\n"
+    )
+    stats = read_stats_log(stats_log)
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["uncacheable"] == 1
+    assert stats["direct_cache_hit"] == 1
+
+
+def test_no_compiler_cache_without_cache_root(run_path: Path) -> None:
+    assert compiler_cache_for(None, run_path, run_path / "stats.log") is None
+
+
+@pytest.mark.skipif(not shutil.which("ccache"), reason="ccache is not installed")
+def test_compiler_cache_for(run_path: Path) -> None:
+    stats_log = run_path / "stats.log"
+    stats_log.write_text("cache_miss\n")
+    compiler_cache = compiler_cache_for(run_path / "cache", run_path, stats_log)
+    assert compiler_cache
+    assert compiler_cache.cache_dir == run_path / "cache" / "ccache"
+    # stats from an earlier build don't count
+    assert not stats_log.exists()
+
+
+def test_snapshot_wraps_compilers(
+    fake_sdk: Path, run_path: Path, compiler_cache: CompilerCache
+) -> None:
+    with SDKSnapshotEnvironment.scoped(run_path, fake_sdk) as sdk_env:
+        sdk_env.initiate_python_environment(fake_sdk, compiler_cache)
+        environment = sdk_env.environment
+    assert environment["CC"] == "ccache arm-fake-gcc --sysroot=/sdk"
+    # the sdk doesn't set CXX, and it shouldn't be set to just ccache
+    assert "CXX" not in environment
+    assert environment["CCACHE_DIR"] == str(run_path / "ccache")
+    assert environment["CCACHE_STATSLOG"] == str(run_path / "stats.log")
@@ -1,13 +1,27 @@
+from dataclasses import replace
+from hashlib import sha256
+from io import StringIO
 from pathlib import Path
+from threading import Barrier, Thread
+from typing import Any
 from unittest import mock
 import os
 import tarfile
 import zipfile
 
-from builder.package_build.download import unpack_source
+import pytest
+
+from builder.package_build.download import (
+    ChecksumMismatch,
+    DownloadCache,
+    DownloadFailed,
+    DownloadManager,
+    fetch_source,
+    unpack_source,
+)
 from builder.package_build.types import GlobalBuildContext
 
-from .conftest import PathsBuilder
+from .conftest import FlakyHTTPServer, PathsBuilder, LocalHTTPServer, LocalSource
 
 
 def test_unpack_source_selects_tar_extractor(
@@ -79,3 +93,233 @@ def test_zip_unpack_happypath(
         for element_name in filenames + dirnames:
             unpacked_set.add(Path(dirpath) / element_name)
     assert file_set == unpacked_set
+
+
+def test_fetch_source_without_cache(
+    local_http_server: LocalHTTPServer,
+    downloaded_sdist_tar: Path,
+    global_context: GlobalBuildContext,
+    run_path: Path,
+) -> None:
+    source = LocalSource("test", local_http_server.base_url, downloaded_sdist_tar.name)
+    fetched = fetch_source(source, run_path, context=global_context)
+    assert fetched == run_path / downloaded_sdist_tar.name
+    assert fetched.read_bytes() == downloaded_sdist_tar.read_bytes()
+
+
+def test_fetch_source_uses_cache(
+    local_http_server: LocalHTTPServer,
+    downloaded_sdist_tar: Path,
+    global_context: GlobalBuildContext,
+    run_path: Path,
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    source = LocalSource("test", local_http_server.base_url, downloaded_sdist_tar.name)
+    first_dir = run_path / "first"
+    second_dir = run_path / "second"
+    first_dir.mkdir()
+    second_dir.mkdir()
+    first = fetch_source(source, first_dir, context=context)
+    second = fetch_source(source, second_dir, context=context)
+    assert len(local_http_server.requested) == 1
+    assert (
+        first.read_bytes() == second.read_bytes() == downloaded_sdist_tar.read_bytes()
+    )
+    # both builds share one cached copy
+    blob = (
+        run_path
+        / "cache"
+        / "downloads"
+        / "blobs"
+        / sha256(downloaded_sdist_tar.read_bytes()).hexdigest()
+    )
+    assert blob.exists()
+    assert first.stat().st_ino == second.stat().st_ino == blob.stat().st_ino
+    # nothing is left behind from downloading it, not even its lock
+    assert not list((run_path / "cache" / "downloads" / "incoming").iterdir())
+
+
+def test_concurrent_fetches_download_once(
+    local_http_server: LocalHTTPServer,
+    downloaded_sdist_tar: Path,
+    global_context: GlobalBuildContext,
+    run_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    source = LocalSource("test", local_http_server.base_url, downloaded_sdist_tar.name)
+    # both builds miss the cache before either of them fetches
+    both_missed = Barrier(2)
+    lookup = DownloadCache.lookup
+
+    def racing_lookup(self: DownloadCache, *args: Any, **kwargs: Any) -> Path | None:
+        found = lookup(self, *args, **kwargs)
+        if kwargs.get("count", True):
+            both_missed.wait(timeout=10)
+        return found
+
+    monkeypatch.setattr(DownloadCache, "lookup", racing_lookup)
+    fetched: list[Path] = []
+
+    def fetch(name: str) -> None:
+        (run_path / name).mkdir()
+        fetched.append(fetch_source(source, run_path / name, context=context))
+
+    threads = [Thread(target=fetch, args=(name,)) for name in ("first", "second")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fetched) == 2
+    assert all(
+        path.read_bytes() == downloaded_sdist_tar.read_bytes() for path in fetched
+    )
+    assert len(local_http_server.requested) == 1
+
+
+def test_download_cache_evicts_least_recently_used(
+    local_http_server: LocalHTTPServer,
+    downloaded_artifacts: list[Path],
+    run_path: Path,
+) -> None:
+    cache = DownloadCache(run_path / "cache", max_bytes=1)
+    cached = []
+    for artifact in downloaded_artifacts:
+        url = f"{local_http_server.base_url}/{artifact.name}"
+        incoming = cache.incoming_path(url)
+        incoming.write_bytes(artifact.read_bytes())
+        digest = sha256(incoming.read_bytes()).hexdigest()
+        cached.append(cache.store_file(url, incoming, digest))
+    # the newest entry is never evicted, even if it alone is over the limit
+    assert cached[-1].exists()
+    assert all(not entry.exists() for entry in cached[:-1])
+    assert (
+        cache.lookup(f"{local_http_server.base_url}/{downloaded_artifacts[0].name}")
+        is None
+    )
+
+
+@pytest.fixture
+def manager() -> DownloadManager:
+    return DownloadManager(retries=3, backoff=0.0, timeout=(5.0, 5.0))
+
+
+def test_download_resumes_after_dropped_connection(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    flaky_http_server.faults = ["drop", "drop"]
+    target = run_path / "archive.tar.gz"
+    digest = manager.download(f"{flaky_http_server.base_url}/archive", target)
+    content = flaky_http_server.content
+    assert target.read_bytes() == content
+    assert digest == sha256(content).hexdigest()
+    assert [path.name for path in run_path.iterdir()] == [target.name]
+    half = len(content) // 2
+    assert flaky_http_server.ranges == [
+        None,
+        f"bytes={half}-",
+        f"bytes={half + (len(content) - half) // 2}-",
+    ]
+    assert not (run_path / "archive.tar.gz.part").exists()
+
+
+def test_download_retries_server_errors(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    flaky_http_server.faults = ["503", "503"]
+    target = run_path / "archive.tar.gz"
+    manager.download(f"{flaky_http_server.base_url}/archive", target)
+    assert target.read_bytes() == flaky_http_server.content
+    assert len(flaky_http_server.ranges) == 3
+
+
+def test_download_restarts_when_range_ignored(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    flaky_http_server.faults = ["drop", "ignore-range"]
+    target = run_path / "archive.tar.gz"
+    digest = manager.download(f"{flaky_http_server.base_url}/archive", target)
+    assert target.read_bytes() == flaky_http_server.content
+    assert digest == sha256(flaky_http_server.content).hexdigest()
+
+
+def test_download_resumes_earlier_partial_file(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    target = run_path / "archive.tar.gz"
+    (run_path / "archive.tar.gz.part").write_bytes(flaky_http_server.content[:1000])
+    (run_path / "archive.tar.gz.part.validator").write_text('"flaky"')
+    digest = manager.download(f"{flaky_http_server.base_url}/archive", target)
+    assert flaky_http_server.ranges == ["bytes=1000-"]
+    assert digest == sha256(flaky_http_server.content).hexdigest()
+
+
+def test_download_gives_up(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    flaky_http_server.faults = ["503"] * 10
+    with pytest.raises(DownloadFailed, match="4 attempts"):
+        manager.download(
+            f"{flaky_http_server.base_url}/archive", run_path / "archive.tar.gz"
+        )
+    assert len(flaky_http_server.ranges) == 4
+
+
+def test_download_does_not_retry_missing_files(
+    local_http_server: LocalHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    with pytest.raises(DownloadFailed, match="404"):
+        manager.download(f"{local_http_server.base_url}/nope.tar.gz", run_path / "x")
+    assert len(local_http_server.requested) == 1
+
+
+def test_download_checks_pinned_sha256(
+    flaky_http_server: FlakyHTTPServer, manager: DownloadManager, run_path: Path
+) -> None:
+    flaky_http_server.faults = ["drop"]
+    url = f"{flaky_http_server.base_url}/archive"
+    target = run_path / "archive.tar.gz"
+    digest = sha256(flaky_http_server.content).hexdigest()
+    assert manager.download(url, target, expected_sha256=digest.upper()) == digest
+    target.unlink()
+    with pytest.raises(ChecksumMismatch):
+        manager.download(url, target, expected_sha256="0" * 64)
+    assert not target.exists()
+    assert not (run_path / "archive.tar.gz.part").exists()
+
+
+def test_fetch_pinned_source_uses_cache_without_network(
+    local_http_server: LocalHTTPServer,
+    downloaded_sdist_tar: Path,
+    global_context: GlobalBuildContext,
+    run_path: Path,
+) -> None:
+    context = replace(global_context, cache_root=run_path / "cache")
+    digest = sha256(downloaded_sdist_tar.read_bytes()).hexdigest()
+    source = LocalSource(
+        "test", local_http_server.base_url, downloaded_sdist_tar.name, sha256=digest
+    )
+    for directory in ("first", "second"):
+        (run_path / directory).mkdir()
+        fetched = fetch_source(source, run_path / directory, context=context)
+        assert fetched.read_bytes() == downloaded_sdist_tar.read_bytes()
+    assert len(local_http_server.requested) == 1
+    # a different pin doesn't trust what's cached for the url
+    wrong = replace(source, sha256="0" * 64)
+    (run_path / "third").mkdir()
+    with pytest.raises(ChecksumMismatch):
+        fetch_source(wrong, run_path / "third", context=context)
+    assert len(local_http_server.requested) == 2
+
+
+def test_unpinned_fetch_suggests_pin(
+    local_http_server: LocalHTTPServer,
+    downloaded_sdist_tar: Path,
+    global_context: GlobalBuildContext,
+    run_path: Path,
+) -> None:
+    output = StringIO()
+    source = LocalSource("test", local_http_server.base_url, downloaded_sdist_tar.name)
+    fetch_source(source, run_path, context=replace(global_context, output=output))
+    digest = sha256(downloaded_sdist_tar.read_bytes()).hexdigest()
+    assert f"sha256='{digest}'" in output.getvalue()
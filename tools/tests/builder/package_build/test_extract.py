@@ -0,0 +1,230 @@
+from io import BytesIO
+from pathlib import Path
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from builder.package_build.extract import (
+    DEFAULT_EXCLUDE,
+    MemberFilter,
+    UnsafeArchiveMember,
+    extract_tar,
+    extract_zip,
+)
+
+
+def _tar(path: Path, members: list[tuple[str, str, str]]) -> Path:
+    """Make a tar from (name, type, contents or link target)."""
+    with tarfile.open(path, "w:gz") as tf:
+        for name, kind, data in members:
+            info = tarfile.TarInfo(name)
+            info.mtime = 1_000_000
+            if kind == "file":
+                info.size = len(data.encode())
+                info.mode = 0o755 if name.endswith(".sh") else 0o644
+                tf.addfile(info, BytesIO(data.encode()))
+                continue
+            if kind == "dir":
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+            elif kind == "symlink":
+                info.type = tarfile.SYMTYPE
+                info.linkname = data
+            elif kind == "hardlink":
+                info.type = tarfile.LNKTYPE
+                info.linkname = data
+            elif kind == "fifo":
+                info.type = tarfile.FIFOTYPE
+            tf.addfile(info)
+    return path
+
+
+def test_extract_tar(run_path: Path) -> None:
+    archive = _tar(
+        run_path / "pkg.tar.gz",
+        [
+            ("pkg-1.0", "dir", ""),
+            ("pkg-1.0/setup.py", "file", "setup()"),
+            ("pkg-1.0/configure.sh", "file", "#!/bin/sh"),
+            ("pkg-1.0/src/module.c", "file", "int main;"),
+            ("pkg-1.0/link.c", "symlink", "src/module.c"),
+            ("pkg-1.0/srclink", "symlink", "src"),
+            ("pkg-1.0/srclink/other.c", "file", "int other;"),
+            ("pkg-1.0/hard.c", "hardlink", "pkg-1.0/src/module.c"),
+        ],
+    )
+    dest = run_path / "unpack"
+    assert extract_tar(dest, archive, Path(".")) == dest / "pkg-1.0"
+    root = dest / "pkg-1.0"
+    assert (root / "setup.py").read_text() == "setup()"
+    assert os.access(root / "configure.sh", os.X_OK)
+    assert (root / "link.c").is_symlink()
+    assert (root / "link.c").read_text() == "int main;"
+    assert (root / "src" / "other.c").read_text() == "int other;"
+    assert (root / "hard.c").stat().st_ino == (root / "src" / "module.c").stat().st_ino
+    assert (root / "setup.py").stat().st_mtime == 1_000_000
+
+
+def test_extract_tar_subpath(run_path: Path) -> None:
+    archive = _tar(
+        run_path / "repo.tar.gz",
+        [
+            ("repo/README", "file", "hi"),
+            ("repo/python/setup.py", "file", "setup()"),
+            ("repo/python/pkg/__init__.py", "file", ""),
+        ],
+    )
+    dest = run_path / "unpack"
+    assert extract_tar(dest, archive, Path("repo/python")) == dest / "repo" / "python"
+    assert not (dest / "repo" / "README").exists()
+    assert (dest / "repo" / "python" / "setup.py").exists()
+
+
+@pytest.mark.parametrize(
+    "members",
+    [
+        [("../evil", "file", "x")],
+        [("pkg/../../evil", "file", "x")],
+        [("/etc/evil", "file", "x")],
+        [("pkg/link", "symlink", "../../outside")],
+        [("pkg/link", "symlink", "/etc")],
+        [("pkg/hard", "hardlink", "../outside")],
+        [("pkg/fifo", "fifo", "")],
+    ],
+)
+def test_extract_tar_rejects_unsafe_members(
+    run_path: Path, members: list[tuple[str, str, str]]
+) -> None:
+    archive = _tar(run_path / "evil.tar.gz", members)
+    with pytest.raises(UnsafeArchiveMember):
+        extract_tar(run_path / "unpack", archive, Path("."))
+    assert not (run_path / "evil").exists()
+    assert not (run_path / "outside").exists()
+
+
+@pytest.mark.parametrize(
+    "members",
+    [
+        # each link is inside on its own, but together they lead out
+        [
+            ("pkg/d", "symlink", ".."),
+            ("pkg/s", "symlink", "d/.."),
+            ("pkg/h", "hardlink", "pkg/s/secret.txt"),
+        ],
+        # a later link changes where an earlier one leads
+        [
+            ("pkg/s", "symlink", "x/../.."),
+            ("pkg/x", "symlink", ".."),
+            ("pkg/h", "hardlink", "pkg/s/secret.txt"),
+        ],
+    ],
+)
+def test_extract_tar_rejects_chained_links(
+    run_path: Path, members: list[tuple[str, str, str]]
+) -> None:
+    (run_path / "secret.txt").write_text("secret")
+    archive = _tar(run_path / "evil.tar.gz", members)
+    dest = run_path / "unpack"
+    with pytest.raises(UnsafeArchiveMember):
+        extract_tar(dest, archive, Path("."))
+    assert not (dest / "pkg" / "h").exists()
+    assert not (dest / "pkg" / "s").is_symlink()
+
+
+def test_extract_zip(run_path: Path) -> None:
+    archive = run_path / "pkg.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("pkg-1.0/", "")
+        zf.writestr("pkg-1.0/setup.py", "setup()")
+        executable = zipfile.ZipInfo("pkg-1.0/configure")
+        executable.external_attr = 0o100755 << 16
+        zf.writestr(executable, "#!/bin/sh")
+        for index in range(200):
+            zf.writestr(f"pkg-1.0/src/file{index}.c", f"int x{index};")
+    dest = run_path / "unpack"
+    assert extract_zip(dest, archive, Path(".")) == dest / "pkg-1.0"
+    assert (dest / "pkg-1.0" / "setup.py").read_text() == "setup()"
+    assert os.access(dest / "pkg-1.0" / "configure", os.X_OK)
+    assert len(list((dest / "pkg-1.0" / "src").iterdir())) == 200
+    assert (dest / "pkg-1.0" / "src" / "file199.c").read_text() == "int x199;"
+
+
+def test_extract_zip_rejects_traversal(run_path: Path) -> None:
+    archive = run_path / "evil.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("../evil", "x")
+    with pytest.raises(UnsafeArchiveMember):
+        extract_zip(run_path / "unpack", archive, Path("."))
+    assert not (run_path / "evil").exists()
+
+
+@pytest.mark.parametrize(
+    "relative,wanted",
+    [
+        ("", True),
+        ("setup.py", True),
+        ("pandas/core/frame.py", True),
+        ("pandas/tests", False),
+        ("pandas/tests/frame/test_api.py", False),
+        ("pandas/testsuite.py", True),
+        ("docs/index.rst", False),
+        ("pandas/docs/index.rst", True),
+        (".github/workflows/ci.yml", False),
+        ("pandas/.github/x", False),
+        ("examples/intro.ipynb", False),
+        ("pandas/_libs/src/parser.c", True),
+    ],
+)
+def test_member_filter(relative: str, wanted: bool) -> None:
+    member_filter = MemberFilter(exclude=[*DEFAULT_EXCLUDE, "pandas/tests"])
+    assert member_filter.wanted(relative) == wanted
+
+
+def test_member_filter_include() -> None:
+    member_filter = MemberFilter(
+        include=["setup.py", "src/**/*.c"], exclude=["*_test.c"]
+    )
+    assert member_filter.wanted("setup.py")
+    assert member_filter.wanted("src/lib/parser.c")
+    assert not member_filter.wanted("src/lib/parser_test.c")
+    assert not member_filter.wanted("src/lib/parser.h")
+    assert not member_filter.wanted("README.md")
+
+
+def test_extract_filtered(run_path: Path) -> None:
+    archive = _tar(
+        run_path / "pkg.tar.gz",
+        [
+            ("pkg-1.0/setup.py", "file", "setup()"),
+            ("pkg-1.0/pkg/__init__.py", "file", ""),
+            ("pkg-1.0/pkg/tests/test_it.py", "file", ""),
+            ("pkg-1.0/pkg/tests/data.csv", "file", "a,b"),
+            ("pkg-1.0/pkg/data.csv", "hardlink", "pkg-1.0/pkg/tests/data.csv"),
+            ("pkg-1.0/docs/index.rst", "file", "docs"),
+        ],
+    )
+    dest = run_path / "unpack"
+    member_filter = MemberFilter(exclude=[*DEFAULT_EXCLUDE, "pkg/tests"])
+    assert (
+        extract_tar(dest, archive, Path("."), member_filter=member_filter)
+        == dest / "pkg-1.0"
+    )
+    root = dest / "pkg-1.0"
+    assert (root / "setup.py").exists()
+    assert (root / "pkg" / "__init__.py").exists()
+    assert not (root / "pkg" / "tests").exists()
+    assert not (root / "pkg" / "data.csv").exists()
+    assert not (root / "docs").exists()
+
+    zipped = run_path / "pkg.zip"
+    with zipfile.ZipFile(zipped, "w") as zf:
+        zf.writestr("pkg-1.0/setup.py", "setup()")
+        zf.writestr("pkg-1.0/pkg/tests/test_it.py", "")
+        zf.writestr("pkg-1.0/.github/workflows/ci.yml", "")
+    zip_dest = run_path / "unzip"
+    extract_zip(zip_dest, zipped, Path("."), member_filter=member_filter)
+    assert (zip_dest / "pkg-1.0" / "setup.py").exists()
+    assert not (zip_dest / "pkg-1.0" / "pkg").exists()
+    assert not (zip_dest / "pkg-1.0" / ".github").exists()
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import pytest
+
+from builder.package_build import fingerprint
+from builder.package_build.types import GithubDevSource, GithubReleaseSDistSource
+
+
+@pytest.fixture
+def build_file(run_path: Path) -> Path:
+    build_py = run_path / "packages" / "pkg" / "1.0" / "build.py"
+    build_py.parent.mkdir(parents=True)
+    build_py.write_text("print('building')\n")
+    return build_py
+
+
+@pytest.fixture
+def source() -> GithubReleaseSDistSource:
+    return GithubReleaseSDistSource(
+        name="pkg", org="org", repo="pkg", tag="v1.0", package_name="pkg-1.0.tar.gz"
+    )
+
+
+def _fingerprint(
+    build_file: Path,
+    source: GithubReleaseSDistSource | GithubDevSource,
+    deps: list[str] | None = None,
+) -> str:
+    return fingerprint.package_fingerprint(
+        build_file, source, ["bdist_wheel"], deps or [], Path("fake-sdk-path")
+    )
+
+
+def test_fingerprint_is_stable(
+    build_file: Path, source: GithubReleaseSDistSource
+) -> None:
+    assert _fingerprint(build_file, source) == _fingerprint(build_file, source)
+
+
+def test_fingerprint_tracks_inputs(
+    build_file: Path, source: GithubReleaseSDistSource
+) -> None:
+    original = _fingerprint(build_file, source)
+    assert _fingerprint(build_file, source, ["numpy"]) != original
+    other_source = GithubDevSource(name="pkg", org="org", repo="pkg", tag="v1.0")
+    assert _fingerprint(build_file, other_source) != original
+    build_file.write_text("print('building differently')\n")
+    assert _fingerprint(build_file, source) != original
+
+
+def test_up_to_date_wheel(run_path: Path) -> None:
+    dist_path = run_path / "dist"
+    dist_path.mkdir()
+    wheel = dist_path / "pkg-1.0-cp310-cp310-linux_armv7l.whl"
+    assert fingerprint.up_to_date_wheel(dist_path, "abc") is None
+    fingerprint.write_manifest(dist_path, "abc", wheel)
+    # the manifest is no good if the wheel isn't there
+    assert fingerprint.up_to_date_wheel(dist_path, "abc") is None
+    wheel.write_bytes(b"wheel")
+    assert fingerprint.up_to_date_wheel(dist_path, "abc") == wheel
+    assert fingerprint.up_to_date_wheel(dist_path, "def") is None
+
+
+def test_fingerprint_tracks_dependency_lock(
+    build_file: Path, source: GithubReleaseSDistSource
+) -> None:
+    lock = build_file.parent / "build-dependencies.lock"
+
+    def with_lock() -> str:
+        return fingerprint.package_fingerprint(
+            build_file, source, ["bdist_wheel"], [], Path("fake-sdk-path"), lock
+        )
+
+    unlocked = with_lock()
+    lock.write_text("wheel==0.41.0 --hash=sha256:" + "0" * 64 + "\n")
+    locked = with_lock()
+    assert locked != unlocked
+    lock.write_text("wheel==0.42.0 --hash=sha256:" + "1" * 64 + "\n")
+    assert with_lock() != locked
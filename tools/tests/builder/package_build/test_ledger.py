@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from builder.package_build import ledger
+from builder.package_build.report import BuildReport, PACKAGE, PHASE
+
+
+def test_record_and_history(build_path: Path) -> None:
+    build_ledger = ledger.BuildLedger.in_build_root(build_path)
+    build_ledger.record(
+        ledger.BuildRecord(
+            "pkg/1.0",
+            10.0,
+            ledger.BUILT,
+            finished=1.0,
+            fingerprint="abc",
+            wheel_size=1234,
+            phases={"fetch": 1.0, "setup.py bdist_wheel": 8.0},
+        )
+    )
+    build_ledger.record(
+        ledger.BuildRecord("pkg/1.0", 0.1, ledger.UP_TO_DATE, finished=2.0)
+    )
+    history = build_ledger.history("pkg/1.0")
+    assert [record.result for record in history] == [ledger.UP_TO_DATE, ledger.BUILT]
+    assert history[1].fingerprint == "abc"
+    assert history[1].wheel_size == 1234
+    assert history[1].phases == {"fetch": 1.0, "setup.py bdist_wheel": 8.0}
+    assert build_ledger.history("other/1.0") == []
+
+
+def test_expected_durations_ignore_skipped_and_failed(build_path: Path) -> None:
+    build_ledger = ledger.BuildLedger.in_build_root(build_path)
+    for finished, (duration, result) in enumerate(
+        [
+            (100.0, ledger.BUILT),
+            (120.0, ledger.BUILT),
+            (300.0, ledger.BUILT),
+            (0.1, ledger.UP_TO_DATE),
+            (5.0, ledger.FAILED),
+        ]
+    ):
+        build_ledger.record(
+            ledger.BuildRecord("pkg/1.0", duration, result, finished=finished)
+        )
+    assert build_ledger.expected_durations(["pkg/1.0", "new/1.0"]) == {"pkg/1.0": 120.0}
+
+
+def test_record_from_report() -> None:
+    report = BuildReport()
+    with report.span("build", PACKAGE, "pkg/1.0"):
+        with report.span("fetch", PHASE, "pkg/1.0"):
+            pass
+    report.record_stats(
+        "pkg/1.0",
+        "build",
+        {"fingerprint": "abc", "wheel_size": 10, "up_to_date": True},
+    )
+    record = ledger.record_from_report("pkg/1.0", report, succeeded=True)
+    assert record.result == ledger.UP_TO_DATE
+    assert record.fingerprint == "abc"
+    assert record.wheel_size == 10
+    assert set(record.phases.keys()) == {"fetch"}
+    assert ledger.record_from_report("pkg/1.0", report, False).result == ledger.FAILED
+    assert ledger.record_from_report("other/1.0", report, True).result == ledger.BUILT
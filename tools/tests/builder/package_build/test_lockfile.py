@@ -0,0 +1,108 @@
+from hashlib import sha256
+from io import StringIO
+from pathlib import Path
+from typing import cast
+
+from builder.package_build.build_wheel import lock_build_dependencies
+from builder.package_build.lockfile import (
+    DependencyLock,
+    LockedRequirement,
+    lock_downloaded,
+)
+from builder.package_build.shell_environment import SDKShell
+from builder.package_build.types import GlobalBuildContext
+
+
+class _FakePipShell:
+    """Pretends to be an SDK shell whose pip download resolves to a fixed set."""
+
+    def __init__(self, resolves_to: dict[str, bytes]) -> None:
+        self.resolves_to = resolves_to
+        self.commands: list[list[str]] = []
+
+    def run(self, command: list[str], env: dict[str, str] | None = None) -> str:
+        self.commands.append(command)
+        if command[1:4] == ["-m", "pip", "download"]:
+            dest = Path(command[command.index("--dest") + 1])
+            for name, contents in self.resolves_to.items():
+                (dest / name).write_bytes(contents)
+        return ""
+
+    def downloads(self) -> int:
+        return sum(1 for command in self.commands if "download" in command)
+
+
+def test_locked_requirement_from_files(run_path: Path) -> None:
+    wheel = run_path / "Cython-0.29.36-cp310-cp310-manylinux_2_17_x86_64.whl"
+    wheel.write_bytes(b"a wheel")
+    sdist = run_path / "some_package-1.2.tar.gz"
+    sdist.write_bytes(b"an sdist")
+    assert LockedRequirement.from_file(wheel) == LockedRequirement(
+        "cython", "0.29.36", sha256(b"a wheel").hexdigest(), wheel.name
+    )
+    locked = LockedRequirement.from_file(sdist)
+    assert (locked.name, locked.version) == ("some-package", "1.2")
+
+
+def test_lock_round_trips(run_path: Path) -> None:
+    downloaded = run_path / "downloaded"
+    downloaded.mkdir()
+    wheelhouse = run_path / "wheelhouse"
+    wheelhouse.mkdir()
+    (downloaded / "wheel-0.41.0-py3-none-any.whl").write_bytes(b"wheel")
+    (downloaded / "numpy-1.24.4-cp310-cp310-linux_x86_64.whl").write_bytes(b"numpy")
+    lock = lock_downloaded(["wheel", "numpy>=1.19.0,<1.25"], downloaded, wheelhouse)
+    assert not list(downloaded.iterdir())
+    assert not lock.missing_from(wheelhouse)
+
+    lock_path = lock.write(run_path / "build-dependencies.lock")
+    loaded = DependencyLock.load(lock_path)
+    assert loaded is not None
+    assert loaded.matches(["numpy>=1.19.0,<1.25", "wheel"])
+    assert not loaded.matches(["numpy", "wheel"])
+    assert sorted(loaded.pins()) == sorted(lock.pins())
+    assert "numpy==1.24.4 --hash=sha256:" in lock_path.read_text()
+
+    (wheelhouse / "numpy-1.24.4-cp310-cp310-linux_x86_64.whl").unlink()
+    assert [missing.name for missing in loaded.missing_from(wheelhouse)] == ["numpy"]
+
+
+def test_bad_lock_does_not_load(run_path: Path) -> None:
+    lock_path = run_path / "build-dependencies.lock"
+    lock_path.write_text("numpy>=1.19\n")
+    assert DependencyLock.load(lock_path) is None
+    assert DependencyLock.load(run_path / "nothing-here.lock") is None
+
+
+def test_dependencies_resolve_once(run_path: Path) -> None:
+    context = GlobalBuildContext(StringIO(), True, Path("fake-sdk-path"))
+    shell = _FakePipShell({"wheel-0.41.0-py3-none-any.whl": b"wheel"})
+    lock_path = run_path / "package" / "build-dependencies.lock"
+    lock_path.parent.mkdir()
+    wheelhouse = run_path / "wheelhouse"
+
+    def lock(dependencies: list[str], context: GlobalBuildContext) -> list[str]:
+        return lock_build_dependencies(
+            cast(SDKShell, shell),
+            run_path / "venv",
+            dependencies,
+            lock_path,
+            wheelhouse,
+            context=context,
+        ).pins()
+
+    pins = lock(["wheel"], context)
+    assert shell.downloads() == 1
+    assert (wheelhouse / "wheel-0.41.0-py3-none-any.whl").is_file()
+    assert not [path for path in wheelhouse.iterdir() if path.name.startswith(".")]
+
+    assert lock(["wheel"], context) == pins
+    assert shell.downloads() == 1
+
+    # changing the dependencies in build.py makes the lock stale
+    lock(["wheel", "Cython<3"], context)
+    assert shell.downloads() == 2
+
+    context.refresh_locks = True
+    lock(["wheel", "Cython<3"], context)
+    assert shell.downloads() == 3
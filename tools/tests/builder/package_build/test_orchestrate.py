@@ -0,0 +1,110 @@
+from pathlib import Path
+from io import StringIO
+
+import pytest
+
+from builder.package_build import orchestrate
+from builder.package_build.ledger import BUILT, FAILED, BuildLedger, BuildRecord
+from builder.package_build.types import GlobalBuildContext
+
+
+def _write_package(package_root: Path, name: str, version: str, body: str) -> Path:
+    package_dir = package_root / name / version
+    package_dir.mkdir(parents=True)
+    (package_dir / "build.py").write_text(body)
+    return package_dir
+
+
+_SUCCEEDS = (
+    "paths = opentrons_package_build_context.paths\n"
+    "paths.dist_path.mkdir(parents=True, exist_ok=True)\n"
+    "(paths.dist_path / 'built').write_text('yes')\n"
+)
+
+_FAILS = "raise RuntimeError('this package is broken')\n"
+
+
+@pytest.fixture
+def package_root(run_path: Path) -> Path:
+    root = run_path / "packages"
+    _write_package(root, "good", "1.0.0", _SUCCEEDS)
+    _write_package(root, "alsogood", "2.0.0", _SUCCEEDS)
+    _write_package(root, "bad", "0.1.0", _FAILS)
+    return root
+
+
+def test_parallel_build_summarizes_results(
+    package_root: Path, build_path: Path, run_path: Path
+) -> None:
+    output = StringIO()
+    context = GlobalBuildContext(output, False, Path("fake-sdk-path"), jobs=2)
+    dist_root = run_path / "dist-out"
+    results = {
+        result.paths.label(): result
+        for result in orchestrate.discover_build_packages(
+            package_root, build_path, dist_root, context=context
+        )
+    }
+    assert set(results.keys()) == {"good/1.0.0", "alsogood/2.0.0", "bad/0.1.0"}
+    assert results["good/1.0.0"].succeeded
+    assert results["alsogood/2.0.0"].succeeded
+    assert not results["bad/0.1.0"].succeeded
+    assert "this package is broken" in (results["bad/0.1.0"].error or "")
+    assert (dist_root / "good" / "1.0.0" / "built").exists()
+    for result in results.values():
+        assert result.log_path and result.log_path.exists()
+    bad_log = results["bad/0.1.0"].log_path
+    assert bad_log and "this package is broken" in bad_log.read_text()
+    # timing from the workers ends up in the global report
+    assert set(context.report.package_durations().keys()) == set(results.keys())
+
+
+def test_parallel_build_sync_raises_on_failure(
+    package_root: Path, build_path: Path, run_path: Path
+) -> None:
+    output = StringIO()
+    context = GlobalBuildContext(output, False, Path("fake-sdk-path"), jobs=3)
+    with pytest.raises(RuntimeError, match="bad/0.1.0"):
+        orchestrate.discover_build_packages_sync(
+            package_root, build_path, run_path / "dist-out", context=context
+        )
+    assert "2 succeeded, 1 failed" in output.getvalue()
+
+
+def test_serial_build_propagates_failure(
+    package_root: Path, build_path: Path, run_path: Path
+) -> None:
+    context = GlobalBuildContext(StringIO(), False, Path("fake-sdk-path"))
+    with pytest.raises(RuntimeError, match="this package is broken"):
+        orchestrate.discover_build_packages_sync(
+            package_root, build_path, run_path / "dist-out", context=context
+        )
+
+
+def test_builds_recorded_and_scheduled_longest_first(
+    package_root: Path, build_path: Path, run_path: Path
+) -> None:
+    build_ledger = BuildLedger.in_build_root(build_path)
+    build_ledger.record(BuildRecord("good/1.0.0", 10.0, BUILT))
+    build_ledger.record(BuildRecord("alsogood/2.0.0", 100.0, BUILT))
+    output = StringIO()
+    context = GlobalBuildContext(output, False, Path("fake-sdk-path"))
+    with pytest.raises(RuntimeError):
+        list(
+            orchestrate.discover_build_packages(
+                package_root, build_path, run_path / "dist-out", context=context
+            )
+        )
+    # the package with no history goes first, and fails
+    assert [record.result for record in build_ledger.history("bad/0.1.0")] == [FAILED]
+    assert "Expected build time 110s with 1 jobs" in output.getvalue()
+    context = GlobalBuildContext(StringIO(), False, Path("fake-sdk-path"), jobs=2)
+    results = [
+        result.paths.label()
+        for result in orchestrate.discover_build_packages(
+            package_root, build_path, run_path / "dist-out", context=context
+        )
+    ]
+    assert set(results) == {"good/1.0.0", "alsogood/2.0.0", "bad/0.1.0"}
+    assert len(build_ledger.history("good/1.0.0")) == 2
+    assert len(build_ledger.history("bad/0.1.0")) == 2
@@ -0,0 +1,173 @@
+from io import StringIO
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Any
+import time
+
+import pytest
+
+from builder.package_build import build_wheel, download, orchestrate
+from builder.package_build.pipeline import COMPILE, Pipeline, StageLimits
+from builder.package_build.types import GlobalBuildContext
+
+from .conftest import LocalHTTPServer
+
+
+def test_stage_limits_concurrency() -> None:
+    pipeline = Pipeline(StageLimits(fetch=2))
+    lock = Lock()
+    active = 0
+    most_active = 0
+
+    def fetch() -> None:
+        nonlocal active, most_active
+        with pipeline.stage("fetch"):
+            with lock:
+                active += 1
+                most_active = max(most_active, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+
+    threads = [Thread(target=fetch) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert most_active == 2
+
+
+def test_stage_without_pipeline_does_not_wait() -> None:
+    context = GlobalBuildContext(StringIO(), False, Path("fake-sdk-path"))
+    with context.stage(COMPILE), context.stage(COMPILE):
+        pass
+
+
+class _Timeline:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.events: list[tuple[float, str, str]] = []
+        self.compiling = 0
+        self.most_compiling = 0
+        self.parallel: dict[str, int] = {}
+
+    def add(self, package: str, event: str) -> None:
+        with self.lock:
+            self.events.append((time.monotonic(), package, event))
+
+    def first(self, event: str) -> float:
+        return min(when for when, _, name in self.events if name == event)
+
+    def all(self, event: str) -> list[float]:
+        return [when for when, _, name in self.events if name == event]
+
+
+_BUILD_PY = (
+    "from tests.builder.package_build.conftest import LocalSource\n"
+    "build_package(\n"
+    "    source=LocalSource({name!r}, {base_url!r}, 'some-test-tar.tar.gz'),\n"
+    "    setup_py_commands=['bdist_wheel'],\n"
+    ")\n"
+)
+
+
+@pytest.fixture
+def timeline(monkeypatch: pytest.MonkeyPatch) -> _Timeline:
+    timeline = _Timeline()
+    unpack_source = download.unpack_source
+
+    def recording_unpack(
+        *args: Any, context: GlobalBuildContext, **kwargs: Any
+    ) -> Path:
+        unpacked = unpack_source(*args, context=context, **kwargs)
+        timeline.add(str(args[0]), "unpacked")
+        return unpacked
+
+    def fake_build(
+        commands: list[str],
+        source_dir: Path,
+        build_dir: Path,
+        dist_dir: Path,
+        venv_dir: Path,
+        build_dependencies: list[str],
+        *,
+        context: GlobalBuildContext,
+        package: str | None = None,
+        parallel: int = 1,
+        lock_path: Path | None = None,
+    ) -> Path:
+        with context.stage(COMPILE):
+            with timeline.lock:
+                timeline.compiling += 1
+                timeline.most_compiling = max(
+                    timeline.most_compiling, timeline.compiling
+                )
+            timeline.add(str(package), "compile started")
+            timeline.parallel[str(package)] = parallel
+            time.sleep(0.3)
+            timeline.add(str(package), "compile finished")
+            with timeline.lock:
+                timeline.compiling -= 1
+        wheel = dist_dir / f"{str(package).replace('/', '-')}-py3-none-any.whl"
+        wheel.write_bytes(b"wheel")
+        return wheel
+
+    monkeypatch.setattr(orchestrate, "unpack_source", recording_unpack)
+    monkeypatch.setattr(orchestrate, "build_with_setup_py", fake_build)
+    return timeline
+
+
+def _write_packages(package_root: Path, base_url: str, count: int) -> None:
+    for index in range(count):
+        package_dir = package_root / f"pkg{index}" / "1.0"
+        package_dir.mkdir(parents=True)
+        (package_dir / "build.py").write_text(
+            _BUILD_PY.format(name=f"pkg{index}", base_url=base_url)
+        )
+
+
+def test_pipeline_fetches_while_compiling(
+    local_http_server: LocalHTTPServer,
+    fake_sdk: Path,
+    timeline: _Timeline,
+    build_path: Path,
+    run_path: Path,
+) -> None:
+    package_root = run_path / "packages"
+    _write_packages(package_root, local_http_server.base_url, 4)
+    context = GlobalBuildContext(StringIO(), False, fake_sdk, jobs=2)
+    results = list(
+        orchestrate.discover_build_packages(
+            package_root, build_path, run_path / "dist-out", context=context
+        )
+    )
+    assert all(result.succeeded for result in results), [
+        result.error for result in results
+    ]
+    assert len(local_http_server.requested) == 4
+    assert timeline.most_compiling == 2
+    # the packages waiting for a compile slot had their sources ready before the
+    # first compiles finished
+    assert max(timeline.all("unpacked")) < timeline.first("compile finished")
+
+
+def test_concurrent_builds_share_the_cpus(
+    local_http_server: LocalHTTPServer,
+    fake_sdk: Path,
+    timeline: _Timeline,
+    build_path: Path,
+    run_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(build_wheel, "available_cpus", lambda: 16)
+    package_root = run_path / "packages"
+    _write_packages(package_root, local_http_server.base_url, 4)
+    context = GlobalBuildContext(StringIO(), False, fake_sdk, jobs=4)
+    results = list(
+        orchestrate.discover_build_packages(
+            package_root, build_path, run_path / "dist-out", context=context
+        )
+    )
+    assert all(result.succeeded for result in results)
+    # 4 packages compile at once, so none of them gets more than a quarter
+    assert timeline.parallel == {f"pkg{index}/1.0": 4 for index in range(4)}
@@ -0,0 +1,66 @@
+from pathlib import Path
+import json
+
+import pytest
+
+from builder.package_build.report import BuildReport, COMMAND, PACKAGE, PHASE
+
+
+@pytest.fixture
+def report() -> BuildReport:
+    report = BuildReport()
+    with report.span("build", PACKAGE, "pkg/1.0"):
+        with report.span("fetch", PHASE, "pkg/1.0"):
+            pass
+        with report.span("python setup.py", COMMAND, "pkg/1.0", command="a b c"):
+            pass
+        with pytest.raises(RuntimeError):
+            with report.span("setup.py bdist_wheel", PHASE, "pkg/1.0"):
+                raise RuntimeError("nope")
+    report.record_stats("pkg/1.0", "ccache", {"hits": 3})
+    return report
+
+
+def test_spans_recorded(report: BuildReport) -> None:
+    assert [span.name for span in report.spans] == [
+        "fetch",
+        "python setup.py",
+        "setup.py bdist_wheel",
+        "build",
+    ]
+    assert report.spans[2].args["failed"] == "RuntimeError"
+    assert set(report.phase_durations("pkg/1.0").keys()) == {
+        "fetch",
+        "setup.py bdist_wheel",
+    }
+    assert "pkg/1.0" in report.package_durations()
+    assert "pkg/1.0" in report.summary()
+
+
+def test_extend(report: BuildReport) -> None:
+    combined = BuildReport()
+    combined.extend(report)
+    assert combined.spans == report.spans
+    assert combined.stats == {"pkg/1.0": {"ccache": {"hits": 3}}}
+
+
+def test_write_json(report: BuildReport, run_path: Path) -> None:
+    written = json.loads(report.write_json(run_path / "report.json").read_text())
+    assert written["packages"]["pkg/1.0"]["stats"] == {"ccache": {"hits": 3}}
+    assert set(written["packages"]["pkg/1.0"]["phases"].keys()) == {
+        "fetch",
+        "setup.py bdist_wheel",
+    }
+    assert len(written["spans"]) == 4
+
+
+def test_write_chrome_trace(report: BuildReport, run_path: Path) -> None:
+    trace = json.loads(
+        report.write_chrome_trace(run_path / "trace" / "trace.json").read_text()
+    )
+    complete = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(complete) == 4
+    for event in complete:
+        assert event["dur"] >= 0
+        assert event["args"]["package"] == "pkg/1.0"
+    assert any(event["ph"] == "M" for event in trace["traceEvents"])
@@ -0,0 +1,30 @@
+import pytest
+
+from builder.package_build import schedule
+
+
+def test_longest_first_puts_unknown_first() -> None:
+    expected = {"short": 1.0, "long": 100.0, "medium": 10.0}
+    ordered = schedule.longest_first(
+        ["short", "new", "long", "medium", "alsonew"], str, expected
+    )
+    assert ordered == ["new", "alsonew", "long", "medium", "short"]
+
+
+@pytest.mark.parametrize(
+    "jobs,total",
+    [
+        (1, 116.0),
+        (2, 100.0),
+        (4, 100.0),
+    ],
+)
+def test_estimate_schedule(jobs: int, total: float) -> None:
+    expected = {"long": 100.0, "medium": 10.0, "short": 5.0, "tiny": 1.0}
+    estimate = schedule.estimate_schedule(
+        ["new", "long", "medium", "short", "tiny"], expected, jobs
+    )
+    assert estimate.total == total
+    assert estimate.critical_path == 100.0
+    assert estimate.longest == "long"
+    assert estimate.unknown == 1
@@ -0,0 +1,105 @@
+from pathlib import Path
+import json
+import os
+
+import pytest
+
+from builder.common.cache import LOOKUPS_NAME
+from builder.common.shellcommand import ShellCommandFailed
+from builder.package_build import shell_environment
+from builder.package_build.shell_environment import (
+    SDKSnapshotEnvironment,
+    SDKSubshell,
+    capture_sdk_environment,
+)
+
+
+def test_capture_sdk_environment(fake_sdk: Path, run_path: Path) -> None:
+    cache_dir = run_path / "sdk-env"
+    environment = capture_sdk_environment(fake_sdk, cache_dir)
+    assert environment["FAKE_SDK_ACTIVE"] == "yes"
+    assert environment["PATH"].startswith(str(fake_sdk / "bin"))
+    key = shell_environment.sdk_environment_key(fake_sdk)
+    assert [
+        entry.name for entry in cache_dir.iterdir() if entry.name != LOOKUPS_NAME
+    ] == [f"{key}.json"]
+    # later captures come from the saved environment without sourcing the sdk
+    shell_environment._captured_environments.clear()
+    setup_script = fake_sdk / "environment-setup"
+    setup_stat = setup_script.stat()
+    setup_script.write_text("exit 1\n")
+    os.utime(setup_script, ns=(setup_stat.st_atime_ns, setup_stat.st_mtime_ns))
+    assert capture_sdk_environment(fake_sdk, cache_dir)["FAKE_SDK_ACTIVE"] == "yes"
+
+
+def test_capture_keeps_only_sdk_changes(
+    fake_sdk: Path, run_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache_dir = run_path / "sdk-env"
+    monkeypatch.setenv("UNSET_BY_SDK", "here")
+    (fake_sdk / "environment-setup").write_text(
+        (fake_sdk / "environment-setup").read_text() + "unset UNSET_BY_SDK\n"
+    )
+    environment = capture_sdk_environment(fake_sdk, cache_dir)
+    assert "UNSET_BY_SDK" not in environment
+    assert environment["HOME"] == os.environ["HOME"]
+    key = shell_environment.sdk_environment_key(fake_sdk)
+    saved = json.loads((cache_dir / f"{key}.json").read_text())
+    assert saved == {
+        "PATH": environment["PATH"],
+        "FAKE_SDK_ACTIVE": "yes",
+        "CFLAGS": "-O2",
+        "CC": "arm-fake-gcc --sysroot=/sdk",
+        "UNSET_BY_SDK": None,
+    }
+    # a different environment to source it in is captured separately
+    monkeypatch.setenv("VIRTUAL_ENV", str(run_path / "some-venv"))
+    assert shell_environment.sdk_environment_key(fake_sdk) != key
+    environment = capture_sdk_environment(fake_sdk, cache_dir)
+    assert environment["VIRTUAL_ENV"] == str(run_path / "some-venv")
+
+
+def test_capture_failure_raises(run_path: Path) -> None:
+    broken = run_path / "broken-sdk"
+    broken.mkdir()
+    (broken / "environment-setup").write_text("echo oh no >&2; exit 3\n")
+    with pytest.raises(ShellCommandFailed) as excinfo:
+        capture_sdk_environment(broken)
+    assert "oh no" in excinfo.value.output
+
+
+def test_snapshot_runs_commands(fake_sdk: Path, run_path: Path) -> None:
+    echoed: list[str] = []
+    with SDKSnapshotEnvironment.scoped(
+        run_path, fake_sdk, echo=echoed.append, echo_verbose=echoed.append
+    ) as sdk_env:
+        output = sdk_env.run(
+            ["bash", "-c", "echo $FAKE_SDK_ACTIVE $EXTRA; pwd"], env={"EXTRA": "more"}
+        )
+        assert output.splitlines() == ["yes more", str(run_path)]
+        with pytest.raises(ShellCommandFailed) as excinfo:
+            sdk_env.run(["bash", "-c", "echo failing; exit 2"])
+        assert excinfo.value.returncode == 2
+        assert "failing" in excinfo.value.output
+    assert any("FAKE_SDK_ACTIVE" in line for line in echoed)
+
+
+def test_subshell_run_sets_environment(fake_sdk: Path, run_path: Path) -> None:
+    with SDKSubshell.scoped(run_path, fake_sdk) as subshell:
+        output = subshell.run(
+            ["bash", "-c", 'echo "$FAKE_SDK_ACTIVE $EXTRA"'],
+            env={"EXTRA": "more than one word", "MAKEFLAGS": "-j4"},
+        )
+    assert "yes more than one word" in output.splitlines()
+
+
+def test_snapshot_python_environment(fake_sdk: Path, run_path: Path) -> None:
+    with SDKSnapshotEnvironment.scoped(run_path, fake_sdk) as sdk_env:
+        venv_dir = run_path / "venv"
+        sdk_env.activate_venv(venv_dir)
+        sdk_env.initiate_python_environment(fake_sdk)
+        assert sdk_env.environment["VIRTUAL_ENV"] == str(venv_dir)
+        assert sdk_env.environment["PATH"].startswith(str(venv_dir / "bin"))
+        assert sdk_env.environment["CFLAGS"].startswith("-O2 ")
+        assert "-D_GNU_SOURCE" in sdk_env.environment["CFLAGS"]
+        assert sdk_env.environment["_PYTHON_SYSCONFIGDATA_NAME"]
@@ -0,0 +1,44 @@
+from pathlib import Path
+import venv
+
+from builder.package_build.venv_cache import VenvCache
+
+
+def _make_venv(path: Path) -> Path:
+    venv.create(path, with_pip=False, symlinks=True)
+    return path
+
+
+def test_key_depends_on_dependencies_and_interpreter() -> None:
+    key = VenvCache.key(["Cython", "wheel"], "/usr/bin/python3:3.10")
+    assert key == VenvCache.key(["Cython", "wheel"], "/usr/bin/python3:3.10")
+    assert key != VenvCache.key(["Cython<3", "wheel"], "/usr/bin/python3:3.10")
+    assert key != VenvCache.key(["Cython", "wheel"], "/opt/sdk/python3:3.10")
+
+
+def test_store_and_clone(run_path: Path) -> None:
+    cache = VenvCache(run_path / "cache")
+    original = _make_venv(run_path / "first" / "venv")
+    assert cache.lookup("somekey") is None
+    entry = cache.store("somekey", original)
+    assert cache.lookup("somekey") == entry
+
+    clone = run_path / "second" / "venv"
+    clone.mkdir(parents=True)
+    cache.clone_to(entry, clone)
+    activate = (clone / "bin" / "activate").read_text()
+    assert str(clone) in activate
+    assert str(original) not in activate
+    # the cached copy is untouched by the relocation
+    assert str(original) in (entry / "bin" / "activate").read_text()
+    assert (clone / "pyvenv.cfg").stat().st_ino == (entry / "pyvenv.cfg").stat().st_ino
+    assert (clone / "bin" / "python").is_symlink()
+
+
+def test_store_evicts_old_venvs(run_path: Path) -> None:
+    cache = VenvCache(run_path / "cache", max_bytes=1)
+    first = cache.store("first", _make_venv(run_path / "first"))
+    second = cache.store("second", _make_venv(run_path / "second"))
+    assert not first.exists()
+    assert second.exists()
+    assert cache.lookup("first") is None
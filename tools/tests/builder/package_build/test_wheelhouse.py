@@ -0,0 +1,143 @@
+from pathlib import Path
+from typing import cast
+import zipfile
+
+import pytest
+
+from builder.package_build.build_wheel import prepare_venv
+from builder.package_build.lockfile import (
+    LOCK_NAME,
+    DependencyLock,
+    LockedRequirement,
+)
+from builder.package_build.shell_environment import SDKShell
+from builder.package_build import wheelhouse
+
+
+def _make_wheel(directory: Path, name: str, version: str) -> Path:
+    """A minimal but valid pure-python wheel."""
+    directory.mkdir(parents=True, exist_ok=True)
+    wheel = directory / f"{name}-{version}-py3-none-any.whl"
+    dist_info = f"{name}-{version}.dist-info"
+    with zipfile.ZipFile(wheel, "w") as archive:
+        archive.writestr(f"{name}.py", "")
+        archive.writestr(
+            f"{dist_info}/METADATA",
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n",
+        )
+        archive.writestr(
+            f"{dist_info}/WHEEL",
+            "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\n"
+            "Tag: py3-none-any\n",
+        )
+        archive.writestr(f"{dist_info}/RECORD", "")
+    return wheel
+
+
+def _lock_package(package_root: Path, label: str, wheels: list[Path]) -> Path:
+    lock_path = package_root / label / LOCK_NAME
+    lock_path.parent.mkdir(parents=True)
+    return DependencyLock(
+        [wheel.name.split("-")[0] for wheel in wheels],
+        [LockedRequirement.from_file(wheel) for wheel in wheels],
+    ).write(lock_path)
+
+
+@pytest.fixture
+def stand_in_index(run_path: Path) -> Path:
+    """A directory of wheels standing in for PyPI."""
+    index = run_path / "pypi"
+    _make_wheel(index, "buildhelper", "1.0")
+    _make_wheel(index, "otherhelper", "2.0")
+    return index
+
+
+def test_populate_downloads_locked_files(stand_in_index: Path, run_path: Path) -> None:
+    package_root = run_path / "packages"
+    _lock_package(
+        package_root, "pkg/1.0", [stand_in_index / "buildhelper-1.0-py3-none-any.whl"]
+    )
+    house = run_path / "cache" / wheelhouse.WHEELHOUSE_DIR
+    index_args = ["--no-index", "--find-links", str(stand_in_index)]
+
+    changes = wheelhouse.populate(house, package_root, None, index_args=index_args)
+    assert len(changes.changed) == 1
+    assert (house / "buildhelper-1.0-py3-none-any.whl").is_file()
+
+    # everything is there already, so there's nothing to download
+    assert not wheelhouse.populate(
+        house, package_root, None, index_args=index_args
+    ).changed
+
+
+def test_prune_keeps_only_locked_files(stand_in_index: Path, run_path: Path) -> None:
+    package_root = run_path / "packages"
+    locked = stand_in_index / "buildhelper-1.0-py3-none-any.whl"
+    _lock_package(package_root, "pkg/1.0", [locked])
+    house = run_path / "wheelhouse"
+    house.mkdir()
+    (house / locked.name).write_bytes(locked.read_bytes())
+    (house / "otherhelper-2.0-py3-none-any.whl").write_bytes(b"unpinned")
+    (house / ".resolving-abc").mkdir()
+
+    changes = wheelhouse.prune(house, package_root)
+    assert [path.name for path in house.iterdir()] == [locked.name]
+    assert len(changes.changed) == 2
+    assert changes.bytes_removed >= len(b"unpinned")
+
+
+def test_prune_does_nothing_with_unreadable_lock(run_path: Path) -> None:
+    package_root = run_path / "packages"
+    (package_root / "pkg" / "1.0").mkdir(parents=True)
+    (package_root / "pkg" / "1.0" / LOCK_NAME).write_text("garbage\n")
+    house = run_path / "wheelhouse"
+    house.mkdir()
+    (house / "something-1.0-py3-none-any.whl").write_bytes(b"maybe pinned")
+    changes = wheelhouse.prune(house, package_root)
+    assert changes.skipped
+    assert (house / "something-1.0-py3-none-any.whl").exists()
+
+
+class _RecordingShell:
+    def __init__(self) -> None:
+        self.commands: list[list[str]] = []
+
+    def run(self, command: list[str], env: dict[str, str] | None = None) -> str:
+        self.commands.append(command)
+        return ""
+
+
+def test_offline_install_needs_populated_wheelhouse(
+    stand_in_index: Path, run_path: Path
+) -> None:
+    lock_path = _lock_package(
+        run_path / "packages",
+        "pkg/1.0",
+        [stand_in_index / "buildhelper-1.0-py3-none-any.whl"],
+    )
+    house = run_path / "wheelhouse"
+    house.mkdir()
+    shell = _RecordingShell()
+    with pytest.raises(wheelhouse.MissingFromWheelhouse):
+        prepare_venv(
+            cast(SDKShell, shell),
+            run_path / "venv",
+            ["buildhelper"],
+            lock_path,
+            house,
+            offline=True,
+        )
+
+    _make_wheel(house, "buildhelper", "1.0")
+    prepare_venv(
+        cast(SDKShell, shell),
+        run_path / "venv",
+        ["buildhelper"],
+        lock_path,
+        house,
+        offline=True,
+    )
+    install = shell.commands[-1]
+    assert install[install.index("--find-links") + 1] == str(house)
+    assert "--no-index" in install
+    assert not any("download" in command for command in shell.commands)
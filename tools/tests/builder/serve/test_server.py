@@ -0,0 +1,157 @@
+from http.client import HTTPConnection, HTTPResponse
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import quote
+import gzip
+import json
+import threading
+
+import pytest
+
+from builder.generate_index import orchestrate
+from builder.serve import server
+
+
+@pytest.fixture
+def index_root(run_path: Path) -> Path:
+    root = run_path / "index"
+    package_dir = root / "simple" / "pkg"
+    package_dir.mkdir(parents=True)
+    orchestrate.write_page(root / "simple" / "index.html", "<html>root</html>")
+    orchestrate.write_page(root / "simple" / "index.json", '{"projects": []}')
+    orchestrate.write_page(package_dir / "index.html", "<html>pkg</html>")
+    (package_dir / "pkg-1.0-py3-none-any.whl").write_bytes(bytes(range(256)) * 4)
+    (run_path / "secret").write_text("nope")
+    return root
+
+
+@pytest.fixture
+def connection(index_root: Path) -> Iterator[HTTPConnection]:
+    index_server = server.IndexServer(("127.0.0.1", 0), index_root, quiet=True)
+    thread = threading.Thread(target=index_server.serve_forever, daemon=True)
+    thread.start()
+    conn = HTTPConnection("127.0.0.1", index_server.server_address[1], timeout=10)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        index_server.shutdown()
+        index_server.server_close()
+
+
+def _get(
+    conn: HTTPConnection, path: str, headers: dict[str, str] | None = None
+) -> tuple[HTTPResponse, bytes]:
+    conn.request("GET", path, headers=headers or {})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_serves_files_and_pages(connection: HTTPConnection) -> None:
+    response, body = _get(connection, "/simple/pkg/")
+    assert response.status == 200
+    assert body == b"<html>pkg</html>"
+    assert response.getheader("Content-Type") == "text/html; charset=utf-8"
+    response, body = _get(connection, "/simple/pkg/pkg-1.0-py3-none-any.whl")
+    assert response.status == 200
+    assert body == bytes(range(256)) * 4
+    assert response.getheader("Accept-Ranges") == "bytes"
+
+
+def test_redirects_directories(connection: HTTPConnection) -> None:
+    response, _ = _get(connection, "/simple/pkg")
+    assert response.status == 301
+    assert response.getheader("Location") == "/simple/pkg/"
+
+
+def test_conditional_requests(connection: HTTPConnection) -> None:
+    response, _ = _get(connection, "/simple/pkg/pkg-1.0-py3-none-any.whl")
+    etag = response.getheader("ETag")
+    assert etag
+    response, body = _get(
+        connection,
+        "/simple/pkg/pkg-1.0-py3-none-any.whl",
+        {"If-None-Match": etag},
+    )
+    assert response.status == 304
+    assert body == b""
+    response, body = _get(
+        connection,
+        "/simple/pkg/pkg-1.0-py3-none-any.whl",
+        {"If-Modified-Since": str(response.getheader("Last-Modified"))},
+    )
+    assert response.status == 304
+
+
+def test_range_requests(connection: HTTPConnection) -> None:
+    whl = "/simple/pkg/pkg-1.0-py3-none-any.whl"
+    response, body = _get(connection, whl, {"Range": "bytes=1000-"})
+    assert response.status == 206
+    assert response.getheader("Content-Range") == "bytes 1000-1023/1024"
+    assert body == bytes(range(232, 256))
+    response, body = _get(connection, whl, {"Range": "bytes=-4"})
+    assert response.status == 206
+    assert body == bytes(range(252, 256))
+    response, _ = _get(connection, whl, {"Range": "bytes=2000-"})
+    assert response.status == 416
+    assert response.getheader("Content-Range") == "bytes */1024"
+    response, body = _get(
+        connection, whl, {"Range": "bytes=0-3", "If-Range": '"stale"'}
+    )
+    assert response.status == 200
+    assert len(body) == 1024
+
+
+def test_precompressed_pages(connection: HTTPConnection) -> None:
+    response, body = _get(connection, "/simple/", {"Accept-Encoding": "gzip"})
+    assert response.status == 200
+    assert response.getheader("Content-Encoding") == "gzip"
+    assert "Accept-Encoding" in str(response.getheader("Vary"))
+    assert gzip.decompress(body) == b"<html>root</html>"
+
+
+def test_negotiates_json(connection: HTTPConnection) -> None:
+    response, body = _get(
+        connection,
+        "/simple/",
+        {
+            "Accept": f"{server.SIMPLE_JSON_TYPE}, {server.SIMPLE_HTML_TYPE};q=0.2, text/html;q=0.01"
+        },
+    )
+    assert response.status == 200
+    assert response.getheader("Content-Type") == server.SIMPLE_JSON_TYPE
+    assert json.loads(body) == {"projects": []}
+    response, body = _get(
+        connection, f"/simple/?format={quote(server.SIMPLE_JSON_TYPE)}"
+    )
+    assert json.loads(body) == {"projects": []}
+    # a leaf without a json page still gets html
+    response, body = _get(
+        connection,
+        "/simple/pkg/",
+        {"Accept": f"{server.SIMPLE_JSON_TYPE}, text/html;q=0.01"},
+    )
+    assert response.getheader("Content-Type") == "text/html; charset=utf-8"
+    response, _ = _get(connection, "/simple/pkg/", {"Accept": server.SIMPLE_JSON_TYPE})
+    assert response.status == 406
+
+
+def test_does_not_leave_root(connection: HTTPConnection) -> None:
+    response, _ = _get(connection, "/../secret")
+    assert response.status == 404
+    response, _ = _get(connection, "/simple/%2e%2e/%2e%2e/secret")
+    assert response.status == 404
+
+
+@pytest.mark.parametrize(
+    "header,size,expected",
+    [
+        ("bytes=0-9", 100, (0, 9)),
+        ("bytes=90-200", 100, (90, 99)),
+        ("bytes=-10", 100, (90, 99)),
+        ("bytes=0-1,5-6", 100, None),
+        ("items=0-1", 100, None),
+    ],
+)
+def test_parse_range(header: str, size: int, expected: tuple[int, int] | None) -> None:
+    assert server.parse_range(header, size) == expected